@@ -1,17 +1,38 @@
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Tuple
+import os
 import random
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from transformers import pipeline
+from chat_generation import StreamingGenerator, CHAT_MAX_NEW_TOKENS
+from executor import ExecutorSaturated
+from metrics import REGISTRY, span
 import logging
 
+# Streamed replies get their own pool rather than queueing behind emotion
+# analysis on the inference pool. Concurrent streams take turns step by step
+# on these workers; more workers raise streaming throughput but each forward
+# pass then shares the CPU cores with the others
+CHAT_GENERATION_WORKERS = int(os.environ.get("EMOTIONBANK_CHAT_GENERATION_WORKERS", "1"))
+# Retrieval is emotion-preferred rather than emotion-filtered: fetch a few
+# extra candidates and move the ones matching the detected emotion first
+CHAT_MEMORY_CANDIDATES = 6
+CHAT_MEMORY_LIMIT = 3
+CHAT_MEMORY_CHARS = 200
+
+CHAT_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "emotionbank_chat_time_to_first_token_ms", "Time from chat request to the first streamed token", []
+)
+
 class AICompanion:
     def __init__(self, memory_handler):
         self.memory_handler = memory_handler
-        
-        # Initialize a smaller language model for conversation
-        self.language_model = pipeline("text-generation", model="distilgpt2")  # Use a smaller model
+        self.generator = StreamingGenerator()
+        self._generation_pool = ThreadPoolExecutor(
+            max_workers=CHAT_GENERATION_WORKERS, thread_name_prefix="chat-generation"
+        )
 
-        
         # Enhanced reflection prompts based on emotions
         self.reflection_prompts = {
             "joy": [
@@ -60,10 +81,16 @@ class AICompanion:
             "What would you tell your past self about this experience?"
         ]
 
-    def _analyze_user_emotion(self, user_input: str) -> str:
+    def load_model(self) -> float:
+        """Load the chat model now instead of on the first message; returns seconds taken"""
+        started = time.perf_counter()
+        self.generator.load()
+        return time.perf_counter() - started
+
+    async def _analyze_user_emotion(self, user_input: str) -> str:
         """Analyze user input to detect emotional context"""
         # Use emotion analyzer from memory handler
-        analysis = self.memory_handler.emotion_analyzer.analyze_text(user_input)
+        analysis = await self.memory_handler.analyze_text(user_input)
         if analysis["emotion_tags"]:
             return analysis["emotion_tags"][0]
         return "neutral"
@@ -74,11 +101,111 @@ class AICompanion:
             return random.choice(self.reflection_prompts[emotion])
         return random.choice(self.general_prompts)
 
+    async def _retrieve_context(self, user_input: str) -> List[Dict]:
+        try:
+            with span("chat.retrieve"):
+                return await self.memory_handler.retrieve_memories(
+                    query=user_input, limit=CHAT_MEMORY_CANDIDATES
+                )
+        except ExecutorSaturated:
+            raise
+        except Exception as e:
+            logging.error(f"Error retrieving memories: {str(e)}")
+            return []
+
+    async def _detect_emotion(self, user_input: str) -> str:
+        with span("chat.emotion"):
+            return await self._analyze_user_emotion(user_input)
+
+    def _build_prompt(self, user_input: str, emotion: str, memories: List[Dict]) -> str:
+        """Ground the reply in the retrieved memories; the model continues after "Companion:" """
+        lines = [
+            "The following is a conversation between a person and a warm, reflective companion "
+            "who helps them revisit memories they have shared."
+        ]
+        if memories:
+            lines.append("Memories they shared:")
+            for memory in memories:
+                text = (memory.get("content") or "").strip()[:CHAT_MEMORY_CHARS]
+                tags = ", ".join(memory.get("emotional_tags") or [])
+                lines.append(f"- {memory['caption']}" + (f": {text}" if text else "") + (f" (felt {tags})" if tags else ""))
+        lines.append(f"They seem to be feeling {emotion}.")
+        lines.append(f"User: {user_input.strip()}")
+        lines.append("Companion:")
+        return "\n".join(lines)
+
+    async def _stream_tokens(self, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        """Drive the blocking generator one step at a time on the generation pool"""
+        loop = asyncio.get_running_loop()
+        pieces = self.generator.stream(prompt, max_tokens)
+        done = object()
+        try:
+            while True:
+                piece = await loop.run_in_executor(self._generation_pool, next, pieces, done)
+                if piece is done:
+                    return
+                yield piece
+        finally:
+            # A client that disconnects mid-reply stops generation at the next step
+            await loop.run_in_executor(self._generation_pool, pieces.close)
+
+    async def chat_stream(self, user_input: str, max_tokens: int = CHAT_MAX_NEW_TOKENS) -> AsyncIterator[Tuple[str, Dict]]:
+        """("context" | "token" | "done", payload) events for one reply, tokens as they are decoded"""
+        started = time.perf_counter()
+        # Neither depends on the other, so the prompt is ready after the slower of the two
+        user_emotion, candidates = await asyncio.gather(
+            self._detect_emotion(user_input), self._retrieve_context(user_input)
+        )
+        matching = [memory for memory in candidates if user_emotion in (memory.get("emotional_tags") or [])]
+        others = [memory for memory in candidates if user_emotion not in (memory.get("emotional_tags") or [])]
+        memories = (matching + others)[:CHAT_MEMORY_LIMIT]
+        yield "context", {"related_memories": memories, "detected_emotion": user_emotion}
+
+        message = ""
+        chunks = 0
+        first_token_ms = None
+        try:
+            with span("chat.generate"):
+                async for piece in self._stream_tokens(self._build_prompt(user_input, user_emotion, memories), max_tokens):
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                        CHAT_TIME_TO_FIRST_TOKEN.labels().observe(first_token_ms)
+                    message += piece
+                    chunks += 1
+                    yield "token", {"text": piece}
+        except Exception as e:
+            logging.error(f"Chat generation failed: {str(e)}")
+
+        if not message.strip():
+            # No model, or it produced nothing usable: fall back to a template reply
+            message = (
+                self._generate_memory_response(user_emotion, memories) if memories
+                else self._generate_exploratory_response(user_emotion)
+            )
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+                CHAT_TIME_TO_FIRST_TOKEN.labels().observe(first_token_ms)
+            chunks += 1
+            yield "token", {"text": message}
+
+        yield "done", {
+            "message": message.strip(),
+            "reflection_prompt": self._get_relevant_prompt(user_emotion),
+            "detected_emotion": user_emotion,
+            "time_to_first_token_ms": first_token_ms,
+            "chunks": chunks
+        }
+
     async def chat(self, user_input: str) -> Dict:
+        """The whole reply at once, from the reply templates.
+
+        Only chat_stream runs the language model; this path stays off the
+        single generation worker so non-streaming clients keep their throughput.
+        """
         try:
             # Analyze user's emotional state
-            user_emotion = self._analyze_user_emotion(user_input)
-            
+            user_emotion = await self._detect_emotion(user_input)
+
             # Prepare response
             response = {
                 "message": "",
@@ -86,19 +213,21 @@ class AICompanion:
                 "reflection_prompt": None,
                 "detected_emotion": user_emotion
             }
-            
+
             # Retrieve relevant memories, handle case if no memories exist
             try:
-                memories = await self.memory_handler.retrieve_memories(
-                    query=user_input,
-                    emotion=user_emotion,
-                    limit=3
-                )
+                with span("chat.retrieve"):
+                    memories = await self.memory_handler.retrieve_memories(
+                        query=user_input,
+                        emotion=user_emotion,
+                        limit=CHAT_MEMORY_LIMIT
+                    )
+            except ExecutorSaturated:
+                raise
             except Exception as e:
                 logging.error(f"Error retrieving memories: {str(e)}")
                 memories = []  # Set memories to an empty list if retrieval fails
 
-            
             # Generate conversational response
             if memories:
                 response["message"] = self._generate_memory_response(
@@ -109,15 +238,20 @@ class AICompanion:
                 response["message"] = self._generate_exploratory_response(
                     user_emotion
                 )
-            
+
             # Add reflection prompt
             response["reflection_prompt"] = self._get_relevant_prompt(user_emotion)
-            
+
             return response
-            
+
+        except ExecutorSaturated:
+            raise
         except Exception as e:
             raise Exception(f"Error in AI companion chat: {str(e)}")
 
+    def shutdown(self):
+        self._generation_pool.shutdown(wait=False, cancel_futures=True)
+
     def _generate_memory_response(self, emotion: str, memories: List[Dict]) -> str:
         """Generate a response that incorporates retrieved memories"""
         memory_count = len(memories)
@@ -1,14 +1,28 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from database import Memory
-from memory_handler import MemoryHandler
+from memory_handler import MemoryHandler, InvalidCursor, BROWSE_PAGE_SIZE
 from emotion_tagging import EmotionAnalyzer
+from batching import BatchingEmotionAnalyzer
+from executor import ExecutionLayer, ExecutorSaturated, INFERENCE_MODE
 from ai_companion import AICompanion
-from datetime import datetime
-from database import SessionLocal, init_db
+from chat_generation import CHAT_MAX_NEW_TOKENS
+from memory_tags import TagFilterError, parse_tag_filter
+from bulk_ingest import BulkIngestor, make_item, parse_tags
+from upload_jobs import UploadJobQueue
+from reconcile import VectorReconciler, RECONCILE_INTERVAL_S
+from rollups import timeline
+from metrics import REGISTRY, SLOW_REQUEST_MS, start_trace
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime, timedelta
+from database import SessionLocal, SerializedWriter, init_db, session_scope
+from contextlib import contextmanager
 import uvicorn
+import asyncio
 import json
 import logging
+import time
 import os
 
 # Configure logging
@@ -17,6 +31,26 @@ logger = logging.getLogger(__name__)
 
 TEMP_FOLDER = "/tmp/memory_uploads"  # Designated temp folder
 
+# "eager" loads models before serving, "background" serves immediately and loads
+# them in a background task, "lazy" loads each model on its first request
+STARTUP_MODE = os.environ.get("EMOTIONBANK_STARTUP_MODE", "background")
+WARMUP = os.environ.get("EMOTIONBANK_WARMUP", "0") == "1"
+
+# Per-stage startup timings in seconds, served at /startup_report
+startup_report = {
+    "mode": STARTUP_MODE,
+    "stages": {},
+    "components": {},
+    "models_ready": False,
+    "error": None
+}
+
+@contextmanager
+def _timed_stage(stage: str):
+    started = time.perf_counter()
+    yield
+    startup_report["stages"][stage] = time.perf_counter() - started
+
 # Ensure the temporary folder exists
 os.makedirs(TEMP_FOLDER, exist_ok=True)
 
@@ -31,67 +65,361 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+REQUEST_DURATION = REGISTRY.histogram(
+    "emotionbank_request_duration_ms", "End-to-end HTTP request latency", ["route"]
+)
+REQUESTS = REGISTRY.counter(
+    "emotionbank_requests_total", "HTTP requests by route and status code", ["route", "status"]
+)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace = start_trace()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        # Label by route template so path parameters don't explode the label set
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        REQUEST_DURATION.labels(route=route_path).observe(elapsed_ms)
+        REQUESTS.labels(route=route_path, status=status).inc()
+        if SLOW_REQUEST_MS > 0 and elapsed_ms > SLOW_REQUEST_MS:
+            stages = ", ".join(f"{stage}={ms:.1f}ms" for stage, ms in trace)
+            logger.warning(
+                f"Slow request {request.method} {route_path}: {elapsed_ms:.1f}ms ({stages or 'no stages'})"
+            )
+
 # Initialize database
-init_db()
-db = SessionLocal()
+with _timed_stage("init_db"):
+    init_db()
+db_writer = SerializedWriter(SessionLocal)
 
 # Initialize components
-emotion_analyzer = EmotionAnalyzer()
-memory_handler = MemoryHandler(db, emotion_analyzer)
+# In process mode each inference worker loads its own models
+emotion_analyzer = None
+if INFERENCE_MODE == "thread":
+    with _timed_stage("models_eager" if STARTUP_MODE == "eager" else "analyzer"):
+        emotion_analyzer = BatchingEmotionAnalyzer(
+            EmotionAnalyzer(lazy=STARTUP_MODE != "eager")
+        )
+executor = ExecutionLayer(emotion_analyzer)
+with _timed_stage("vector_db"):
+    memory_handler = MemoryHandler(SessionLocal, emotion_analyzer, executor, db_writer)
 ai_companion = AICompanion(memory_handler)
+bulk_ingestor = BulkIngestor(memory_handler)
+upload_jobs = UploadJobQueue(memory_handler, SessionLocal, db_writer)
+reconciler = VectorReconciler(memory_handler)
+
+class BulkMemoryItem(BaseModel):
+    image_path: str
+    caption: Optional[str] = None
+    content: Optional[str] = None
+    emotional_tags: List[str] = []
+    timestamp: Optional[str] = None
+
+SERVICE_UNAVAILABLE_DETAIL = "Server is busy, please retry shortly"
+
+async def _prepare_models():
+    """Load (and optionally warm up) every enabled model component"""
+    started = time.perf_counter()
+    try:
+        # Every process worker loads its own models, so each one is prepared before ready
+        timings = await executor.prepare("warm_up" if WARMUP else "load")
+        timings["chat_model"] = await executor.run_io(ai_companion.load_model)
+        startup_report["components"] = timings
+        startup_report["models_ready"] = True
+    except Exception as e:
+        logger.error(f"Model loading failed: {str(e)}")
+        startup_report["error"] = str(e)
+    startup_report["stages"]["models"] = time.perf_counter() - started
+
+async def _reconcile_periodically():
+    """Repair drift between SQLite and the vector collections left by crashes"""
+    while True:
+        try:
+            await executor.run_io(reconciler.reconcile)
+        except Exception as e:
+            logger.error(f"Vector reconciliation failed: {str(e)}")
+        await asyncio.sleep(RECONCILE_INTERVAL_S)
+
+@app.on_event("startup")
+async def start_model_loading():
+    await upload_jobs.start()
+    if RECONCILE_INTERVAL_S > 0:
+        asyncio.create_task(_reconcile_periodically())
+    if STARTUP_MODE == "lazy":
+        # Nothing to wait for; each component loads on its first request
+        startup_report["models_ready"] = True
+    elif STARTUP_MODE == "background":
+        asyncio.create_task(_prepare_models())
+    else:
+        await _prepare_models()
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    await upload_jobs.stop()
+    ai_companion.shutdown()
+    executor.shutdown()
+    db_writer.stop()
 
 @app.get("/")
 async def read_root():
     return {"status": "ok", "message": "EmotionBank API is running"}
 
-@app.post("/upload_memory/")
+@app.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def readiness():
+    ready = startup_report["models_ready"]
+    body = {
+        "status": "ready" if ready else "loading",
+        "components": startup_report["components"],
+        "error": startup_report["error"]
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/startup_report")
+async def get_startup_report():
+    return startup_report
+
+@app.get("/stats/batching")
+async def batching_stats():
+    if emotion_analyzer is None:
+        return {}
+    return emotion_analyzer.stats()
+
+@app.get("/stats/cache")
+async def cache_stats():
+    if emotion_analyzer is None:
+        return {}
+    return emotion_analyzer.cache.stats()
+
+@app.get("/stats/query_cache")
+async def query_cache_stats():
+    return memory_handler.query_cache.stats()
+
+@app.get("/stats/executor")
+async def executor_stats():
+    return executor.stats()
+
+@app.get("/stats/jobs")
+async def job_stats():
+    return upload_jobs.stats()
+
+@app.get("/stats/vector_drift")
+async def vector_drift_stats():
+    return reconciler.last_report or {}
+
+@app.post("/maintenance/reconcile")
+async def reconcile_vectors(dry_run: bool = False):
+    try:
+        return await executor.run_io(reconciler.reconcile, dry_run)
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail=SERVICE_UNAVAILABLE_DETAIL)
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.post("/upload_memory/", status_code=202)
 async def upload_memory(
-    image_path:str = Form(...) ,
     caption: str = Form(...),
     content: str = Form(...),
-    emotional_tags: str = Form(...)
+    emotional_tags: str = Form(...),
+    image: Optional[UploadFile] = File(None),
+    image_path: Optional[str] = Form(None)
 ):
+    """Queue a memory for analysis; poll /jobs/{id} or subscribe to /jobs/{id}/events for the result.
+
+    The image is either streamed as the `image` file part or read from a
+    local `image_path`; both are copied into the content-addressed store.
+    """
     logger.info(f"Received upload request - Caption: {caption}")
     try:
-        # Parse emotional tags
-        tags = json.loads(emotional_tags)
-        
-        # Create memory object
-        memory = Memory(
-            image_path=image_path,
-            caption=caption,
-            content=content,
-            emotional_tags=tags,
-            timestamp=datetime.now()
+        # Same formats as bulk ingest: a JSON list of strings or comma-separated text
+        tags = parse_tags(emotional_tags)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="emotional_tags must be a JSON list of strings or comma-separated text"
         )
-                
-        try:
-            # Pass the file path to the memory handler
-            result = await memory_handler.upload_memory(memory)
-            logger.info("Upload successful")
-            return result
-        except:
-            logger.error("Upload failed")
-        
+    if image is None and not image_path:
+        raise HTTPException(status_code=400, detail="Provide an image file or an image_path")
+
+    try:
+        if image is not None:
+            stored = await memory_handler.save_upload(image)
+        else:
+            stored = await memory_handler.save_uploaded_file(image_path)
+        job = await upload_jobs.enqueue(stored["original"], caption, content, tags, datetime.now())
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail=SERVICE_UNAVAILABLE_DETAIL)
     except Exception as e:
         logger.error(f"Upload failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
-    
+
+    job["status_url"] = f"/jobs/{job['id']}"
+    job["events_url"] = f"/jobs/{job['id']}/events"
+    return JSONResponse(job, status_code=202, headers={"Location": job["status_url"]})
+
+@app.get("/jobs/{job_id}")
+async def get_upload_job(job_id: str):
+    job = await upload_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def upload_job_events(job_id: str):
+    """Server-sent events: the job's current state, then every status change until it finishes"""
+    if await upload_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def stream():
+        async for state in upload_jobs.events(job_id):
+            yield f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+@app.post("/upload_memories/batch")
+async def upload_memories_batch(items: List[BulkMemoryItem]):
+    logger.info(f"Received batch upload of {len(items)} memories")
+    try:
+        source_items = [
+            make_item(item.image_path, item.caption, item.content,
+                       item.emotional_tags, item.timestamp)
+            for item in items
+        ]
+        return await bulk_ingestor.ingest(source_items)
+    except ExecutorSaturated as e:
+        # Report what was committed before the pool filled up; resending the batch skips it
+        raise HTTPException(status_code=503, detail={
+            "message": SERVICE_UNAVAILABLE_DETAIL, "summary": getattr(e, "summary", None)
+        })
+    except Exception as e:
+        logger.error(f"Batch upload failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
 @app.get("/retrieve_memories/")
-async def retrieve_memories(query: str = None):
+async def retrieve_memories(query: str = None, emotion: str = None, tags: str = None,
+                            similar_to_id: int = None, start: datetime = None,
+                            end: datetime = None, limit: int = 10):
     try:
-        memories = await memory_handler.retrieve_memories(query=query)
+        memories = await memory_handler.retrieve_memories(
+            query=query, emotion=emotion, similar_to_id=similar_to_id, limit=limit,
+            tag_filter=tags, start=start, end=end
+        )
         return memories
+    except TagFilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail=SERVICE_UNAVAILABLE_DETAIL)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/memories")
+async def browse_memories(cursor: str = None, limit: int = BROWSE_PAGE_SIZE, emotion: str = None,
+                          tags: str = None, start: datetime = None, end: datetime = None):
+    """A page of memories, newest first; pass next_cursor back to get the following page"""
+    try:
+        return await memory_handler.browse_memories(cursor, limit, emotion, tags, start, end)
+    except (TagFilterError, InvalidCursor) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail=SERVICE_UNAVAILABLE_DETAIL)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/memories/stream")
+async def stream_memories(emotion: str = None, tags: str = None,
+                          start: datetime = None, end: datetime = None):
+    """Every matching memory as newline-delimited JSON, read page by page"""
+    if tags:
+        # Reject a bad filter before the response starts streaming
+        try:
+            parse_tag_filter(tags)
+        except TagFilterError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def lines():
+        async for memory in memory_handler.iter_memories(
+            emotion=emotion, tag_filter=tags, start=start, end=end
+        ):
+            yield json.dumps(memory) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/memories/{memory_id}/similar")
+async def similar_memories(memory_id: int, kind: str = "fused", limit: int = 10):
+    """The memory's nearest neighbours by text, image or fused similarity"""
+    try:
+        return await memory_handler.similar_memories(memory_id, kind, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail=SERVICE_UNAVAILABLE_DETAIL)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/timeline")
+async def emotion_timeline(period: str = "week", emotions: str = None,
+                           start: datetime = None, end: datetime = None):
+    """Per-emotion mean, count and max per day or week, served from the rollup table.
+
+    Defaults to the year up to now; `emotions` is comma-separated, e.g. joy,sadness.
+    """
+    end = end or datetime.now()
+    start = start or end - timedelta(days=365)
+    emotion_list = [emotion.strip().lower() for emotion in emotions.split(",")] if emotions else None
+
+    def read_timeline():
+        with session_scope() as db:
+            return timeline(db, period, emotion_list, start, end)
+
+    try:
+        return await executor.run_io(read_timeline)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail=SERVICE_UNAVAILABLE_DETAIL)
+
 @app.get("/chat/")
 async def chat_with_ai(user_input: str):
     try:
         response = await ai_companion.chat(user_input)
         return response
+    except ExecutorSaturated:
+        raise HTTPException(status_code=503, detail=SERVICE_UNAVAILABLE_DETAIL)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/chat/stream")
+async def chat_stream(user_input: str, max_tokens: int = CHAT_MAX_NEW_TOKENS):
+    """Server-sent events: the related memories, each decoded piece of the reply, then the full reply"""
+    if max_tokens < 1:
+        raise HTTPException(status_code=400, detail="max_tokens must be positive")
+
+    async def stream():
+        try:
+            async for event, payload in ai_companion.chat_stream(user_input, min(max_tokens, CHAT_MAX_NEW_TOKENS)):
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        except ExecutorSaturated:
+            yield f"event: error\ndata: {json.dumps({'detail': SERVICE_UNAVAILABLE_DETAIL})}\n\n"
+        except Exception as e:
+            logger.error(f"Chat stream failed: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
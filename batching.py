@@ -0,0 +1,206 @@
+import os
+import time
+import queue
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+from metrics import REGISTRY, BATCH_SIZE_BUCKETS, current_trace, start_trace
+
+# Batching window configuration
+BATCH_MAX_SIZE = int(os.environ.get("EMOTIONBANK_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("EMOTIONBANK_BATCH_MAX_WAIT_MS", "10"))
+
+BATCH_SIZE = REGISTRY.histogram(
+    "emotionbank_batch_size", "Items per inference batch", ["batcher"], BATCH_SIZE_BUCKETS
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "emotionbank_batch_queue_wait_ms", "Time items wait before their batch runs", ["batcher"]
+)
+
+class MicroBatcher:
+    """Collects single-item requests and runs them through a batch function.
+
+    A background thread waits for the first pending item, then keeps
+    collecting until either `max_batch_size` items are queued or
+    `max_wait_ms` has elapsed, and resolves each caller's future with its
+    slice of the batch result.
+
+    The batch runs outside every caller's context, so its spans are
+    collected separately and copied into the trace of each request in the
+    batch, along with the time that request waited in the queue.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[List], List],
+                 max_batch_size: int = BATCH_MAX_SIZE,
+                 max_wait_ms: float = BATCH_MAX_WAIT_MS):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batch_sizes = BATCH_SIZE.labels(batcher=name)
+        self.queue_wait_ms = QUEUE_WAIT.labels(batcher=name)
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._worker.start()
+
+    def submit(self, item) -> Future:
+        if self._stopped.is_set():
+            raise RuntimeError(f"Batcher '{self.name}' is stopped")
+        future = Future()
+        self._queue.put((item, future, time.perf_counter(), current_trace()))
+        return future
+
+    def stop(self):
+        """Stop the worker; requests still queued fail instead of waiting forever"""
+        self._stopped.set()
+        self._queue.put(None)
+        self._worker.join()
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if entry is not None:
+                entry[1].set_exception(RuntimeError(f"Batcher '{self.name}' stopped"))
+
+    def _collect(self) -> List:
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._stopped.set()
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            self.batch_sizes.observe(len(batch))
+            for _, _, enqueued, trace in batch:
+                wait_ms = (started - enqueued) * 1000
+                self.queue_wait_ms.observe(wait_ms)
+                if trace is not None:
+                    trace.append((f"batch.{self.name}.wait", wait_ms))
+
+            items = [item for item, _, _, _ in batch]
+            try:
+                results = self._traced(items, [trace for _, _, _, trace in batch])
+            except Exception as e:
+                logging.error(f"Batch '{self.name}' of {len(batch)} failed: {str(e)}")
+                if len(batch) > 1:
+                    self._run_singly(batch)
+                else:
+                    batch[0][1].set_exception(e)
+                continue
+
+            for (_, future, _, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def _traced(self, items: List, traces: List) -> List:
+        """Run the batch function, copying the spans it records into every caller's trace"""
+        context = contextvars.Context()
+        batch_trace = context.run(start_trace)
+        try:
+            return context.run(self.batch_fn, items)
+        finally:
+            # Callers are blocked on their futures, so their traces aren't being written
+            for trace in traces:
+                if trace is not None:
+                    trace.extend(batch_trace)
+
+    def _run_singly(self, batch: List):
+        """Retry a failed batch one item at a time, so only the items that fail get the error"""
+        for item, future, _, trace in batch:
+            try:
+                future.set_result(self._traced([item], [trace])[0])
+            except Exception as e:
+                future.set_exception(e)
+
+    def stats(self) -> Dict:
+        return {
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            "pending": self._queue.qsize()
+        }
+
+class BatchingEmotionAnalyzer:
+    """Drop-in front for EmotionAnalyzer that micro-batches concurrent calls"""
+
+    def __init__(self, analyzer, max_batch_size: int = BATCH_MAX_SIZE,
+                 max_wait_ms: float = BATCH_MAX_WAIT_MS):
+        self.analyzer = analyzer
+        self.emotion_categories = analyzer.emotion_categories
+        self.cache = analyzer.cache
+        self.text_batcher = MicroBatcher(
+            "text", analyzer.analyze_texts, max_batch_size, max_wait_ms
+        )
+        # Items are (image_path, digest) pairs; a None digest is hashed by the analyzer
+        self.image_batcher = MicroBatcher(
+            "image", lambda items: analyzer.analyze_images(
+                [path for path, _ in items], [digest for _, digest in items]
+            ), max_batch_size, max_wait_ms
+        )
+
+    def submit_text(self, text: str) -> Future:
+        return self.text_batcher.submit(text)
+
+    def submit_image(self, image_path: str, digest: str = None) -> Future:
+        return self.image_batcher.submit((image_path, digest))
+
+    def analyze_text(self, text: str) -> Dict:
+        return self.submit_text(text).result()
+
+    def analyze_image(self, image_path: str, digest: str = None) -> Dict:
+        return self.submit_image(image_path, digest).result()
+
+    def analyze_texts(self, texts: List[str]) -> List[Dict]:
+        return self.analyzer.analyze_texts(texts)
+
+    def analyze_images(self, image_paths: List, digests: List[str] = None) -> List[Dict]:
+        return self.analyzer.analyze_images(image_paths, digests)
+
+    def encode_clip_texts(self, texts: List[str]):
+        return self.analyzer.encode_clip_texts(texts)
+
+    def combine_analysis(self, text_analysis: Dict, image_analysis: Dict) -> Dict:
+        return self.analyzer.combine_analysis(text_analysis, image_analysis)
+
+    def combine_analyses(self, text_analyses: List[Dict], image_analyses: List[Dict]) -> List[Dict]:
+        return self.analyzer.combine_analyses(text_analyses, image_analyses)
+
+    def has_component(self, name: str) -> bool:
+        return self.analyzer.has_component(name)
+
+    def load(self) -> Dict:
+        return self.analyzer.load()
+
+    def warm_up(self) -> Dict:
+        return self.analyzer.warm_up()
+
+    def stats(self) -> Dict:
+        return {
+            "text": self.text_batcher.stats(),
+            "image": self.image_batcher.stats()
+        }
+
+    def stop(self):
+        self.text_batcher.stop()
+        self.image_batcher.stop()
@@ -0,0 +1,470 @@
+"""Offline benchmark suite for the ingest, retrieval and chat paths.
+
+Runs against a throwaway working directory (SQLite, Chroma, caches and
+images all live there) with a synthetic corpus. When model weights are
+unavailable, a deterministic stub analyzer stands in for the real one so
+timings cover everything except the model forward passes.
+
+    python benchmark.py --memories 500 --output results.json
+    python benchmark.py --baseline results.json --tolerance 0.2   # exit 1 on regression
+
+Metrics ending in `_ms` are latencies (lower is better); metrics ending
+in `_per_sec` are throughputs (higher is better). `vector_store` compares
+the Chroma and numpy vector backends on synthetic vectors, including
+recall against exact search; a `recall_at_<k>` drop of more than
+--recall-tolerance (absolute) also counts as a regression.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+import platform
+import tempfile
+from datetime import datetime, timedelta
+from typing import Dict, List
+import numpy as np
+
+BENCH_EMOTIONS = ["joy", "sadness", "anger", "fear", "love", "surprise", "gratitude", "anxiety"]
+TEXT_TEMPLATES = [
+    "A day full of {emotion} at the lake with the whole family.",
+    "I still remember the {emotion} I felt when the letter arrived.",
+    "Dinner with old friends, laughing and sharing {emotion}.",
+    "Walking home alone in the rain, thinking about {emotion}.",
+    "The first morning in the new apartment brought so much {emotion}."
+]
+
+def percentiles(samples: List[float]) -> Dict:
+    values = np.array(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99))
+    }
+
+def _seeded_vector(key: str, dim: int) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def make_stub_analyzer():
+    """EmotionAnalyzer with deterministic fake models; caching, prompt bank and fusion are real"""
+    from emotion_tagging import (
+        EmotionAnalyzer, COMPONENTS, EMOTION_MODEL_NAME, TEXT_MODEL_NAME, CLIP_MODEL_NAME
+    )
+    from prompt_bank import PromptBank
+
+    class StubEmotionAnalyzer(EmotionAnalyzer):
+        stub = True
+        TEXT_LABELS = ["sadness", "joy", "love", "anger", "fear", "surprise"]
+
+        def __init__(self):
+            super().__init__(components=COMPONENTS, lazy=False, backend="torch")
+
+        def _stub_revision(self, model_name: str):
+            self.model_revisions[model_name] = "stub"
+            self.cache.register_model(model_name, "stub")
+
+        def _load_emotion(self):
+            self._stub_revision(EMOTION_MODEL_NAME)
+
+        def _load_text(self):
+            self._stub_revision(TEXT_MODEL_NAME)
+
+        def _load_clip(self):
+            self._stub_revision(CLIP_MODEL_NAME)
+            self._prompt_bank = PromptBank(CLIP_MODEL_NAME, "stub", self.emotion_categories)
+            self._prompt_bank.load_or_build(self._encode_clip_texts)
+
+        def _classify_emotions(self, texts):
+            results = []
+            for text in texts:
+                logits = np.array(_seeded_vector(f"emotion:{text}", len(self.TEXT_LABELS))) * 4
+                scores = np.exp(logits) / np.exp(logits).sum()
+                results.append([
+                    {"label": label, "score": float(score)} for label, score in zip(self.TEXT_LABELS, scores)
+                ])
+            return results
+
+        def _embed_texts(self, texts):
+            return [_seeded_vector(f"text:{text}", 384) for text in texts]
+
+        def _embed_images(self, images):
+            vectors = []
+            for image in images:
+                if isinstance(image, str):
+                    with open(image, "rb") as f:
+                        key = hashlib.sha256(f.read()).hexdigest()
+                else:
+                    key = hashlib.sha256(image.tobytes()).hexdigest()
+                vectors.append(_seeded_vector(f"image:{key}", 512))
+            return vectors
+
+        def _encode_clip_texts(self, texts):
+            return np.array([_seeded_vector(f"clip:{text}", 512) for text in texts])
+
+    return StubEmotionAnalyzer()
+
+def make_stub_generator():
+    """StreamingGenerator that streams deterministic words instead of running the chat model"""
+    from chat_generation import StreamingGenerator, CHAT_MAX_NEW_TOKENS
+
+    class StubStreamingGenerator(StreamingGenerator):
+        WORDS = ["That", " sounds", " like", " a", " moment", " worth", " remembering", "."]
+
+        def load(self):
+            pass
+
+        def stream(self, prompt: str, max_new_tokens: int = CHAT_MAX_NEW_TOKENS):
+            for i in range(min(max_new_tokens, len(self.WORDS))):
+                yield self.WORDS[i]
+
+    return StubStreamingGenerator()
+
+def make_analyzer(kind: str):
+    if kind == "stub":
+        return make_stub_analyzer()
+    from emotion_tagging import EmotionAnalyzer
+    if kind == "real":
+        return EmotionAnalyzer()
+    try:
+        return EmotionAnalyzer()
+    except Exception as e:
+        logging.warning(f"Real models unavailable ({str(e)}), using stub analyzer")
+        return make_stub_analyzer()
+
+def generate_corpus(directory: str, count: int, seed: int = 0) -> List[Dict]:
+    """Synthetic memories with small JPEG images and emotion-flavoured text"""
+    from PIL import Image
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    os.makedirs(directory, exist_ok=True)
+    start = datetime(2024, 1, 1)
+    corpus = []
+    for i in range(count):
+        emotion = random.choice(BENCH_EMOTIONS)
+        pixels = rng.integers(0, 255, (96, 128, 3), dtype=np.uint8)
+        image_path = os.path.join(directory, f"memory_{i:06d}.jpg")
+        Image.fromarray(pixels).save(image_path, quality=85)
+        corpus.append({
+            "image_path": image_path,
+            "caption": f"Memory {i}",
+            "content": random.choice(TEXT_TEMPLATES).format(emotion=emotion),
+            "emotional_tags": [emotion] + random.sample(BENCH_EMOTIONS, 1),
+            "timestamp": start + timedelta(hours=int(rng.integers(0, 24 * 365)))
+        })
+    return corpus
+
+async def bench_upload(handler, corpus: List[Dict]) -> Dict:
+    from database import Memory
+    started = time.perf_counter()
+    latencies = []
+    for item in corpus:
+        call_started = time.perf_counter()
+        await handler.upload_memory(Memory(**item))
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return {"items_per_sec": len(corpus) / elapsed, **percentiles(latencies)}
+
+async def bench_retrieve(handler, corpus: List[Dict], memory_ids: List[int], iterations: int) -> Dict:
+    branches = {
+        "query": lambda: {"query": random.choice(corpus)["content"]},
+        "emotion": lambda: {"emotion": random.choice(BENCH_EMOTIONS)},
+        "hybrid": lambda: {
+            "query": random.choice(corpus)["content"], "emotion": random.choice(BENCH_EMOTIONS)
+        },
+        "similar_to_id": lambda: {"similar_to_id": random.choice(memory_ids)},
+        "list": lambda: {},
+        # The same search every time: served from the result cache after the first call
+        "repeated_query": lambda: {"query": corpus[0]["content"]}
+    }
+    results = {}
+    for branch, make_args in branches.items():
+        latencies = []
+        for _ in range(iterations):
+            kwargs = make_args()
+            started = time.perf_counter()
+            await handler.retrieve_memories(limit=10, **kwargs)
+            latencies.append(time.perf_counter() - started)
+        results[branch] = percentiles(latencies)
+    return results
+
+async def bench_chat(companion, iterations: int) -> Dict:
+    """Time to the first streamed token and to the end of the reply"""
+    first_token = []
+    latencies = []
+    for i in range(iterations):
+        message = random.choice(TEXT_TEMPLATES).format(emotion=random.choice(BENCH_EMOTIONS))
+        started = time.perf_counter()
+        first = None
+        async for event, _ in companion.chat_stream(f"{message} ({i})"):
+            if event == "token" and first is None:
+                first = time.perf_counter() - started
+        latencies.append(time.perf_counter() - started)
+        first_token.append(first)
+    return {"time_to_first_token": percentiles(first_token), "complete": percentiles(latencies)}
+
+async def bench_http(analyzer, corpus: List[Dict], concurrency: int, requests_per_client: int) -> Dict:
+    """Concurrent mixed load against the FastAPI app in-process, including health checks during uploads"""
+    import httpx
+    import app as app_module
+    from batching import BatchingEmotionAnalyzer
+
+    # Point the app's components at the benchmark analyzer
+    batching_analyzer = BatchingEmotionAnalyzer(analyzer)
+    app_module.emotion_analyzer = batching_analyzer
+    app_module.executor.analyzer = batching_analyzer
+    app_module.memory_handler.emotion_analyzer = batching_analyzer
+    if getattr(analyzer, "stub", False):
+        app_module.ai_companion.generator = make_stub_generator()
+
+    # ASGITransport does not run startup events, so start the upload job workers here
+    await app_module.upload_jobs.start()
+    transport = httpx.ASGITransport(app=app_module.app)
+    latencies = {"health": [], "retrieve": [], "chat": [], "upload": [], "upload_complete": []}
+    rejected = {}  # upload status code -> count
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def timed(kind: str, method: str, url: str, **kwargs):
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies[kind].append(time.perf_counter() - started)
+            return response
+
+        async def uploader(items):
+            for item in items:
+                started = time.perf_counter()
+                response = await timed("upload", "POST", "/upload_memory/", data={
+                    "image_path": item["image_path"],
+                    "caption": item["caption"],
+                    "content": item["content"],
+                    "emotional_tags": json.dumps(item["emotional_tags"])
+                })
+                if response.status_code != 202:
+                    # Backpressure (503) or a bad request: nothing was queued to wait for
+                    rejected[response.status_code] = rejected.get(response.status_code, 0) + 1
+                    continue
+                # Accept latency above; time until the memory is stored here
+                await app_module.upload_jobs.wait(response.json()["id"])
+                latencies["upload_complete"].append(time.perf_counter() - started)
+
+        async def reader():
+            for _ in range(requests_per_client):
+                kind = random.choice(["health", "retrieve", "chat"])
+                if kind == "health":
+                    await timed("health", "GET", "/")
+                elif kind == "retrieve":
+                    await timed("retrieve", "GET", "/retrieve_memories/",
+                                params={"query": random.choice(corpus)["content"]})
+                else:
+                    await timed("chat", "GET", "/chat/",
+                                params={"user_input": random.choice(corpus)["content"]})
+
+        upload_items = corpus[:max(1, len(corpus) // 10)]
+        started = time.perf_counter()
+        await asyncio.gather(uploader(upload_items), *[reader() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    await app_module.upload_jobs.stop()
+    batching_analyzer.stop()
+    total = sum(len(samples) for kind, samples in latencies.items() if kind != "upload_complete")
+    results = {"requests_per_sec": total / elapsed, "upload_rejected": sum(rejected.values())}
+    results.update({f"upload_rejected_{status}": count for status, count in sorted(rejected.items())})
+    for kind, samples in latencies.items():
+        if samples:
+            results[kind] = percentiles(samples)
+    return results
+
+def bench_vector_stores(count: int, dim: int, iterations: int, seed: int = 0, k: int = 10) -> Dict:
+    """Chroma against the numpy backend (exact, IVF and PQ-compressed) on the same synthetic vectors.
+
+    Recall is measured against the exact numpy results.
+    """
+    from vector_store import NumpyVectorStore, CHROMA_DIR, open_collection
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(8, count // 500), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), count)]
+    vectors += 0.5 * rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [str(i) for i in range(count)]
+    metadatas = [
+        {"memory_id": i, f"tag:{BENCH_EMOTIONS[i % len(BENCH_EMOTIONS)]}": True, "timestamp_epoch": float(i)}
+        for i in range(count)
+    ]
+    queries = vectors[rng.choice(count, min(iterations, count), replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+    where = {f"tag:{BENCH_EMOTIONS[0]}": True}
+
+    backends = {
+        "numpy": lambda: NumpyVectorStore("bench_vector_index").get_or_create_collection("exact"),
+        "numpy_ivf": lambda: _ivf_collection(max(16, int(4 * np.sqrt(count)))),
+        "numpy_pq": lambda: NumpyVectorStore("bench_vector_index").get_or_create_collection("pq")
+    }
+    try:
+        import chromadb
+        backends["chroma"] = lambda: open_collection(
+            chromadb.PersistentClient(path=CHROMA_DIR + "_bench"), "bench"
+        )
+    except ImportError:
+        logging.warning("chromadb is not installed; benchmarking the numpy backend only")
+
+    results, exact = {}, None
+    for name, make_collection in backends.items():
+        collection = make_collection()
+        started = time.perf_counter()
+        for start in range(0, count, 1000):
+            collection.upsert(
+                ids=ids[start:start + 1000], embeddings=vectors[start:start + 1000].tolist(),
+                metadatas=metadatas[start:start + 1000]
+            )
+        upsert_seconds = time.perf_counter() - started
+        if name == "numpy_ivf":
+            collection.train_ivf()
+        elif name == "numpy_pq":
+            # 32x smaller than float32: one byte per 8 dimensions
+            collection.train_compression(subspaces=max(8, dim // 8))
+
+        found, latencies, filtered_latencies = [], [], []
+        for query in queries:
+            started = time.perf_counter()
+            result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=["distances"])
+            latencies.append(time.perf_counter() - started)
+            found.append(set(result["ids"][0]))
+            started = time.perf_counter()
+            collection.query(query_embeddings=[query.tolist()], n_results=k, where=where, include=["distances"])
+            filtered_latencies.append(time.perf_counter() - started)
+
+        if exact is None:
+            exact = found
+        results[name] = {
+            "upsert_per_sec": count / upsert_seconds,
+            "query": percentiles(latencies),
+            "filtered_query": percentiles(filtered_latencies),
+            f"recall_at_{k}": float(np.mean([len(a & b) / k for a, b in zip(found, exact)]))
+        }
+    return results
+
+def _ivf_collection(lists: int):
+    from vector_store import NumpyCollection
+    return NumpyCollection(os.path.join("bench_vector_index", "ivf"), ivf_lists=lists)
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+def compare(current: Dict[str, float], baseline: Dict[str, float], tolerance: float,
+            recall_tolerance: float = 0.02) -> List[str]:
+    """Names and details of metrics that regressed by more than `tolerance`.
+
+    Recall is a fraction already, so it regresses when it drops by more
+    than `recall_tolerance` in absolute terms rather than relatively.
+    """
+    regressions = []
+    for name, value in current.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if ".recall_at_" in name:
+            if value < old - recall_tolerance:
+                regressions.append(f"{name}: {old:.3f} -> {value:.3f} ({value - old:+.3f})")
+            continue
+        if old == 0:
+            continue
+        if name.endswith("_ms") and value > old * (1 + tolerance):
+            regressions.append(f"{name}: {old:.2f} -> {value:.2f} ms")
+        elif name.endswith("_per_sec") and value < old * (1 - tolerance):
+            regressions.append(f"{name}: {old:.2f} -> {value:.2f} per sec")
+    return regressions
+
+async def run(args) -> Dict:
+    from database import SessionLocal, init_db
+    from memory_handler import MemoryHandler
+    from ai_companion import AICompanion
+
+    init_db()
+    analyzer = make_analyzer(args.analyzer)
+    handler = MemoryHandler(SessionLocal, analyzer)
+    companion = AICompanion(handler)
+    if getattr(analyzer, "stub", False):
+        companion.generator = make_stub_generator()
+
+    corpus = generate_corpus(os.path.join(os.getcwd(), "bench_images"), args.memories, args.seed)
+    results = {"upload": await bench_upload(handler, corpus)}
+
+    from database import Memory
+    with SessionLocal() as db:
+        memory_ids = [row.id for row in db.query(Memory.id)]
+    results["retrieve"] = await bench_retrieve(handler, corpus, memory_ids, args.iterations)
+    results["chat"] = await bench_chat(companion, args.iterations)
+    if not args.skip_http:
+        results["http"] = await bench_http(analyzer, corpus, args.concurrency, args.iterations)
+    if args.vector_count:
+        results["vector_store"] = bench_vector_stores(args.vector_count, args.vector_dim, args.iterations, args.seed)
+    return results
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="EmotionBank performance benchmarks")
+    parser.add_argument("--memories", type=int, default=200, help="Size of the synthetic corpus")
+    parser.add_argument("--iterations", type=int, default=50, help="Calls per measured path")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent HTTP clients")
+    parser.add_argument("--analyzer", choices=["auto", "real", "stub"], default="auto")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--vector-count", type=int, default=10000,
+                        help="Vectors for the Chroma vs numpy vector store comparison (0 skips it)")
+    parser.add_argument("--vector-dim", type=int, default=384)
+    parser.add_argument("--output", default=None, help="Write results JSON here")
+    parser.add_argument("--baseline", default=None, help="Results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument("--recall-tolerance", type=float, default=0.02,
+                        help="Allowed absolute drop in vector store recall@k")
+    parser.add_argument("--workdir", default=None, help="Keep benchmark state here instead of a temp dir")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="emotionbank-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    # Every relative path the app uses (memories.db, vector_db, caches) resolves inside the workdir
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    os.environ.setdefault("EMOTIONBANK_STARTUP_MODE", "lazy")
+
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "memories": args.memories,
+            "iterations": args.iterations,
+            "analyzer": args.analyzer
+        },
+        "results": results,
+        "metrics": flatten(results)
+    }
+    print(json.dumps(report["metrics"], indent=2))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)["metrics"]
+        regressions = compare(report["metrics"], baseline, args.tolerance, args.recall_tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
@@ -0,0 +1,266 @@
+"""Bulk import of memories from a photo folder or a CSV/JSONL manifest.
+
+    python bulk_ingest.py ./photos --tags family,holiday
+    python bulk_ingest.py manifest.jsonl --chunk-size 128
+
+Manifest rows have `image_path`, and optionally `caption`, `content`,
+`emotional_tags` (list, JSON list or comma-separated) and `timestamp`
+(ISO 8601). Relative image paths are resolved against the manifest's
+directory. Images are copied into the content-addressed image store and
+analyzed from its model-resolution copy. Items already imported (tracked
+in `ingest_records`) are skipped, so an interrupted run can simply be
+restarted.
+"""
+import os
+import csv
+import json
+import time
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+from PIL import Image
+from database import Memory
+from rescoring import modality_scores
+from executor import ExecutorSaturated
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"}
+INGEST_CHUNK_SIZE = int(os.environ.get("EMOTIONBANK_INGEST_CHUNK_SIZE", "64"))
+ERROR_REPORT_LIMIT = 100  # Per-item errors listed in an ingest summary
+DECODE_WORKERS = int(os.environ.get("EMOTIONBANK_DECODE_WORKERS", str(os.cpu_count() or 4)))
+
+def parse_tags(tags) -> List[str]:
+    """Tags from a list, a JSON list of strings or comma-separated text; ValueError for anything else"""
+    if not tags:
+        return []
+    if isinstance(tags, list):
+        if not all(isinstance(tag, str) for tag in tags):
+            raise ValueError("Tags must be strings")
+        return [tag.strip() for tag in tags if tag.strip()]
+    if not isinstance(tags, str):
+        raise ValueError("Tags must be a list or a string")
+    tags = tags.strip()
+    if tags[:1] in ("[", "{", '"'):
+        parsed = json.loads(tags)
+        if not isinstance(parsed, list):
+            raise ValueError("JSON tags must be a list of strings")
+        return parse_tags(parsed)
+    return [tag.strip() for tag in tags.split(",") if tag.strip()]
+
+def make_item(image_path: str, caption: str = None, content: str = None,
+               emotional_tags=None, timestamp: str = None) -> Dict:
+    """An ingest item; one that can't be imported carries an `error` instead of failing the batch"""
+    image_path = os.path.abspath(image_path)
+    caption = caption or os.path.splitext(os.path.basename(image_path))[0]
+    item = {
+        "source_key": image_path,
+        "image_path": image_path,
+        "caption": caption,
+        "content": content or caption,
+        "emotional_tags": [],
+        "timestamp": None
+    }
+    try:
+        item["emotional_tags"] = parse_tags(emotional_tags)
+        item["timestamp"] = (
+            datetime.fromisoformat(timestamp) if timestamp
+            else datetime.fromtimestamp(os.path.getmtime(image_path))
+        )
+    except (OSError, ValueError) as e:
+        item["error"] = str(e)
+    return item
+
+def scan_directory(directory: str, emotional_tags=None) -> List[Dict]:
+    """Every image under `directory`; a sibling .txt file is used as the description"""
+    items = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            content = None
+            sidecar = os.path.join(root, f"{stem}.txt")
+            if os.path.exists(sidecar):
+                with open(sidecar, encoding="utf-8") as f:
+                    content = f.read().strip()
+            items.append(make_item(os.path.join(root, name), content=content,
+                                    emotional_tags=emotional_tags))
+    return items
+
+def read_manifest(path: str) -> List[Dict]:
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    return [
+        make_item(
+            os.path.join(base_dir, row["image_path"]),
+            caption=row.get("caption"),
+            content=row.get("content"),
+            emotional_tags=row.get("emotional_tags"),
+            timestamp=row.get("timestamp")
+        )
+        for row in rows
+    ]
+
+def _store_image(image_store, image_path: str) -> Tuple[str, Image.Image, str]:
+    """Copy the file into the image store and decode its model-resolution copy.
+
+    Returns (sha256 of the original, decoded image, stored original path).
+    """
+    stored = image_store.put_file(image_path)
+    with Image.open(image_store.model_copy(stored["original"])) as opened:
+        image = opened.convert("RGB")
+    return stored["sha256"], image, stored["original"]
+
+class BulkIngestor:
+    """Imports memories in chunks: parallel decode, batched inference, one commit per chunk"""
+
+    def __init__(self, memory_handler, chunk_size: int = INGEST_CHUNK_SIZE,
+                 decode_workers: int = DECODE_WORKERS):
+        self.memory_handler = memory_handler
+        self.chunk_size = chunk_size
+        self.decode_pool = ThreadPoolExecutor(decode_workers, thread_name_prefix="decode")
+
+    def _pending_items(self, items: List[Dict]) -> List[Dict]:
+        """Drop items that a previous run already imported"""
+        done = self.memory_handler.ingested_source_keys([item["source_key"] for item in items])
+        return [item for item in items if item["source_key"] not in done]
+
+    async def _decode_chunk(self, chunk: List[Dict], errors: List[Dict]) -> Tuple[List[Dict], List, List[str], List[str]]:
+        loop = asyncio.get_running_loop()
+        image_store = self.memory_handler.image_store
+        decoded = await asyncio.gather(
+            *[
+                loop.run_in_executor(self.decode_pool, _store_image, image_store, item["image_path"])
+                for item in chunk
+            ],
+            return_exceptions=True
+        )
+        items, images, digests, stored_paths = [], [], [], []
+        for item, result in zip(chunk, decoded):
+            if isinstance(result, Exception):
+                logging.error(f"Skipping {item['image_path']}: {str(result)}")
+                errors.append({"source_key": item["source_key"], "error": str(result)})
+                continue
+            items.append(item)
+            digests.append(result[0])
+            images.append(result[1])
+            stored_paths.append(result[2])
+        return items, images, digests, stored_paths
+
+    async def _ingest_chunk(self, chunk: List[Dict], errors: List[Dict]) -> int:
+        handler = self.memory_handler
+        items, images, digests, stored_paths = await self._decode_chunk(chunk, errors)
+        if not items:
+            return 0
+
+        text_analyses = await handler.run_inference(
+            "analyze_texts", [item["content"] for item in items]
+        )
+        if handler.image_analysis_enabled:
+            image_analyses = await handler.run_inference("analyze_images", images, digests)
+        else:
+            image_analyses = [handler.empty_image_analysis() for _ in items]
+        combined_analyses = await handler.run_inference(
+            "combine_analyses", text_analyses, image_analyses
+        )
+
+        memories = [
+            Memory(
+                image_path=stored_path,
+                caption=item["caption"],
+                content=item["content"],
+                emotional_tags=item["emotional_tags"],
+                timestamp=item["timestamp"],
+                text_embedding=text_analysis["text_embedding"],
+                image_embedding=image_analysis["image_embedding"],
+                suggested_tags=combined["primary_emotions"],
+                sentiment_scores=combined["emotion_scores"],
+                modality_scores=modality_scores(text_analysis, image_analysis)
+            )
+            for item, stored_path, text_analysis, image_analysis, combined
+            in zip(items, stored_paths, text_analyses, image_analyses, combined_analyses)
+        ]
+        await handler.run_io(
+            handler.store_memories, memories, [item["source_key"] for item in items]
+        )
+        return len(memories)
+
+    async def ingest(self, items: List[Dict], progress: Callable[[Dict], None] = None) -> Dict:
+        """Import `items`, reporting progress after each chunk; returns a summary"""
+        errors = [
+            {"source_key": item["source_key"], "error": item["error"]} for item in items if "error" in item
+        ]
+        # A source key is imported once; later repeats would violate ingest_records' unique key
+        unique = {}
+        for item in items:
+            if "error" not in item:
+                unique.setdefault(item["source_key"], item)
+        valid = list(unique.values())
+        pending = await self.memory_handler.run_io(self._pending_items, valid)
+        summary = {
+            "total": len(items),
+            "skipped": len(valid) - len(pending),
+            "duplicates": len(items) - len(errors) - len(valid),
+            "ingested": 0,
+            "failed": len(errors),
+            "items_per_sec": 0.0
+        }
+        started = time.perf_counter()
+        for start in range(0, len(pending), self.chunk_size):
+            chunk = pending[start:start + self.chunk_size]
+            try:
+                ingested = await self._ingest_chunk(chunk, errors)
+            except ExecutorSaturated as e:
+                # Backpressure: stop here; earlier chunks are committed and a rerun skips them
+                summary["errors"] = errors[:ERROR_REPORT_LIMIT]
+                e.summary = summary
+                raise
+            except Exception as e:
+                logging.error(f"Chunk of {len(chunk)} items failed: {str(e)}")
+                errors.extend({"source_key": item["source_key"], "error": str(e)} for item in chunk)
+                ingested = 0
+            summary["ingested"] += ingested
+            summary["failed"] += len(chunk) - ingested
+            summary["items_per_sec"] = summary["ingested"] / max(time.perf_counter() - started, 1e-9)
+            if progress:
+                progress(summary)
+        summary["errors"] = errors[:ERROR_REPORT_LIMIT]
+        return summary
+
+def _log_progress(summary: Dict):
+    done = summary["skipped"] + summary["duplicates"] + summary["ingested"] + summary["failed"]
+    logging.info(
+        f"{done}/{summary['total']} items ({summary['ingested']} ingested, "
+        f"{summary['failed']} failed) - {summary['items_per_sec']:.1f} items/sec"
+    )
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Bulk import memories into EmotionBank")
+    parser.add_argument("source", help="Photo directory or CSV/JSONL manifest")
+    parser.add_argument("--tags", default="", help="Comma-separated emotional tags for directory imports")
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    parser.add_argument("--decode-workers", type=int, default=DECODE_WORKERS)
+    args = parser.parse_args()
+
+    from database import SessionLocal, init_db
+    from emotion_tagging import EmotionAnalyzer
+    from memory_handler import MemoryHandler
+
+    if os.path.isdir(args.source):
+        source_items = scan_directory(args.source, args.tags)
+    else:
+        source_items = read_manifest(args.source)
+
+    init_db()
+    handler = MemoryHandler(SessionLocal, EmotionAnalyzer())
+    ingestor = BulkIngestor(handler, args.chunk_size, args.decode_workers)
+    result = asyncio.run(ingestor.ingest(source_items, progress=_log_progress))
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,91 @@
+"""Token-by-token text generation for the AI companion.
+
+The causal LM is called directly instead of through a pipeline so that
+each step feeds only the newest token. The attention keys and values of
+everything before it come from the KV cache returned by the previous
+step (`past_key_values`), so the prompt is encoded once and every later
+step costs the same whatever the length of the text so far.
+"""
+import os
+import logging
+import threading
+from typing import Iterator
+
+CHAT_MODEL_NAME = os.environ.get("EMOTIONBANK_CHAT_MODEL", "distilgpt2")
+CHAT_MAX_NEW_TOKENS = int(os.environ.get("EMOTIONBANK_CHAT_MAX_NEW_TOKENS", "96"))  # hard cap per request
+# Prompt plus reply must fit the model's context (1024 tokens for distilgpt2)
+CHAT_MAX_PROMPT_TOKENS = int(os.environ.get("EMOTIONBANK_CHAT_MAX_PROMPT_TOKENS", "768"))
+CHAT_TEMPERATURE = float(os.environ.get("EMOTIONBANK_CHAT_TEMPERATURE", "0.8"))  # 0 is greedy
+CHAT_TOP_K = 40
+# The reply ends where the model starts writing the user's next turn
+STOP_SEQUENCES = ("\nUser:", "\n\n")
+
+def _held_back(text: str) -> int:
+    """Length of the end of `text` that could still grow into a stop sequence"""
+    for length in range(min(len(text), max(map(len, STOP_SEQUENCES)) - 1), 0, -1):
+        if any(stop.startswith(text[-length:]) for stop in STOP_SEQUENCES):
+            return length
+    return 0
+
+class StreamingGenerator:
+    def __init__(self, model_name: str = CHAT_MODEL_NAME):
+        self.model_name = model_name
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._model is None:
+                from transformers import AutoTokenizer, AutoModelForCausalLM
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self._model = AutoModelForCausalLM.from_pretrained(self.model_name).eval()
+                logging.info(f"Loaded chat model {self.model_name}")
+
+    def _sample(self, logits) -> int:
+        import torch
+        if CHAT_TEMPERATURE <= 0:
+            return int(torch.argmax(logits))
+        values, indices = torch.topk(logits / CHAT_TEMPERATURE, min(CHAT_TOP_K, logits.shape[-1]))
+        return int(indices[torch.multinomial(torch.softmax(values, dim=-1), 1)])
+
+    def stream(self, prompt: str, max_new_tokens: int = CHAT_MAX_NEW_TOKENS) -> Iterator[str]:
+        """Yield the reply to `prompt` as text pieces, one decoding step at a time"""
+        import torch
+        self.load()
+        max_new_tokens = max(1, min(max_new_tokens, CHAT_MAX_NEW_TOKENS))
+        # Over-long prompts keep their end, which holds the user's message
+        step_input = self._tokenizer(prompt, return_tensors="pt").input_ids[:, -CHAT_MAX_PROMPT_TOKENS:]
+        past_key_values = None
+        generated = []
+        emitted = 0
+
+        for _ in range(max_new_tokens):
+            # Entered per step, never across a yield: streams sharing a worker
+            # thread interleave their steps, and grad mode is thread-local
+            with torch.inference_mode():
+                output = self._model(input_ids=step_input, past_key_values=past_key_values, use_cache=True)
+                past_key_values = output.past_key_values
+                token = self._sample(output.logits[0, -1])
+            if token == self._tokenizer.eos_token_id:
+                break
+            generated.append(token)
+            step_input = torch.tensor([[token]])
+
+            # Decode the whole reply so multi-token characters come out whole
+            text = self._tokenizer.decode(generated, skip_special_tokens=True)
+            stops = [text.find(stop) for stop in STOP_SEQUENCES if stop in text]
+            if stops:
+                if min(stops) > emitted:
+                    yield text[emitted:min(stops)]
+                return
+            if text.endswith("�"):
+                continue
+            ready = len(text) - _held_back(text)
+            if ready > emitted:
+                yield text[emitted:ready]
+                emitted = ready
+
+        text = self._tokenizer.decode(generated, skip_special_tokens=True)
+        if len(text) > emitted:
+            yield text[emitted:]
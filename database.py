@@ -1,29 +1,162 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Text, Date, DateTime, LargeBinary, Float, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker, deferred, relationship
+from sqlalchemy.types import TypeDecorator
+from embedding_codec import encode_embedding, decode_embedding
+from concurrent.futures import Future
+from contextlib import contextmanager
+import threading
 import logging
 import datetime
+import queue
+import json
+import os
 
-DATABASE_URL = "sqlite:///./memories.db"
+DATABASE_URL = os.environ.get("EMOTIONBANK_DATABASE_URL", "sqlite:///./memories.db")
+DB_POOL_SIZE = int(os.environ.get("EMOTIONBANK_DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("EMOTIONBANK_DB_MAX_OVERFLOW", "20"))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("EMOTIONBANK_DB_BUSY_TIMEOUT_MS", "5000"))
 
 # Database connection and session setup
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT_MS / 1000},
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True
+)
+
+@event.listens_for(engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets readers proceed while the writer commits; NORMAL sync is durable under WAL
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+@contextmanager
+def session_scope(session_factory=SessionLocal):
+    """One session per unit of work: commit on success, roll back on error, always close"""
+    session = session_factory()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+class SerializedWriter:
+    """Single thread that applies write jobs one at a time, each in its own transaction.
+
+    SQLite allows one writer at a time; funnelling inserts through one
+    thread avoids busy-lock retries between concurrent uploads while WAL
+    keeps reads running alongside.
+    """
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._worker.start()
+
+    def submit(self, fn, *args) -> Future:
+        """Queue `fn(session, *args)`; the future resolves to its return value after commit"""
+        future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            fn, args, future = job
+            try:
+                with session_scope(self.session_factory) as session:
+                    result = fn(session, *args)
+                future.set_result(result)
+            except Exception as e:
+                logging.error(f"Database write failed: {str(e)}")
+                future.set_exception(e)
+
+    def stop(self):
+        self._queue.put(None)
+        self._worker.join()
+
+class EmbeddingBlob(TypeDecorator):
+    """Vector stored as a binary blob with a dtype/dimension header"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_embedding(value)
+
+    def process_result_value(self, value, dialect):
+        return decode_embedding(value)
+
+class JSONText(TypeDecorator):
+    """Python list/dict serialized to JSON in a TEXT column"""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+
 # Define Memories table
 class Memory(Base):
     __tablename__ = "memories"
     id = Column(Integer, primary_key=True, index=True)
     caption = Column(Text, nullable=True)
     content = Column(Text, nullable=True)
-    emotional_tags = Column(Text, nullable=True)  # JSON stored as TEXT
-    suggested_tags = Column(Text, nullable=True)  # JSON stored as TEXT
+    emotional_tags = Column(JSONText, nullable=True)  # JSON stored as TEXT
+    suggested_tags = Column(JSONText, nullable=True)  # JSON stored as TEXT
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     image_path = Column(String, nullable=True)
-    text_embedding = Column(Text, nullable=True)  # JSON stored as TEXT
-    image_embedding = Column(Text, nullable=True)  # JSON stored as TEXT
-    sentiment_scores = Column(Text, nullable=True)  # JSON stored as TEXT
+    # Embeddings are deferred so listing queries don't load them
+    text_embedding = deferred(Column(EmbeddingBlob, nullable=True))
+    image_embedding = deferred(Column(EmbeddingBlob, nullable=True))
+    sentiment_scores = Column(JSONText, nullable=True)  # JSON stored as TEXT
+    modality_scores = relationship(
+        "MemoryModalityScores", uselist=False, cascade="all, delete-orphan", passive_deletes=True
+    )
+    # Keyset pagination walks memories newest first on (timestamp, id)
+    __table_args__ = (
+        Index("ix_memories_timestamp_id", "timestamp", "id"),
+    )
+
+# Normalized tags and emotion scores, one row per (memory, tag, source), for indexed filtering.
+# source is "user" (emotional_tags), "suggested" (suggested_tags) or "score" (sentiment_scores).
+class MemoryTag(Base):
+    __tablename__ = "memory_tags"
+    id = Column(Integer, primary_key=True)
+    memory_id = Column(Integer, ForeignKey("memories.id", ondelete="CASCADE"), nullable=False)
+    tag = Column(String, nullable=False)
+    source = Column(String, nullable=False)
+    score = Column(Float, nullable=True)
+    __table_args__ = (
+        Index("ix_memory_tags_lookup", "tag", "source", "score", "memory_id"),
+        Index("ix_memory_tags_memory_id", "memory_id"),
+    )
 
 # Define ChatHistory table
 class ChatHistory(Base):
@@ -32,7 +165,71 @@ class ChatHistory(Base):
     user_input = Column(Text, nullable=True)
     ai_response = Column(Text, nullable=True)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
-    related_memory_ids = Column(Text, nullable=True)  # JSON stored as TEXT
+    related_memory_ids = Column(JSONText, nullable=True)  # JSON stored as TEXT
+
+# Tracks which source items bulk ingestion has already imported, so runs can resume
+class IngestRecord(Base):
+    __tablename__ = "ingest_records"
+    id = Column(Integer, primary_key=True, index=True)
+    source_key = Column(String, nullable=False, unique=True, index=True)
+    memory_id = Column(Integer, nullable=False)
+    ingested_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# Per-modality emotion scores as dense float32 vectors over score_fusion.EMOTION_CATEGORIES,
+# kept so combined scores and suggested tags can be recomputed without re-running the models.
+# image_scores is NULL for memories stored without image analysis.
+class MemoryModalityScores(Base):
+    __tablename__ = "memory_modality_scores"
+    memory_id = Column(Integer, ForeignKey("memories.id", ondelete="CASCADE"), primary_key=True)
+    text_scores = Column(EmbeddingBlob, nullable=False)
+    image_scores = Column(EmbeddingBlob, nullable=True)
+
+# Precomputed nearest neighbours: each memory's top-k memories by text similarity, image
+# similarity and their rank fusion ("text", "image", "fused"), rank 0 first. score is the
+# similarity 1 / (1 + distance) for text and image and the fused score for "fused".
+class MemoryNeighbor(Base):
+    __tablename__ = "memory_neighbors"
+    memory_id = Column(Integer, ForeignKey("memories.id", ondelete="CASCADE"), primary_key=True)
+    kind = Column(String, primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    neighbor_id = Column(Integer, ForeignKey("memories.id", ondelete="CASCADE"), nullable=False)
+    score = Column(Float, nullable=False)
+    __table_args__ = (
+        Index("ix_memory_neighbors_neighbor_id", "neighbor_id"),
+    )
+
+# Per-emotion aggregates of combined emotion scores per day and per week (weeks start on Monday),
+# maintained in the same transaction as each memory insert
+class EmotionRollup(Base):
+    __tablename__ = "emotion_rollups"
+    period = Column(String, primary_key=True)
+    bucket_start = Column(Date, primary_key=True)
+    emotion = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_max = Column(Float, nullable=False, default=0.0)
+
+# Uploads accepted by POST /upload_memory/; background workers claim queued rows in order.
+# status is "queued", "running", "done" or "failed"; rows left running by a crash are requeued.
+class UploadJob(Base):
+    __tablename__ = "upload_jobs"
+    id = Column(String, primary_key=True)
+    status = Column(String, nullable=False, default="queued")
+    image_path = Column(String, nullable=True)
+    caption = Column(Text, nullable=True)
+    content = Column(Text, nullable=True)
+    emotional_tags = Column(JSONText, nullable=True)
+    timestamp = Column(DateTime, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    memory_id = Column(Integer, nullable=True)
+    result = Column(JSONText, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    __table_args__ = (
+        Index("ix_upload_jobs_status_created", "status", "created_at"),
+    )
 
 from sqlalchemy import inspect
 
@@ -54,9 +251,13 @@ def check_tables():
 def init_db():
     try:
         Base.metadata.create_all(bind=engine)
+        # create_all skips indexes added to tables that already exist
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
         check_tables()
         logging.info("Database tables created successfully.")
-        logging.info("Tables created: memories, chat_history")
+        logging.info("Tables created: memories, memory_tags, chat_history, ingest_records, memory_modality_scores, memory_neighbors, emotion_rollups, upload_jobs")
     except Exception as e:
         logging.error(f"Error creating database tables: {str(e)}")
 
@@ -0,0 +1,141 @@
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Cache configuration
+CACHE_MAX_ENTRIES = int(os.environ.get("EMOTIONBANK_CACHE_MAX_ENTRIES", "10000"))
+CACHE_DISK_PATH = os.environ.get("EMOTIONBANK_CACHE_DISK_PATH", "")  # empty disables the disk tier
+
+def text_digest(text: str) -> str:
+    """SHA-256 of the normalized text (NFC, collapsed whitespace)"""
+    normalized = " ".join(unicodedata.normalize("NFC", text).split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's raw bytes, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class EmbeddingCache:
+    """Two-tier cache of model outputs keyed by (model, revision, content hash).
+
+    The memory tier is a size-bounded LRU. The optional disk tier is a
+    SQLite file that survives restarts; hits there are promoted to memory.
+    Values must be JSON-serializable.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES,
+                 disk_path: Optional[str] = CACHE_DISK_PATH or None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "model TEXT NOT NULL, revision TEXT NOT NULL, digest TEXT NOT NULL, "
+                "value TEXT NOT NULL, PRIMARY KEY (model, revision, digest))"
+            )
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS model_revisions ("
+                "model TEXT PRIMARY KEY, revision TEXT NOT NULL)"
+            )
+            self._disk.commit()
+
+    def get(self, model: str, revision: str, digest: str):
+        key = (model, revision, digest)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT value FROM cache_entries WHERE model = ? AND revision = ? AND digest = ?",
+                    key
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, model: str, revision: str, digest: str, value):
+        key = (model, revision, digest)
+        with self._lock:
+            self._remember(key, value)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO cache_entries (model, revision, digest, value) VALUES (?, ?, ?, ?)",
+                    (model, revision, digest, json.dumps(value))
+                )
+                self._disk.commit()
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def register_model(self, model: str, revision: str):
+        """Record the loaded revision of a model, dropping entries from older revisions"""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == model and key[1] != revision]
+            for key in stale:
+                del self._entries[key]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT revision FROM model_revisions WHERE model = ?", (model,)
+                ).fetchone()
+                if row is not None and row[0] != revision:
+                    logging.info(f"Model {model} changed from {row[0]} to {revision}, invalidating cache")
+                self._disk.execute(
+                    "DELETE FROM cache_entries WHERE model = ? AND revision != ?", (model, revision)
+                )
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO model_revisions (model, revision) VALUES (?, ?)",
+                    (model, revision)
+                )
+                self._disk.commit()
+
+    def invalidate_model(self, model: str):
+        """Drop every cached entry produced by a model"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == model]:
+                del self._entries[key]
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM cache_entries WHERE model = ?", (model,))
+                self._disk.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "disk_tier": self._disk is not None
+            }
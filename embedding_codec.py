@@ -0,0 +1,39 @@
+import os
+import json
+import struct
+import numpy as np
+
+# Stored dtype for new embeddings: "float32" or "float16"
+EMBEDDING_DTYPE = os.environ.get("EMOTIONBANK_EMBEDDING_DTYPE", "float32")
+
+# Blob layout: 2-byte magic, format version, dtype code, uint32 dimension, raw little-endian values
+MAGIC = b"EB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<2sBBI")
+DTYPE_CODES = {
+    "float32": 1,
+    "float16": 2
+}
+CODE_DTYPES = {code: np.dtype(name).newbyteorder("<") for name, code in DTYPE_CODES.items()}
+
+def encode_embedding(vector, dtype: str = EMBEDDING_DTYPE) -> bytes:
+    """Pack a vector (list or array) into a self-describing binary blob"""
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    array = np.asarray(vector, dtype=np.dtype(dtype).newbyteorder("<")).ravel()
+    return HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[dtype], array.size) + array.tobytes()
+
+def decode_embedding(value) -> np.ndarray:
+    """Unpack a blob without copying; legacy JSON text is parsed as float32"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return np.asarray(json.loads(value), dtype=np.float32)
+
+    magic, version, dtype_code, dim = HEADER.unpack_from(value)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not an EmotionBank embedding blob")
+    return np.frombuffer(value, dtype=CODE_DTYPES[dtype_code], count=dim, offset=HEADER.size)
+
+def is_encoded(value) -> bool:
+    return isinstance(value, (bytes, memoryview)) and bytes(value[:2]) == MAGIC
@@ -4,127 +4,349 @@ import numpy as np
 from PIL import Image
 import torch
 from transformers import CLIPProcessor, CLIPModel
+from embedding_cache import EmbeddingCache, text_digest, file_digest
+from prompt_bank import PromptBank
+from image_preprocess import ClipPreprocessor
+from score_fusion import EMOTION_CATEGORIES, score_matrix, fuse_scores, scores_dict, tags_list
+from metrics import span
+import threading
 import logging
+import time
+import os
+
+EMOTION_MODEL_NAME = "bhadresh-savani/bert-base-uncased-emotion"
+TEXT_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+
+# Independently loadable model components, e.g. EMOTIONBANK_COMPONENTS=emotion,text for text-only
+COMPONENTS = ("emotion", "text", "clip")
+MODEL_COMPONENTS = {
+    EMOTION_MODEL_NAME: "emotion",
+    TEXT_MODEL_NAME: "text",
+    CLIP_MODEL_NAME: "clip"
+}
+ENABLED_COMPONENTS = tuple(
+    name.strip() for name in os.environ.get("EMOTIONBANK_COMPONENTS", ",".join(COMPONENTS)).split(",")
+    if name.strip()
+)
+
+# "torch" runs the models eagerly; "onnx" runs exported (optionally int8) models in ONNX Runtime
+INFERENCE_BACKEND = os.environ.get("EMOTIONBANK_BACKEND", "torch")
+
+def _model_revision(model) -> str:
+    """Hub commit hash of a loaded model, used to key cached outputs"""
+    revision = getattr(model.config, "_commit_hash", None) or "unknown"
+    backend_tag = getattr(model, "backend_tag", None)
+    return f"{revision}+{backend_tag}" if backend_tag else revision
 
 class EmotionAnalyzer:
-    def __init__(self):
-        # Initialize emotion classification model
-        self.emotion_classifier = pipeline(
-            "text-classification",
-            model="bhadresh-savani/bert-base-uncased-emotion",
-            return_all_scores=True
-        )
+    def __init__(self, cache: EmbeddingCache = None, components=ENABLED_COMPONENTS,
+                 lazy: bool = False, backend: str = INFERENCE_BACKEND):
+        unknown = set(components) - set(COMPONENTS)
+        if unknown:
+            raise ValueError(f"Unknown model components: {sorted(unknown)}")
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Unknown inference backend: {backend}")
+        self.components = tuple(components)
+        self.backend = backend
+        self._onnx_runtime = None
+
+        self.text_model_name = TEXT_MODEL_NAME
         
+        # Define emotion categories
+        self.emotion_categories = list(EMOTION_CATEGORIES)
+
+        # Cache model outputs by content hash, dropping entries from older model revisions
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.model_revisions = {}
+
+        # Models load on first use (lazy) or all at once here
+        self.load_timings = {}
+        self._loaded = set()
+        self._load_lock = threading.RLock()
+        if not lazy:
+            self.load()
+
+    def has_component(self, name: str) -> bool:
+        return name in self.components
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._loaded
+
+    def load_component(self, name: str):
+        """Load one model component if it is not loaded yet, recording how long it took"""
+        if name in self._loaded:
+            return
+        if name not in self.components:
+            raise RuntimeError(f"Model component '{name}' is disabled in this deployment")
+        with self._load_lock:
+            if name in self._loaded:
+                return
+            started = time.perf_counter()
+            getattr(self, f"_load_{name}")()
+            self.load_timings[name] = time.perf_counter() - started
+            self._loaded.add(name)
+            logging.info(f"Loaded model component '{name}' in {self.load_timings[name]:.2f}s")
+
+    def load(self) -> Dict:
+        """Load every enabled component; returns per-component load times in seconds"""
+        for name in self.components:
+            self.load_component(name)
+        return dict(self.load_timings)
+
+    def warm_up(self) -> Dict:
+        """Load every enabled component and push one dummy batch through each model"""
+        timings = self.load()
+        started = time.perf_counter()
+        with torch.no_grad():
+            if self.has_component("emotion"):
+                self._classify_emotions(["warm up"])
+            if self.has_component("text"):
+                self._embed_texts(["warm up"])
+            if self.has_component("clip"):
+                self._embed_images([Image.new("RGB", (224, 224))])
+        timings["warm_up"] = time.perf_counter() - started
+        return timings
+
+    def _register_revision(self, model_name: str, model):
+        self.model_revisions[model_name] = _model_revision(model)
+        self.cache.register_model(model_name, self.model_revisions[model_name])
+
+    @property
+    def onnx_runtime(self):
+        if self._onnx_runtime is None:
+            from onnx_backend import OnnxRuntime
+            self._onnx_runtime = OnnxRuntime()
+        return self._onnx_runtime
+
+    def _load_emotion(self):
+        # Initialize emotion classification model
+        if self.backend == "onnx":
+            from onnx_backend import OnnxEmotionClassifier
+            self._emotion_classifier = OnnxEmotionClassifier(EMOTION_MODEL_NAME, self.onnx_runtime)
+        else:
+            self._emotion_classifier = pipeline(
+                "text-classification",
+                model=EMOTION_MODEL_NAME,
+                return_all_scores=True
+            )
+        self._register_revision(EMOTION_MODEL_NAME, self._emotion_classifier.model)
+
+    def _load_text(self):
         # Initialize text embedding model for semantic search
-        self.text_model_name = "sentence-transformers/all-MiniLM-L6-v2"
-        self.text_tokenizer = AutoTokenizer.from_pretrained(self.text_model_name)
-        self.text_model = AutoModelForSequenceClassification.from_pretrained(self.text_model_name)
-        
+        self._text_tokenizer = AutoTokenizer.from_pretrained(self.text_model_name)
+        if self.backend == "onnx":
+            from onnx_backend import OnnxSequenceModel
+            self._text_model = OnnxSequenceModel(self.text_model_name, self._text_tokenizer, self.onnx_runtime)
+        else:
+            self._text_model = AutoModelForSequenceClassification.from_pretrained(self.text_model_name)
+        self._register_revision(self.text_model_name, self._text_model)
+
+    def _load_clip(self):
         # Initialize CLIP model for image-text alignment
-        self.clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        self.clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+        self._clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+        if self.backend == "onnx":
+            from onnx_backend import OnnxClipModel
+            self._clip_model = OnnxClipModel(CLIP_MODEL_NAME, self._clip_processor, self.onnx_runtime)
+        else:
+            self._clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+        self._clip_preprocessor = ClipPreprocessor(self._clip_processor.image_processor)
+        self._register_revision(CLIP_MODEL_NAME, self._clip_model)
+
+        # Emotion prompt embeddings never change for a given model, so load them once
+        self._prompt_bank = PromptBank(
+            CLIP_MODEL_NAME, self.model_revisions[CLIP_MODEL_NAME], self.emotion_categories
+        )
+        self._prompt_bank.load_or_build(self._encode_clip_texts)
+
+    @property
+    def emotion_classifier(self):
+        self.load_component("emotion")
+        return self._emotion_classifier
+
+    @property
+    def text_tokenizer(self):
+        self.load_component("text")
+        return self._text_tokenizer
+
+    @property
+    def text_model(self):
+        self.load_component("text")
+        return self._text_model
+
+    @property
+    def clip_model(self):
+        self.load_component("clip")
+        return self._clip_model
+
+    @property
+    def clip_processor(self):
+        self.load_component("clip")
+        return self._clip_processor
+
+    @property
+    def clip_preprocessor(self):
+        self.load_component("clip")
+        return self._clip_preprocessor
+
+    @property
+    def prompt_bank(self):
+        self.load_component("clip")
+        return self._prompt_bank
+
+    def _cached_batch(self, model_name: str, digests: List[str], items: List,
+                      compute_fn) -> List:
+        """Look up each item's output in the cache and compute only the unique misses"""
+        self.load_component(MODEL_COMPONENTS[model_name])
+        revision = self.model_revisions[model_name]
+        outputs = [self.cache.get(model_name, revision, digest) for digest in digests]
+
+        missing = {}
+        for digest, item, output in zip(digests, items, outputs):
+            if output is None and digest not in missing:
+                missing[digest] = item
+        if missing:
+            computed = dict(zip(missing, compute_fn(list(missing.values()))))
+            for digest, output in computed.items():
+                self.cache.put(model_name, revision, digest, output)
+            outputs = [
+                output if output is not None else computed[digest]
+                for digest, output in zip(digests, outputs)
+            ]
+        return outputs
+
+    def _classify_emotions(self, texts: List[str]) -> List[List[Dict]]:
+        classifier = self.emotion_classifier
+        with span("emotion.classify"):
+            return classifier(texts, batch_size=len(texts))
+
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        tokenizer, model = self.text_tokenizer, self.text_model
+        with span("text.tokenize"):
+            inputs = tokenizer(
+                texts,
+                padding=True,
+                truncation=True,
+                return_tensors="pt"
+            )
         
-        # Define emotion categories
-        self.emotion_categories = [
-            "joy", "sadness", "anger", "fear", "love", 
-            "surprise", "neutral", "anxiety", "gratitude"
-        ]
+        with span("text.forward"), torch.no_grad():
+            return model(**inputs).logits.numpy().tolist()
+
+    def _embed_images(self, images: List) -> List[List[float]]:
+        preprocessor, model = self.clip_preprocessor, self.clip_model
+        # Images (file paths or decoded PIL images) are decoded and normalized on the
+        # preprocessing pool, one batch ahead of the forward pass
+        features = []
+        batches = preprocessor.batches(images)
+        while True:
+            with span("clip.preprocess"):
+                pixel_values = next(batches, None)
+            if pixel_values is None:
+                break
+            with span("clip.forward"), torch.no_grad():
+                features.extend(model.get_image_features(pixel_values=pixel_values).tolist())
+        return features
+
+    def encode_clip_texts(self, texts: List[str]) -> np.ndarray:
+        """CLIP text-encoder features for a batch of texts"""
+        self.load_component("clip")
+        return self._encode_clip_texts(texts)
+
+    def _encode_clip_texts(self, texts: List[str]) -> np.ndarray:
+        # Called while the clip component is loading, so use the private attributes
+        text_inputs = self._clip_processor(
+            text=texts,
+            return_tensors="pt",
+            padding=True
+        )
+        with torch.no_grad():
+            return self._clip_model.get_text_features(**text_inputs).numpy()
 
     def analyze_text(self, text: str) -> Dict:
+        return self.analyze_texts([text])[0]
+
+    def analyze_texts(self, texts: List[str]) -> List[Dict]:
+        """Analyze a batch of texts with one forward pass per model"""
+        digests = [text_digest(text) for text in texts]
+
         # Get detailed emotion analysis
-        emotion_scores = self.emotion_classifier(text)[0]
+        batch_emotion_scores = self._cached_batch(
+            EMOTION_MODEL_NAME, digests, texts, self._classify_emotions
+        )
         
         # Generate text embeddings for semantic search
-        inputs = self.text_tokenizer(
-            text,
-            padding=True,
-            truncation=True,
-            return_tensors="pt"
+        text_embeddings = self._cached_batch(
+            self.text_model_name, digests, texts, self._embed_texts
         )
         
-        with torch.no_grad():
-            text_embedding = self.text_model(**inputs).logits[0].numpy()
-        
-        # Get primary emotions (those with score > threshold)
-        threshold = 0.2
-        primary_emotions = [
-            score["label"] for score in emotion_scores 
-            if score["score"] > threshold
-        ]
-        
-        return {
-            "emotion_tags": primary_emotions,
-            "emotion_scores": {
-                score["label"]: score["score"] 
-                for score in emotion_scores
-            },
-            "text_embedding": text_embedding.tolist()
-        }
-
-    def analyze_image(self, image_path: str) -> Dict:
-        try:
-            # Log the image path
-            logging.info(f"Starting image analysis for: {image_path}")
-            print(image_path)
-
-            # Load and process image
-            image = Image.open(image_path).convert('RGB')
-            logging.info(f"Image loaded successfully. Image size: {image.size}, Mode: {image.mode}")
-            print(image)
-
-            inputs = self.clip_processor(images=image, return_tensors="pt")
-            logging.info(f"Inputs processed successfully. Inputs keys: {inputs.keys()}")
-
-            # Generate image embeddings
-            with torch.no_grad():
-                image_features = self.clip_model.get_image_features(**inputs)
-            logging.info(f"Image features generated. Shape: {image_features.shape}")
-
-            # Prepare emotion-related text prompts
-            emotion_prompts = [
-                f"an image expressing {emotion}"
-                for emotion in self.emotion_categories
+        results = []
+        for emotion_scores, text_embedding in zip(batch_emotion_scores, text_embeddings):
+            # Get primary emotions (those with score > threshold)
+            threshold = 0.2
+            primary_emotions = [
+                score["label"] for score in emotion_scores 
+                if score["score"] > threshold
             ]
-            logging.info(f"Emotion prompts prepared: {emotion_prompts}")
+            
+            results.append({
+                "emotion_tags": primary_emotions,
+                "emotion_scores": {
+                    score["label"]: score["score"] 
+                    for score in emotion_scores
+                },
+                "text_embedding": text_embedding
+            })
+        return results
 
-            text_inputs = self.clip_processor(
-                text=emotion_prompts,
-                return_tensors="pt",
-                padding=True
-            )
-            logging.info(f"Text inputs processed. Shape: {text_inputs['input_ids'].shape}")
+    def analyze_image(self, image_path: str, digest: str = None) -> Dict:
+        return self.analyze_images([image_path], None if digest is None else [digest])[0]
 
-            # Get text features for emotion prompts
-            with torch.no_grad():
-                text_features = self.clip_model.get_text_features(**text_inputs)
-            logging.info(f"Text features generated. Shape: {text_features.shape}")
+    def analyze_images(self, image_paths: List, digests: List[str] = None) -> List[Dict]:
+        """Analyze a batch of images with one CLIP forward pass.
 
-            # Calculate similarity scores
-            similarity = torch.nn.functional.cosine_similarity(
-                image_features, text_features, dim=1  # Ensure dimension matches
+        Items may be file paths or decoded PIL images; decoded images must
+        come with the SHA-256 digests of their source bytes. Paths whose
+        digest is missing or None are hashed here.
+        """
+        try:
+            # Generate image embeddings, keyed by the original image's bytes
+            digests = list(digests) if digests is not None else [None] * len(image_paths)
+            if any(digest is None for digest in digests):
+                with span("clip.hash"):
+                    digests = [
+                        file_digest(image_path) if digest is None else digest
+                        for image_path, digest in zip(image_paths, digests)
+                    ]
+            image_features = self._cached_batch(
+                CLIP_MODEL_NAME, digests, image_paths, self._embed_images
             )
-            logging.info(f"Similarity scores calculated. Shape: {similarity.shape}, Values: {similarity}")
 
-            # Get emotion scores
-            emotion_scores = {
-                emotion: score.item()
-                for emotion, score in zip(self.emotion_categories, similarity)
-            }
-            logging.info(f"Emotion scores: {emotion_scores}")
+            # Calculate similarity scores against the prompt bank (images x emotions)
+            with span("clip.score"):
+                similarity = self.prompt_bank.score(np.array(image_features))
 
-            # Get primary emotions (those with score > threshold)
-            threshold = 0.2
-            primary_emotions = [
-                emotion for emotion, score in emotion_scores.items()
-                if score > threshold
-            ]
-            logging.info(f"Primary emotions: {primary_emotions}")
+            results = []
+            for features, scores in zip(image_features, similarity):
+                # Get emotion scores
+                emotion_scores = {
+                    emotion: float(score)
+                    for emotion, score in zip(self.emotion_categories, scores)
+                }
 
-            return {
-                "image_embedding": image_features[0].tolist(),
-                "emotion_scores": emotion_scores,
-                "primary_emotions": primary_emotions
-            }
+                # Get primary emotions (those with score > threshold)
+                threshold = 0.2
+                primary_emotions = [
+                    emotion for emotion, score in emotion_scores.items()
+                    if score > threshold
+                ]
+
+                results.append({
+                    "image_embedding": features,
+                    "emotion_scores": emotion_scores,
+                    "primary_emotions": primary_emotions
+                })
+            return results
 
         except Exception as e:
             logging.error(f"Error analyzing image: {str(e)}", exc_info=True)
@@ -132,28 +354,20 @@ class EmotionAnalyzer:
 
     def combine_analysis(self, text_analysis: Dict, image_analysis: Dict) -> Dict:
         """Combine text and image analysis for overall emotional context"""
-        # Combine emotion scores with weights
-        text_weight = 0.6
-        image_weight = 0.4
-        
-        combined_scores = {}
-        for emotion in self.emotion_categories:
-            text_score = text_analysis["emotion_scores"].get(emotion, 0)
-            image_score = image_analysis["emotion_scores"].get(emotion, 0)
-            combined_scores[emotion] = (
-                text_score * text_weight + image_score * image_weight
-            )
-        
-        # Get primary emotions from combined scores
-        threshold = 0.2
-        primary_emotions = [
-            emotion for emotion, score in combined_scores.items()
-            if score > threshold
+        return self.combine_analyses([text_analysis], [image_analysis])[0]
+
+    def combine_analyses(self, text_analyses: List[Dict], image_analyses: List[Dict]) -> List[Dict]:
+        """Weighted fusion of per-modality scores for a batch, as one matrix expression"""
+        text_scores = score_matrix(analysis["emotion_scores"] for analysis in text_analyses)
+        image_scores = score_matrix(analysis["emotion_scores"] for analysis in image_analyses)
+        combined, suggested = fuse_scores(text_scores, image_scores)
+        return [
+            {
+                "primary_emotions": tags_list(suggested_row),
+                "emotion_scores": scores_dict(combined_row),
+                "text_analysis": text_analysis,
+                "image_analysis": image_analysis
+            }
+            for combined_row, suggested_row, text_analysis, image_analysis
+            in zip(combined, suggested, text_analyses, image_analyses)
         ]
-        
-        return {
-            "primary_emotions": primary_emotions,
-            "emotion_scores": combined_scores,
-            "text_analysis": text_analysis,
-            "image_analysis": image_analysis
-        }
\ No newline at end of file
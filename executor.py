@@ -0,0 +1,169 @@
+import os
+import asyncio
+import contextvars
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict
+
+# Execution layer configuration
+IO_WORKERS = int(os.environ.get("EMOTIONBANK_IO_WORKERS", "8"))
+INFERENCE_MODE = os.environ.get("EMOTIONBANK_INFERENCE_MODE", "thread")  # "thread" or "process"
+# Thread workers share one analyzer; process workers each load a full copy
+# of the models, so process mode defaults to as many as cores and memory allow
+THREAD_INFERENCE_WORKERS = int(os.environ.get("EMOTIONBANK_THREAD_INFERENCE_WORKERS", "16"))
+PROCESS_WORKER_MEMORY_MB = int(os.environ.get("EMOTIONBANK_PROCESS_WORKER_MEMORY_MB", "1500"))
+PREPARE_TIMEOUT_S = 600
+MAX_PENDING = int(os.environ.get("EMOTIONBANK_MAX_PENDING", "64"))
+
+class ExecutorSaturated(Exception):
+    """Raised when the bounded work queue is full"""
+
+def default_inference_workers(inference_mode: str) -> int:
+    """EMOTIONBANK_INFERENCE_WORKERS, else a default for the mode"""
+    if "EMOTIONBANK_INFERENCE_WORKERS" in os.environ:
+        return int(os.environ["EMOTIONBANK_INFERENCE_WORKERS"])
+    if inference_mode == "thread":
+        return THREAD_INFERENCE_WORKERS
+    workers = max(1, (os.cpu_count() or 2) // 2)
+    try:
+        available_mb = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+        workers = min(workers, available_mb // PROCESS_WORKER_MEMORY_MB)
+    except (ValueError, OSError, AttributeError):
+        pass  # No sysconf memory figures on this platform; go by cores alone
+    return max(1, workers)
+
+# Analyzer owned by each inference worker process
+_worker_analyzer = None
+# Shared by all workers so a warm-up task per worker can't land twice on one process
+_worker_barrier = None
+
+def _init_inference_worker(barrier):
+    global _worker_analyzer, _worker_barrier
+    from emotion_tagging import EmotionAnalyzer
+    _worker_analyzer = EmotionAnalyzer()
+    _worker_barrier = barrier
+    logging.info(f"Inference worker {os.getpid()} loaded models")
+
+def _call_worker_analyzer(method: str, *args):
+    return getattr(_worker_analyzer, method)(*args)
+
+def _prepare_worker(method: str) -> Dict:
+    timings = _call_worker_analyzer(method)
+    # Hold this worker until every other one has taken its own task
+    _worker_barrier.wait(PREPARE_TIMEOUT_S)
+    return timings
+
+class ExecutionLayer:
+    """Runs blocking work off the event loop.
+
+    I/O-bound calls (SQLAlchemy, ChromaDB) go to a thread pool. Model
+    inference goes either to a thread pool calling the shared analyzer
+    (so concurrent calls can still join a micro-batch) or to a process
+    pool where every worker loads its own EmotionAnalyzer. Both share a
+    bounded pending count; submissions beyond it raise ExecutorSaturated.
+    """
+
+    def __init__(self, analyzer=None,
+                 io_workers: int = IO_WORKERS,
+                 inference_mode: str = INFERENCE_MODE,
+                 inference_workers: int = None,
+                 max_pending: int = MAX_PENDING):
+        if inference_mode not in ("thread", "process"):
+            raise ValueError(f"Unknown inference mode: {inference_mode}")
+        if inference_mode == "thread" and analyzer is None:
+            raise ValueError("Thread inference mode needs an analyzer instance")
+
+        if inference_workers is None:
+            inference_workers = default_inference_workers(inference_mode)
+
+        self.analyzer = analyzer
+        self.inference_mode = inference_mode
+        self.inference_workers = inference_workers
+        self.max_pending = max_pending
+        self.io_pool = ThreadPoolExecutor(io_workers, thread_name_prefix="io")
+        if inference_mode == "process":
+            context = multiprocessing.get_context("spawn")
+            self.inference_pool = ProcessPoolExecutor(
+                inference_workers,
+                mp_context=context,
+                initializer=_init_inference_worker,
+                initargs=(context.Barrier(inference_workers),)
+            )
+        else:
+            self.inference_pool = ThreadPoolExecutor(
+                inference_workers, thread_name_prefix="inference"
+            )
+        self._pending = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise ExecutorSaturated(
+                    f"Work queue full ({self._pending}/{self.max_pending} pending)"
+                )
+            self._pending += 1
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    async def _submit(self, pool, fn: Callable, *args):
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            if isinstance(pool, ThreadPoolExecutor):
+                # Carry the request's trace into the worker thread so its spans are recorded
+                return await loop.run_in_executor(pool, contextvars.copy_context().run, fn, *args)
+            return await loop.run_in_executor(pool, fn, *args)
+        finally:
+            self._release()
+
+    async def run_io(self, fn: Callable, *args, **kwargs):
+        """Run a blocking database or vector store call on the I/O pool"""
+        return await self._submit(self.io_pool, partial(fn, *args, **kwargs))
+
+    async def run_inference(self, method: str, *args):
+        """Run an EmotionAnalyzer method on the inference pool"""
+        if self.inference_mode == "process":
+            return await self._submit(self.inference_pool, _call_worker_analyzer, method, *args)
+        return await self._submit(self.inference_pool, getattr(self.analyzer, method), *args)
+
+    async def prepare(self, method: str) -> Dict:
+        """Run the analyzer's `load` or `warm_up` on every inference worker; returns per-component seconds.
+
+        Thread workers share one analyzer, so one call covers them. Each
+        process worker gets its own call, and the slowest time per
+        component is reported.
+        """
+        if self.inference_mode == "thread":
+            return await self.run_inference(method)
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self.inference_pool, _prepare_worker, method)
+            for _ in range(self.inference_workers)
+        ])
+        timings = {}
+        for worker_timings in results:
+            for component, seconds in (worker_timings or {}).items():
+                timings[component] = max(seconds, timings.get(component, seconds))
+        return timings
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "inference_mode": self.inference_mode,
+                "inference_workers": self.inference_workers,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "rejected": self._rejected
+            }
+
+    def shutdown(self):
+        self.io_pool.shutdown(wait=True)
+        self.inference_pool.shutdown(wait=True)
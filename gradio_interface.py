@@ -2,11 +2,12 @@ import gradio as gr
 import requests
 import json
 import os
-import shutil
 import time
 
 API_URL = "http://127.0.0.1:8000"
-UPLOAD_FOLDER = "./uploads/images"  # Directory to save uploaded files
+JOB_POLL_INTERVAL = 0.5  # Seconds between upload job status checks
+JOB_POLL_TIMEOUT = 120
+BROWSE_PAGE_SIZE = 24
 
 def check_api_connection():
     try:
@@ -31,42 +32,45 @@ def upload_memory(caption, content, emotional_tags, file):
         return {"error": "Please upload an image"}
     
     try:
-        # Ensure the upload directory exists
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-        
-        current_directory = os.getcwd() 
-
-        # Construct the full path to the upload folder
-        upload_folder = os.path.join(current_directory, "uploads\\images") 
-
-        # Generate unique filename while preserving original filename
-        timestamp = str(int(time.time()))
-        original_filename = os.path.basename(file.name)
-        temp_filename = f"{timestamp}_{original_filename}"
-
-        temp_file_path = f"{upload_folder}\\{temp_filename}"  # Using `/` explicitly
-        
-        # Copy the uploaded file to temp location using simple copy
-        shutil.copy2(file.name, temp_file_path)
-        
         tags = [tag.strip() for tag in emotional_tags.split(',')]
         data = {
-            'image_path':temp_file_path,
             'caption': caption,
             'content': content,
             'emotional_tags': json.dumps(tags)
         }
         
-        response = requests.post(f"{API_URL}/upload_memory/", 
-                              data=data)
+        # Stream the file to the API, which stores each distinct image once
+        with open(file.name, "rb") as image:
+            response = requests.post(f"{API_URL}/upload_memory/", 
+                                  data=data,
+                                  files={'image': (os.path.basename(file.name), image)})
+        if response.status_code != 202:
+            return response.json()
         
-        return response.json()
+        return wait_for_job(response.json()["status_url"])
         
-    except shutil.SameFileError:
-        return {"error": "Source and destination file are the same"}
     except Exception as e:
         return {"error": f"An error occurred: {str(e)}"}
 
+def wait_for_job(status_url):
+    """Poll an upload job until it finishes; returns its result or error"""
+    deadline = time.time() + JOB_POLL_TIMEOUT
+    while time.time() < deadline:
+        job = requests.get(f"{API_URL}{status_url}").json()
+        if job["status"] == "done":
+            return job["result"] or {"id": job["memory_id"]}
+        if job["status"] == "failed":
+            return {"error": job["error"]}
+        time.sleep(JOB_POLL_INTERVAL)
+    return {"error": "Upload is still processing, check back later", "job": status_url}
+
+def _gallery_items(memories):
+    # Thumbnails keep the gallery light; older memories outside the image store have none
+    return [
+        (memory.get("thumbnail_path") or memory["image_path"], memory["caption"])
+        for memory in memories if memory.get("image_path")
+    ]
+
 @handle_api_error
 def search_memories(query):
     response = requests.get(f"{API_URL}/retrieve_memories/", 
@@ -75,21 +79,73 @@ def search_memories(query):
     
     gallery_items = []
     if memories and isinstance(memories, list):
-        for memory in memories:
-            if "image_path" in memory:
-                gallery_items.append((memory["image_path"], memory["caption"]))
+        gallery_items = _gallery_items(memories)
     
     return gallery_items, memories
 
-@handle_api_error
+def show_page(cursors):
+    """Render the page whose starting cursor is last in `cursors`; only that page is held in memory"""
+    try:
+        response = requests.get(f"{API_URL}/memories",
+                                params={"cursor": cursors[-1], "limit": BROWSE_PAGE_SIZE})
+        page = response.json()
+    except requests.exceptions.ConnectionError:
+        return [], {"error": "Cannot connect to the backend server."}, cursors, None, ""
+    if "items" not in page:
+        return [], page, cursors, None, ""
+    label = f"Page {len(cursors)}" + ("" if page["next_cursor"] else " (last)")
+    return _gallery_items(page["items"]), page["items"], cursors, page["next_cursor"], label
+
+def first_page():
+    return show_page([None])
+
+def next_page(cursors, next_cursor):
+    if next_cursor:
+        cursors = cursors + [next_cursor]
+    return show_page(cursors)
+
+def previous_page(cursors):
+    if len(cursors) > 1:
+        cursors = cursors[:-1]
+    return show_page(cursors)
+
+def _sse_events(response):
+    """(event, data) pairs from a text/event-stream response"""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
 def chat_with_ai(user_input, history):
-    response = requests.get(f"{API_URL}/chat/", 
-                         params={"user_input": user_input})
-    ai_response = response.json()
-    
-    history.append((user_input, ai_response["message"]))
-    
-    return history, ai_response.get("related_memories", [])
+    # A generator, so the reply renders piece by piece as the server streams it
+    history = history + [(user_input, "")]
+    related = []
+    try:
+        with requests.get(f"{API_URL}/chat/stream", params={"user_input": user_input},
+                          stream=True) as response:
+            if response.status_code != 200:
+                history[-1] = (user_input, f"Error: {response.json().get('detail')}")
+                yield history, related
+                return
+            for event, data in _sse_events(response):
+                if event == "context":
+                    related = data["related_memories"]
+                elif event == "token":
+                    history[-1] = (user_input, history[-1][1] + data["text"])
+                elif event == "done":
+                    history[-1] = (user_input, data["message"])
+                elif event == "error":
+                    history[-1] = (user_input, f"Error: {data['detail']}")
+                yield history, related
+    except requests.exceptions.ConnectionError:
+        history[-1] = (user_input, "Cannot connect to the backend server. Please ensure the FastAPI server is running.")
+        yield history, related
 
 def create_interface():
     with gr.Blocks(theme=gr.themes.Soft()) as demo:
@@ -115,9 +171,19 @@ def create_interface():
                     search_text = gr.Textbox(label="Search Memories", placeholder="Search by text or emotion...")
                     search_button = gr.Button("Search")
                 
+                with gr.Row():
+                    newest_button = gr.Button("Newest")
+                    previous_button = gr.Button("Previous Page")
+                    next_button = gr.Button("Next Page")
+                    page_label = gr.Markdown("")
+                
                 with gr.Row():
                     memories_gallery = gr.Gallery(label="Found Memories")
                     memory_details = gr.JSON(label="Memory Details")
+                
+                # Cursors of the pages visited so far, so Previous can step back
+                page_cursors = gr.State([None])
+                next_cursor = gr.State(None)
 
             # AI Companion Tab
             with gr.Tab("Chat & Reflect"):
@@ -137,6 +203,11 @@ def create_interface():
                           inputs=search_text,
                           outputs=[memories_gallery, memory_details])
         
+        page_outputs = [memories_gallery, memory_details, page_cursors, next_cursor, page_label]
+        newest_button.click(first_page, outputs=page_outputs)
+        next_button.click(next_page, inputs=[page_cursors, next_cursor], outputs=page_outputs)
+        previous_button.click(previous_page, inputs=page_cursors, outputs=page_outputs)
+        
         chat_button.click(chat_with_ai,
                         inputs=[user_message, chat_history],
                         outputs=[chat_history, related_memories])
@@ -145,4 +216,6 @@ def create_interface():
 
 if __name__ == "__main__":
     demo = create_interface()
+    # Generator handlers (the streaming chat) need the queue
+    demo.queue()
     demo.launch(show_error=True)
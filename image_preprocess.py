@@ -0,0 +1,90 @@
+"""CLIP image preprocessing without full-resolution decodes.
+
+CLIPProcessor decodes every photo at full size and then resizes it. Here
+JPEGs are decoded in draft mode, which lets libjpeg scale by 1/2, 1/4 or
+1/8 during the DCT, to the smallest size that still covers the model
+resolution. EXIF orientation is applied and the image is resized and
+center-cropped. It is then normalized straight into its slot of a batch
+array allocated once per batch. Batches are prepared on a thread pool
+(decode and resize release the GIL), so the next batch is ready while the
+model runs on the current one.
+
+The output matches CLIPProcessor's resize -> center crop -> rescale ->
+normalize; draft decoding only changes which pixels feed the resize.
+"""
+import os
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Union
+import numpy as np
+import torch
+from PIL import Image, ImageOps
+
+PREPROCESS_WORKERS = int(os.environ.get("EMOTIONBANK_PREPROCESS_WORKERS", str(min(8, os.cpu_count() or 4))))
+CLIP_BATCH_SIZE = int(os.environ.get("EMOTIONBANK_CLIP_BATCH_SIZE", "32"))
+
+def _size(value, key: str) -> int:
+    return value[key] if isinstance(value, dict) else int(value)
+
+class ClipPreprocessor:
+    def __init__(self, image_processor, workers: int = PREPROCESS_WORKERS):
+        self.shortest_edge = _size(image_processor.size, "shortest_edge")
+        self.crop_height = _size(image_processor.crop_size, "height")
+        self.crop_width = _size(image_processor.crop_size, "width")
+        self.resample = getattr(image_processor, "resample", Image.BICUBIC)
+        # Fold rescale (x / 255) and normalize ((x - mean) / std) into one multiply-add
+        mean = np.asarray(image_processor.image_mean, dtype=np.float32)
+        std = np.asarray(image_processor.image_std, dtype=np.float32)
+        self._scale = (1.0 / (255.0 * std)).reshape(3, 1, 1)
+        self._offset = (-mean / std).reshape(3, 1, 1)
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="clip-preprocess")
+        # Drives whole batches for batches(); separate from the per-image pool it waits on
+        self.prefetch_pool = ThreadPoolExecutor(2, thread_name_prefix="clip-prefetch")
+
+    def load(self, image: Union[str, Image.Image]) -> Image.Image:
+        """Decode at the smallest size that covers the model resolution, upright and RGB"""
+        if isinstance(image, str):
+            # convert() decodes into a new image, so the file can close on return
+            with Image.open(image) as opened:
+                if opened.format == "JPEG":
+                    width, height = opened.size
+                    scale = self.shortest_edge / min(width, height)
+                    if scale < 1:
+                        opened.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+                return ImageOps.exif_transpose(opened).convert("RGB")
+        return ImageOps.exif_transpose(image).convert("RGB")
+
+    def _resize_and_crop(self, image: Image.Image) -> Image.Image:
+        width, height = image.size
+        scale = self.shortest_edge / min(width, height)
+        size = (max(self.crop_width, round(width * scale)), max(self.crop_height, round(height * scale)))
+        if size != image.size:
+            image = image.resize(size, self.resample)
+        left = (image.width - self.crop_width) // 2
+        top = (image.height - self.crop_height) // 2
+        return image.crop((left, top, left + self.crop_width, top + self.crop_height))
+
+    def _fill(self, image, out: np.ndarray):
+        pixels = np.asarray(self._resize_and_crop(self.load(image)), dtype=np.float32)
+        # HWC uint8 -> normalized CHW, written into this image's slot of the batch
+        np.multiply(pixels.transpose(2, 0, 1), self._scale, out=out)
+        out += self._offset
+
+    def preprocess(self, images: List) -> torch.Tensor:
+        """pixel_values for a batch of paths or PIL images, decoded in parallel"""
+        batch = np.empty((len(images), 3, self.crop_height, self.crop_width), dtype=np.float32)
+        for future in [self.pool.submit(self._fill, image, batch[i]) for i, image in enumerate(images)]:
+            future.result()
+        return torch.from_numpy(batch)
+
+    def batches(self, images: List, batch_size: int = CLIP_BATCH_SIZE):
+        """Yield pixel_values batch by batch, preparing the next batch while the caller uses this one"""
+        chunks = [images[start:start + batch_size] for start in range(0, len(images), batch_size)]
+        if not chunks:
+            return
+        pending: Future = self.prefetch_pool.submit(self.preprocess, chunks[0])
+        for next_chunk in chunks[1:]:
+            current = pending.result()
+            pending = self.prefetch_pool.submit(self.preprocess, next_chunk)
+            yield current
+        yield pending.result()
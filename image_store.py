@@ -0,0 +1,165 @@
+"""Content-addressed image store.
+
+Originals are streamed into the store in fixed-size chunks, hashed on the
+fly, and kept once per distinct SHA-256 under a two-level sharded layout:
+
+    <root>/originals/ab/cd/abcd....jpg
+    <root>/thumbnails/ab/cd/abcd....jpg    longest side THUMBNAIL_SIZE, for galleries
+    <root>/model/ab/cd/abcd....jpg         shortest side MODEL_IMAGE_SIZE, for CLIP
+
+The model copy is resized the way the CLIP processor resizes (shortest
+side to 224) so its center crop sees the same pixels as the original
+would, while the analyzer decodes a small file instead of a full photo.
+Derivatives are written on first use and reused for duplicate uploads.
+"""
+import os
+import uuid
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+import aiofiles
+from PIL import Image, ImageOps
+
+IMAGE_STORE_DIR = os.environ.get("EMOTIONBANK_IMAGE_STORE_DIR", "./uploads/store")
+THUMBNAIL_SIZE = int(os.environ.get("EMOTIONBANK_THUMBNAIL_SIZE", "256"))
+MODEL_IMAGE_SIZE = int(os.environ.get("EMOTIONBANK_MODEL_IMAGE_SIZE", "224"))
+COPY_CHUNK_SIZE = 1 << 20
+EXTENSION_ALIASES = {".jpeg": ".jpg", ".tif": ".tiff"}
+
+def _normalize_extension(filename: str) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return EXTENSION_ALIASES.get(ext, ext) or ".jpg"
+
+class ImageStore:
+    def __init__(self, root: str = IMAGE_STORE_DIR, thumbnail_size: int = THUMBNAIL_SIZE,
+                 model_image_size: int = MODEL_IMAGE_SIZE):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+        self.model_image_size = model_image_size
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def _path(self, kind: str, digest: str, ext: str) -> str:
+        return os.path.join(self.root, kind, digest[:2], digest[2:4], f"{digest}{ext}")
+
+    def _tmp_path(self) -> str:
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    @staticmethod
+    def discard(tmp_path: str):
+        """Remove a temporary file left by a failed write"""
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def digest_of(self, path: str) -> Optional[str]:
+        """SHA-256 of a stored original, read from its name; None for files outside the store"""
+        originals = os.path.abspath(os.path.join(self.root, "originals"))
+        if not os.path.abspath(path).startswith(originals + os.sep):
+            return None
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return stem if len(stem) == 64 else None
+
+    # Adding originals
+
+    def put_file(self, source_path: str) -> Dict:
+        """Copy a file into the store in chunks, hashing as it goes"""
+        tmp_path = self._tmp_path()
+        sha256 = hashlib.sha256()
+        try:
+            with open(source_path, "rb") as source, open(tmp_path, "wb") as target:
+                while True:
+                    chunk = source.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    target.write(chunk)
+            return self.commit(tmp_path, sha256.hexdigest(), _normalize_extension(source_path))
+        finally:
+            # Gone after a successful commit; left behind only when copying or committing failed
+            self.discard(tmp_path)
+
+    async def receive_upload(self, upload) -> Tuple[str, str, str]:
+        """Stream an UploadFile to a temporary file; returns (tmp_path, sha256, extension) for commit()"""
+        tmp_path = self._tmp_path()
+        sha256 = hashlib.sha256()
+        try:
+            async with aiofiles.open(tmp_path, "wb") as target:
+                while True:
+                    chunk = await upload.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    await target.write(chunk)
+        except BaseException:
+            self.discard(tmp_path)
+            raise
+        return tmp_path, sha256.hexdigest(), _normalize_extension(upload.filename)
+
+    def commit(self, tmp_path: str, digest: str, ext: str) -> Dict:
+        """Move a received file into place, or drop it if the content is already stored"""
+        original = self._path("originals", digest, ext)
+        deduplicated = os.path.exists(original)
+        try:
+            if deduplicated:
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(original), exist_ok=True)
+                os.replace(tmp_path, original)
+        finally:
+            self.discard(tmp_path)
+        return {"sha256": digest, "original": original, "deduplicated": deduplicated}
+
+    # Derivatives
+
+    def thumbnail_path(self, path: str) -> Optional[str]:
+        """Thumbnail of a stored original if it has been generated"""
+        digest = self.digest_of(path)
+        if digest is None:
+            return None
+        thumbnail = self._path("thumbnails", digest, ".jpg")
+        return thumbnail if os.path.exists(thumbnail) else None
+
+    def model_copy(self, path: str) -> str:
+        """Path the analyzer should read for `path`: the model-resolution copy for stored
+        originals (writing both derivatives on first use), otherwise `path` itself"""
+        digest = self.digest_of(path)
+        if digest is None:
+            return path
+        model_path = self._path("model", digest, ".jpg")
+        thumbnail = self._path("thumbnails", digest, ".jpg")
+        if os.path.exists(model_path) and os.path.exists(thumbnail):
+            return model_path
+
+        with Image.open(path) as image:
+            if image.format == "JPEG":
+                # Decode only as large as the bigger of the two derivatives needs
+                width, height = image.size
+                scale = max(self.model_image_size / min(width, height), self.thumbnail_size / max(width, height))
+                if scale < 1:
+                    image.draft("RGB", (round(width * scale), round(height * scale)))
+            # Derivatives are saved without EXIF, so bake the orientation in
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            self._save(self._resize_shortest(image, self.model_image_size), model_path, quality=95)
+            image.thumbnail((self.thumbnail_size, self.thumbnail_size))
+            self._save(image, thumbnail, quality=85)
+        logging.info(f"Generated derivatives for {digest}")
+        return model_path
+
+    @staticmethod
+    def _resize_shortest(image: Image.Image, size: int) -> Image.Image:
+        width, height = image.size
+        scale = size / min(width, height)
+        if scale >= 1:
+            return image
+        return image.resize((round(width * scale), round(height * scale)), Image.BICUBIC)
+
+    def _save(self, image: Image.Image, path: str, quality: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = self._tmp_path()
+        try:
+            image.save(tmp_path, format="JPEG", quality=quality)
+            os.replace(tmp_path, path)
+        finally:
+            self.discard(tmp_path)
@@ -1,79 +1,185 @@
+import asyncio
+import copy
+import json
 import logging
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import sessionmaker
 from fastapi import UploadFile
 import os
-import aiofiles
+import base64
 import numpy as np
 from datetime import datetime
-from typing import List, Dict
-from database import Memory
-import chromadb
+from typing import AsyncIterator, List, Dict, Tuple
+from sqlalchemy import tuple_
+from database import Memory, MemoryNeighbor, IngestRecord, SerializedWriter, session_scope
+from memory_tags import (
+    replace_memory_tags, has_tag, parse_tag_filter, tag_filter_where, vector_tag_key,
+    vector_tag_metadata, TagFilterError, NotPushable
+)
+from executor import ExecutorSaturated
+from image_store import ImageStore
+from rollups import add_to_rollups
+from rescoring import modality_scores
+from metrics import span
+from emotion_tagging import ENABLED_COMPONENTS
+from ranking import FUSION_TEXT_WEIGHT, FUSION_IMAGE_WEIGHT, fuse_rankings
+from neighbors import NeighborGraph, NEIGHBOR_KINDS
+from vector_store import open_vector_store, open_collection
+from query_cache import QueryCache, cache_key
+
+# Each modality returns this many candidates per requested result before fusion
+CANDIDATE_FACTOR = int(os.environ.get("EMOTIONBANK_CANDIDATE_FACTOR", "3"))
+# Filters with `not` are checked against the tag table after the vector search;
+# the candidate pool grows by this factor until enough hits pass, up to the cap
+POST_FILTER_GROWTH = 4
+POST_FILTER_MAX_CANDIDATES = int(os.environ.get("EMOTIONBANK_POST_FILTER_MAX_CANDIDATES", "4096"))
+
+TEXT_COLLECTION = "text_memories"
+IMAGE_COLLECTION = "image_memories"
+
+# Browsing pages through memories newest first with an opaque (timestamp, id) cursor
+BROWSE_PAGE_SIZE = 24
+BROWSE_MAX_PAGE_SIZE = 500
+BROWSE_COLUMNS = (
+    Memory.id, Memory.caption, Memory.content, Memory.emotional_tags, Memory.suggested_tags,
+    Memory.sentiment_scores, Memory.timestamp, Memory.image_path
+)
+
+class InvalidCursor(ValueError):
+    """Raised for a browse cursor that was not produced by encode_cursor"""
+
+def encode_cursor(timestamp: datetime, memory_id: int) -> str:
+    payload = json.dumps([timestamp.isoformat(), memory_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str):
+    """(timestamp, id) of the last row of the previous page, or None for the first page"""
+    if not cursor:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, memory_id = json.loads(payload)
+        return datetime.fromisoformat(timestamp), int(memory_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+
+def _copy_result(result):
+    """A deep copy of a cached result, so callers can't modify the cached one"""
+    return copy.deepcopy(result)
 
 class MemoryHandler:
-    def __init__(self, db: Session, emotion_analyzer):
-        self.db = db 
+    def __init__(self, session_factory: sessionmaker, emotion_analyzer, executor=None,
+                 writer: SerializedWriter = None, image_store: ImageStore = None):
+        # Each unit of work opens its own session; writes go through the writer when one is set
+        self.session_factory = session_factory
+        self.writer = writer
         self.emotion_analyzer = emotion_analyzer
+        self.executor = executor
+        self.image_store = image_store or ImageStore()
+        # Text-only deployments never load CLIP; memories are stored without image vectors
+        self.image_analysis_enabled = "clip" in ENABLED_COMPONENTS
         
-        # Initialize ChromaDB for vector search
-        self.vector_db = chromadb.PersistentClient(path="./vector_db")
-        print(self.vector_db.list_collections())
-        # Check if the collection 'text_memories' exists
-        collections = self.vector_db.list_collections()
-        if "text_memories" in collections:
-            # If the collection exists, get it
-            self.text_collection = self.vector_db.get_collection(name="text_memories")
-        else:
-            # If the collection doesn't exist, create a new one
-            self.text_collection = self.vector_db.create_collection(name="text_memories")
-
-        # Similarly for image collection
-        if "image_memories" in collections:
-            self.image_collection = self.vector_db.get_collection(name="image_memories")
-        else:
-            self.image_collection = self.vector_db.create_collection(name="image_memories")
-        
-        # Ensure directories exist
-        os.makedirs("uploads/images", exist_ok=True)
+        # Chroma, or the embedded numpy index, per EMOTIONBANK_VECTOR_BACKEND
+        self.vector_db = open_vector_store()
+        self._open_collections()
+        self.neighbor_graph = NeighborGraph(self)
+        # Search results, invalidated by every write that can change them
+        self.query_cache = QueryCache()
 
-    async def save_uploaded_file(self, file_path_temp: str) -> str:
-        """Save uploaded file and return the final file path"""
-        try:
-            # Extract the basename of the uploaded file
-            original_filename = os.path.basename(file_path_temp)
+    def _open_collections(self):
+        self.text_collection = open_collection(self.vector_db, TEXT_COLLECTION)
+        self.image_collection = open_collection(self.vector_db, IMAGE_COLLECTION)
+
+    def reset_vector_collections(self):
+        """Drop and recreate both collections, e.g. before a rebuild from SQLite"""
+        # Older Chroma clients list Collection objects, newer ones list names
+        existing = {getattr(collection, "name", collection) for collection in self.vector_db.list_collections()}
+        for name in (TEXT_COLLECTION, IMAGE_COLLECTION):
+            if name in existing:
+                self.vector_db.delete_collection(name=name)
+        self._open_collections()
+        self.query_cache.bump("rebuild")
+
+    async def run_inference(self, method: str, *args):
+        """Call an EmotionAnalyzer method, off the event loop when an executor is set"""
+        if self.executor is not None:
+            return await self.executor.run_inference(method, *args)
+        return getattr(self.emotion_analyzer, method)(*args)
+
+    async def run_io(self, fn, *args):
+        """Run a blocking database/vector store call, off the event loop when an executor is set"""
+        if self.executor is not None:
+            return await self.executor.run_io(fn, *args)
+        return fn(*args)
+
+    async def analyze_text(self, text: str) -> Dict:
+        """Analyze text, joining the analyzer's micro-batch when it has one"""
+        if self.executor is None and hasattr(self.emotion_analyzer, "submit_text"):
+            return await asyncio.wrap_future(self.emotion_analyzer.submit_text(text))
+        return await self.run_inference("analyze_text", text)
 
-            # Define the final file path
-            file_path = os.path.join("uploads", "images", original_filename)
+    async def analyze_image(self, image_path: str, digest: str = None) -> Dict:
+        """Analyze an image, joining the analyzer's micro-batch when it has one.
 
-            # Ensure the destination directory exists
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        `digest` is the SHA-256 of the original the image was derived from; it
+        keys the embedding cache, and the file is hashed when it is not given.
+        """
+        if not self.image_analysis_enabled:
+            return self.empty_image_analysis()
+        if self.executor is None and hasattr(self.emotion_analyzer, "submit_image"):
+            return await asyncio.wrap_future(self.emotion_analyzer.submit_image(image_path, digest))
+        return await self.run_inference("analyze_image", image_path, digest)
 
-            # Save the file to the final path
-            async with aiofiles.open(file_path, "wb") as buffer:
-                async with aiofiles.open(file_path_temp, "rb") as temp_file:
-                    content = await temp_file.read()
-                    await buffer.write(content)
+    @staticmethod
+    def empty_image_analysis() -> Dict:
+        return {"image_embedding": None, "emotion_scores": {}, "primary_emotions": []}
 
-            logging.info(f"File saved successfully: {file_path}")
-            return file_path
+    async def save_uploaded_file(self, file_path_temp: str) -> Dict:
+        """Copy a file into the image store; returns the stored original's sha256 and path"""
+        try:
+            stored = await self.run_io(self.image_store.put_file, file_path_temp)
+            logging.info(f"File stored: {stored['original']} (duplicate: {stored['deduplicated']})")
+            return stored
+        except Exception as e:
+            logging.error(f"Error saving uploaded file: {e}")
+            raise RuntimeError(f"Error saving uploaded file: {e}")
+
+    async def save_upload(self, upload: UploadFile) -> Dict:
+        """Stream a multipart upload into the image store"""
+        try:
+            tmp_path, digest, ext = await self.image_store.receive_upload(upload)
+            try:
+                stored = await self.run_io(self.image_store.commit, tmp_path, digest, ext)
+            except BaseException:
+                # commit never ran, e.g. the I/O pool was saturated
+                self.image_store.discard(tmp_path)
+                raise
+            logging.info(f"File stored: {stored['original']} (duplicate: {stored['deduplicated']})")
+            return stored
         except Exception as e:
             logging.error(f"Error saving uploaded file: {e}")
             raise RuntimeError(f"Error saving uploaded file: {e}")
 
-    async def upload_memory(self, memory: Memory):
+    async def upload_memory(self, memory: Memory, source_key: str = None):
+        """Analyze and store one memory; `source_key` is recorded with it so a retry can detect it"""
         try:
-            # Save uploaded file
             file_path = memory.image_path
+            # Writes the thumbnail and model copy of stored originals; the analyzer reads the copy
+            with span("image.derivatives"):
+                analysis_path = await self.run_io(self.image_store.model_copy, file_path)
             
-            # Analyze text content
-            text_analysis = self.emotion_analyzer.analyze_text(memory.content)
-            
-            # Analyze image
-            image_analysis = self.emotion_analyzer.analyze_image(file_path)
-            
-            # Combine analyses
-            combined_analysis = self.emotion_analyzer.combine_analysis(
-                text_analysis, image_analysis
-            )
+            # Analyze text content and image concurrently so both can join a batch
+            with span("upload.analyze"):
+                text_analysis, image_analysis = await asyncio.gather(
+                    self.analyze_text(memory.content),
+                    # Keyed by the stored original's digest, as bulk ingest does, so the
+                    # model copy isn't read again just to hash it
+                    self.analyze_image(analysis_path, self.image_store.digest_of(file_path))
+                )
+                
+                # Combine analyses
+                combined_analysis = await self.run_inference(
+                    "combine_analysis", text_analysis, image_analysis
+                )
             
             # Update memory object with analysis results
             memory.image_path = file_path
@@ -81,35 +187,9 @@ class MemoryHandler:
             memory.image_embedding = image_analysis["image_embedding"]
             memory.suggested_tags = combined_analysis["primary_emotions"]
             memory.sentiment_scores = combined_analysis["emotion_scores"]
+            memory.modality_scores = modality_scores(text_analysis, image_analysis)
             
-            # Save to database
-            self.db.add(memory)
-            self.db.commit()
-            self.db.refresh(memory)
-            
-            # Add to vector databases
-            self.text_collection.add(
-                ids=[str(memory.id)],
-                embeddings=[memory.text_embedding],
-                metadatas=[{
-                    "caption": memory.caption,
-                    "emotional_tags": memory.emotional_tags,
-                    "timestamp": memory.timestamp.isoformat()
-                }]
-            )
-            
-            self.image_collection.add(
-                ids=[str(memory.id)],
-                embeddings=[memory.image_embedding],
-                metadatas=[{
-                    "caption": memory.caption,
-                    "emotional_tags": memory.emotional_tags,
-                    "timestamp": memory.timestamp.isoformat()
-                }]
-            )
-            
-            return {
-                "id": memory.id,
+            result = {
                 "caption": memory.caption,
                 "content": memory.content,
                 "emotional_tags": memory.emotional_tags,
@@ -119,75 +199,453 @@ class MemoryHandler:
                 "file_path": file_path
             }
             
+            # Save to database and vector databases
+            memory_ids = await self.run_io(
+                self.store_memories, [memory], [source_key] if source_key else None
+            )
+            result["id"] = memory_ids[0]
+            return result
+            
+        except ExecutorSaturated:
+            raise
         except Exception as e:
             logging.error(f"Error uploading memory: {str(e)}")
             raise Exception(f"Failed to upload memory: {str(e)}")
 
+    def store_memories(self, memories: List[Memory], source_keys: List[str] = None):
+        """Commit memories in one transaction, then add them to both vector collections.
+
+        Returns the new memory ids.
+
+        When `source_keys` is given, an IngestRecord is written for each memory
+        in the same transaction so bulk imports can resume after a crash.
+        """
+        # Keep the analysis vectors; the committed columns reload as binary-decoded arrays
+        text_embeddings = [memory.text_embedding for memory in memories]
+        image_embeddings = [memory.image_embedding for memory in memories]
+        with span("db.write"):
+            if self.writer is not None:
+                ids, metadatas = self.writer.submit(self._write_memories, memories, source_keys).result()
+            else:
+                with session_scope(self.session_factory) as db:
+                    ids, metadatas = self._write_memories(db, memories, source_keys)
+        # Browse pages read SQLite, so they are stale from the commit on
+        self.query_cache.bump("store")
+
+        with span("vector.index"):
+            self.index_vectors(ids, metadatas, text_embeddings, image_embeddings)
+        try:
+            self.neighbor_graph.add_memories(ids, text_embeddings, image_embeddings)
+        except Exception as e:
+            # The memories are stored; their neighbours are searched live until the next rebuild
+            logging.warning(f"Failed to update neighbour lists for memories {ids}: {e}")
+        # Searches that ran during indexing may have cached results without the new vectors
+        self.query_cache.bump("index")
+        return [int(memory_id) for memory_id in ids]
+
+    def _write_memories(self, db, memories: List[Memory], source_keys: List[str] = None):
+        db.add_all(memories)
+        db.flush()
+        replace_memory_tags(db, memories)
+        add_to_rollups(db, memories)
+        if source_keys:
+            db.add_all([
+                IngestRecord(source_key=source_key, memory_id=memory.id)
+                for source_key, memory in zip(source_keys, memories)
+            ])
+        # Read ids and metadata before commit expires the instances
+        ids = [str(memory.id) for memory in memories]
+        metadatas = [self.vector_metadata(memory) for memory in memories]
+        return ids, metadatas
+
+    def ingested_source_keys(self, source_keys: List[str]) -> set:
+        """Subset of `source_keys` that bulk ingestion has already imported"""
+        done = set()
+        with session_scope(self.session_factory) as db:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(source_keys), 500):
+                done.update(
+                    row.source_key for row in db.query(IngestRecord.source_key).filter(
+                        IngestRecord.source_key.in_(source_keys[start:start + 500])
+                    )
+                )
+        return done
+
+    def vector_metadata(self, memory: Memory) -> Dict:
+        """Everything a search result needs, so ranked results come from the vector store alone.
+
+        Chroma metadata values must be scalars: lists and dicts are stored as
+        JSON text, and tags and scores are also flattened into `tag:<name>` and
+        `score:<emotion>` keys so filters can run inside the vector search.
+        """
+        metadata = {
+            "memory_id": int(memory.id),
+            "caption": memory.caption or "",
+            "content": memory.content or "",
+            "image_path": memory.image_path or "",
+            "emotional_tags": json.dumps(memory.emotional_tags or []),
+            "suggested_tags": json.dumps(memory.suggested_tags or []),
+            "sentiment_scores": json.dumps(memory.sentiment_scores or {}),
+            "timestamp": memory.timestamp.isoformat(),
+            "timestamp_epoch": memory.timestamp.timestamp()
+        }
+        metadata.update(vector_tag_metadata(
+            memory.emotional_tags, memory.suggested_tags, memory.sentiment_scores
+        ))
+        return metadata
+
+    def refresh_vector_metadata(self, batch_size: int = 500) -> int:
+        """Rewrite the vector metadata of every memory from SQLite; returns the number updated"""
+        last_id = 0
+        total = 0
+        while True:
+            with session_scope(self.session_factory) as db:
+                memories = db.query(Memory).filter(
+                    Memory.id > last_id
+                ).order_by(Memory.id).limit(batch_size).all()
+                ids = [str(memory.id) for memory in memories]
+                metadatas = [self.vector_metadata(memory) for memory in memories]
+            if not ids:
+                return total
+            self.query_cache.bump("metadata_refresh")
+            for collection in (self.text_collection, self.image_collection):
+                present = set(collection.get(ids=ids, include=[])["ids"])
+                if present:
+                    collection.update(
+                        ids=[memory_id for memory_id in ids if memory_id in present],
+                        metadatas=[metadata for memory_id, metadata in zip(ids, metadatas) if memory_id in present]
+                    )
+            total += len(ids)
+            last_id = int(ids[-1])
+            logging.info(f"Refreshed vector metadata for {total} memories")
+
+    def index_vectors(self, ids: List[str], metadatas: List[Dict],
+                      text_embeddings: List, image_embeddings: List):
+        """Upsert vectors into both collections with one call each; safe to repeat"""
+        self.text_collection.upsert(
+            ids=ids,
+            embeddings=text_embeddings,
+            metadatas=metadatas
+        )
+        
+        # Memories stored without image analysis have no image vector
+        with_images = [i for i, embedding in enumerate(image_embeddings) if embedding is not None]
+        if with_images:
+            self.image_collection.upsert(
+                ids=[ids[i] for i in with_images],
+                embeddings=[image_embeddings[i] for i in with_images],
+                metadatas=[metadatas[i] for i in with_images]
+            )
+
     async def retrieve_memories(self, 
                               query: str = None, 
                               emotion: str = None, 
                               similar_to_id: int = None,
-                              limit: int = 10) -> List[Dict]:
+                              limit: int = 10,
+                              tag_filter: str = None,
+                              start: datetime = None,
+                              end: datetime = None) -> List[Dict]:
+        """Ranked memories for a query text or a memory to find neighbours of.
+
+        Emotion, tag expression and date range narrow the vector search
+        itself; text and image similarity are fused into one score. Without
+        a query or similar_to_id this is the first page of browse_memories;
+        an unfiltered similar_to_id reads the precomputed neighbour graph.
+        Results are cached until the next write.
+        """
+        key = cache_key(
+            "retrieve", query=query, emotion=emotion, similar_to_id=similar_to_id, limit=limit,
+            tag_filter=tag_filter, start=start, end=end
+        )
+        return await self._cached(
+            key, self._retrieve, query, emotion, similar_to_id, limit, tag_filter, start, end
+        )
+
+    async def _cached(self, key, compute, *args):
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            return _copy_result(cached)
+        # A write landing while this runs bumps the generation, and put() then drops the result
+        generation = self.query_cache.generation
+        result = await compute(*args)
+        self.query_cache.put(key, result, generation)
+        return _copy_result(result)
+
+    async def _retrieve(self, query: str, emotion: str, similar_to_id: int, limit: int,
+                        tag_filter: str, start: datetime, end: datetime) -> List[Dict]:
+        if similar_to_id and not (emotion or tag_filter or start or end):
+            return await self._similar(similar_to_id, "fused", limit)
         try:
-            if similar_to_id:
-                # Get similar memories using vector similarity
-                memory = self.db.query(Memory).filter(Memory.id == similar_to_id).first()
-                if memory:
-                    # Search both text and image collections
-                    text_results = self.text_collection.query(
-                        query_embeddings=[memory.text_embedding],
-                        n_results=limit
-                    )
-                    image_results = self.image_collection.query(
-                        query_embeddings=[memory.image_embedding],
-                        n_results=limit
-                    )
-                    
-                    # Combine and deduplicate results
-                    memory_ids = list(set([int(id) for id in text_results['ids'][0] + image_results['ids'][0]]))
-                    memories = self.db.query(Memory).filter(
-                        Memory.id.in_(memory_ids)
-                    ).limit(limit).all()
-                    
-            elif emotion:
-                # Filter by emotion tag
-                memories = self.db.query(Memory).filter(
-                    Memory.emotional_tags.contains([emotion])
-                ).limit(limit).all()
-                
-            elif query:
-                # Analyze query text for embedding
-                query_analysis = self.emotion_analyzer.analyze_text(query)
-                query_embedding = query_analysis["text_embedding"]
-                
-                # Search using query embedding
-                results = self.text_collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=limit
-                )
-                
-                memory_ids = [int(id) for id in results['ids'][0]]
-                memories = self.db.query(Memory).filter(
-                    Memory.id.in_(memory_ids)
-                ).all()
-                
-            else:
-                memories = self.db.query(Memory).limit(limit).all()
-
-            return [
-                {
-                    "id": memory.id,
-                    "caption": memory.caption,
-                    "content": memory.content,
-                    "emotional_tags": memory.emotional_tags,
-                    "suggested_tags": memory.suggested_tags,
-                    "sentiment_scores": memory.sentiment_scores,
-                    "timestamp": memory.timestamp,
-                    "image_path": memory.image_path
-                }
-                for memory in memories
-            ]
+            if not query and not similar_to_id:
+                page = await self._browse_page(None, limit, emotion, tag_filter, start, end)
+                return page["items"]
+
+            text_vector = image_vector = None
+            if not similar_to_id:
+                with span("query.embed"):
+                    text_vector, image_vector = await self._embed_query(query)
+
+            return await self.run_io(
+                self._search_sync, text_vector, image_vector, similar_to_id,
+                emotion, tag_filter, start, end, limit
+            )
             
+        except (ExecutorSaturated, TagFilterError):
+            raise
         except Exception as e:
             logging.error(f"Error retrieving memories: {str(e)}")
             raise Exception(f"Failed to retrieve memories: {str(e)}")
+
+    async def similar_memories(self, memory_id: int, kind: str = "fused", limit: int = 10) -> List[Dict]:
+        """The memory's precomputed `kind` neighbours ("text", "image" or "fused"), best first.
+
+        Memories without a stored list, or asked for more neighbours than a
+        list holds, are searched live in the vector collections instead.
+        """
+        if kind not in NEIGHBOR_KINDS:
+            raise ValueError(f"Unknown neighbour kind {kind!r}; expected one of {', '.join(NEIGHBOR_KINDS)}")
+        key = cache_key("similar", memory_id=memory_id, kind=kind, limit=limit)
+        return await self._cached(key, self._similar, memory_id, kind, limit)
+
+    async def _similar(self, memory_id: int, kind: str, limit: int) -> List[Dict]:
+        try:
+            if limit <= self.neighbor_graph.k:
+                neighbors = await self.run_io(self._neighbors_sync, memory_id, kind, limit)
+                if neighbors:
+                    return neighbors
+            return await self.run_io(
+                self._search_sync, None, None, memory_id, None, None, None, None, limit, kind
+            )
+        except ExecutorSaturated:
+            raise
+        except Exception as e:
+            logging.error(f"Error finding similar memories: {str(e)}")
+            raise Exception(f"Failed to find similar memories: {str(e)}")
+
+    def _neighbors_sync(self, memory_id: int, kind: str, limit: int) -> List[Dict]:
+        with span("db.fetch"), session_scope(self.session_factory) as db:
+            # One range scan of the (memory_id, kind, rank) primary key joined to the neighbours' rows
+            rows = db.query(MemoryNeighbor.score, *BROWSE_COLUMNS).select_from(MemoryNeighbor).join(
+                Memory, Memory.id == MemoryNeighbor.neighbor_id
+            ).filter(
+                MemoryNeighbor.memory_id == memory_id, MemoryNeighbor.kind == kind
+            ).order_by(MemoryNeighbor.rank).limit(limit).all()
+        return [self._memory_from_row(row, row.score) for row in rows]
+
+    async def _embed_query(self, query: str):
+        """Query vectors for the text collection and, with CLIP enabled, the image collection"""
+        if not self.image_analysis_enabled:
+            return (await self.analyze_text(query))["text_embedding"], None
+        text_analysis, clip_features = await asyncio.gather(
+            self.analyze_text(query),
+            self.run_inference("encode_clip_texts", [query])
+        )
+        return text_analysis["text_embedding"], np.asarray(clip_features[0], dtype=np.float32).tolist()
+
+    def _vector_where(self, emotion: str, tag_filter: str, start: datetime, end: datetime):
+        """(where clause, tag filter left to check on the tag table after the search, or None)"""
+        clauses = []
+        post_filter = None
+        if emotion:
+            clauses.append({vector_tag_key(emotion): True})
+        if tag_filter:
+            try:
+                clauses.append(tag_filter_where(tag_filter))
+            except NotPushable:
+                # A negation matches most of the library, so it is checked on the hits instead
+                post_filter = tag_filter
+        if start:
+            clauses.append({"timestamp_epoch": {"$gte": start.timestamp()}})
+        if end:
+            clauses.append({"timestamp_epoch": {"$lte": end.timestamp()}})
+        if not clauses:
+            return None, post_filter
+        return (clauses[0] if len(clauses) == 1 else {"$and": clauses}), post_filter
+
+    def _matching_ids(self, tag_filter: str, memory_ids: List[str]) -> set:
+        """The ids among `memory_ids` whose memories satisfy `tag_filter`"""
+        condition = parse_tag_filter(tag_filter)
+        matching = set()
+        with span("db.fetch"), session_scope(self.session_factory) as db:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(memory_ids), 500):
+                batch = [int(memory_id) for memory_id in memory_ids[start:start + 500]]
+                matching.update(
+                    str(row.id) for row in db.query(Memory.id).filter(Memory.id.in_(batch), condition)
+                )
+        return matching
+
+    @staticmethod
+    def _stored_vector(collection, memory_id: str):
+        stored = collection.get(ids=[memory_id], include=["embeddings"])
+        embeddings = stored["embeddings"]
+        if embeddings is None or len(embeddings) == 0:
+            return None
+        return np.asarray(embeddings[0], dtype=np.float32).tolist()
+
+    @staticmethod
+    def _query_collection(collection, vector, where, n_results: int) -> List[Tuple[str, float, Dict]]:
+        results = collection.query(
+            query_embeddings=[vector],
+            n_results=n_results,
+            where=where,
+            include=["metadatas", "distances"]
+        )
+        return list(zip(results["ids"][0], results["distances"][0], results["metadatas"][0]))
+
+    def _search_sync(self, text_vector, image_vector, similar_to_id: int, emotion: str,
+                     tag_filter: str, start: datetime, end: datetime, limit: int,
+                     kind: str = "fused") -> List[Dict]:
+        where, post_filter = self._vector_where(emotion, tag_filter, start, end)
+
+        exclude = None
+        if similar_to_id:
+            # Neighbours of a stored memory, using its own vectors as the query
+            exclude = str(similar_to_id)
+            with span("vector.query"):
+                if kind != "image":
+                    text_vector = self._stored_vector(self.text_collection, exclude)
+                if kind != "text":
+                    image_vector = self._stored_vector(self.image_collection, exclude)
+
+        n_results = limit * CANDIDATE_FACTOR + (1 if exclude else 0)
+        while True:
+            rankings = []
+            with span("vector.query"):
+                if text_vector is not None:
+                    rankings.append((FUSION_TEXT_WEIGHT, self._query_collection(
+                        self.text_collection, text_vector, where, n_results
+                    )))
+                if image_vector is not None:
+                    rankings.append((FUSION_IMAGE_WEIGHT, self._query_collection(
+                        self.image_collection, image_vector, where, n_results
+                    )))
+
+            fused = [result for result in fuse_rankings(rankings) if result[0] != exclude]
+            if post_filter is None:
+                break
+            matching = self._matching_ids(post_filter, [memory_id for memory_id, _, _ in fused])
+            fused = [result for result in fused if result[0] in matching]
+            # Stop once enough hits pass, or when no collection had more candidates to give
+            exhausted = all(len(ranking) < n_results for _, ranking in rankings)
+            if len(fused) >= limit or exhausted or n_results >= POST_FILTER_MAX_CANDIDATES:
+                break
+            n_results = min(n_results * POST_FILTER_GROWTH, POST_FILTER_MAX_CANDIDATES)
+
+        return [
+            self._memory_from_metadata(memory_id, metadata, score)
+            for memory_id, score, metadata in fused[:limit]
+        ]
+
+    def _memory_from_metadata(self, memory_id: str, metadata: Dict, score: float) -> Dict:
+        return {
+            "id": int(memory_id),
+            "caption": metadata.get("caption"),
+            "content": metadata.get("content"),
+            "emotional_tags": json.loads(metadata.get("emotional_tags") or "[]"),
+            "suggested_tags": json.loads(metadata.get("suggested_tags") or "[]"),
+            "sentiment_scores": json.loads(metadata.get("sentiment_scores") or "{}"),
+            "timestamp": metadata.get("timestamp"),
+            "image_path": metadata.get("image_path"),
+            "thumbnail_path": self.image_store.thumbnail_path(metadata.get("image_path") or ""),
+            "score": score
+        }
+
+    async def browse_memories(self, cursor: str = None, limit: int = BROWSE_PAGE_SIZE,
+                              emotion: str = None, tag_filter: str = None,
+                              start: datetime = None, end: datetime = None) -> Dict:
+        """One page of memories, newest first, and the cursor for the next page (None at the end)"""
+        key = cache_key(
+            "browse", cursor=cursor, limit=limit, emotion=emotion, tag_filter=tag_filter, start=start, end=end
+        )
+        return await self._cached(key, self._browse_page, cursor, limit, emotion, tag_filter, start, end)
+
+    async def _browse_page(self, cursor: str, limit: int, emotion: str, tag_filter: str,
+                           start: datetime, end: datetime) -> Dict:
+        try:
+            return await self.run_io(
+                self._browse_sync, decode_cursor(cursor), min(limit, BROWSE_MAX_PAGE_SIZE),
+                emotion, tag_filter, start, end
+            )
+        except (ExecutorSaturated, TagFilterError, InvalidCursor):
+            raise
+        except Exception as e:
+            logging.error(f"Error browsing memories: {str(e)}")
+            raise Exception(f"Failed to browse memories: {str(e)}")
+
+    def _browse_sync(self, after, limit: int, emotion: str, tag_filter: str,
+                     start: datetime, end: datetime) -> Dict:
+        conditions = []
+        if emotion:
+            conditions.append(has_tag(emotion))
+        if tag_filter:
+            conditions.append(parse_tag_filter(tag_filter))
+        if start:
+            conditions.append(Memory.timestamp >= start)
+        if end:
+            conditions.append(Memory.timestamp <= end)
+        if after is not None:
+            # Seek past the previous page on the (timestamp, id) index
+            conditions.append(tuple_(Memory.timestamp, Memory.id) < after)
+
+        with span("db.fetch"), session_scope(self.session_factory) as db:
+            # Plain column tuples: no ORM identity map and no embedding columns
+            rows = db.query(*BROWSE_COLUMNS).filter(*conditions).order_by(
+                Memory.timestamp.desc(), Memory.id.desc()
+            ).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+        return {
+            "items": [self._memory_from_row(row, None) for row in rows],
+            "next_cursor": next_cursor
+        }
+
+    def _memory_from_row(self, row, score: float) -> Dict:
+        """Result dict for a BROWSE_COLUMNS row"""
+        return {
+            "id": row.id,
+            "caption": row.caption,
+            "content": row.content,
+            "emotional_tags": row.emotional_tags,
+            "suggested_tags": row.suggested_tags,
+            "sentiment_scores": row.sentiment_scores,
+            "timestamp": row.timestamp.isoformat(),
+            "image_path": row.image_path,
+            "thumbnail_path": self.image_store.thumbnail_path(row.image_path or ""),
+            "score": score
+        }
+
+    async def iter_memories(self, page_size: int = BROWSE_MAX_PAGE_SIZE, **filters) -> AsyncIterator[Dict]:
+        """Every matching memory, newest first, fetched one short transaction per page"""
+        cursor = None
+        while True:
+            # Straight to the database: exports would only churn the result cache
+            page = await self._browse_page(
+                cursor, page_size, filters.get("emotion"), filters.get("tag_filter"),
+                filters.get("start"), filters.get("end")
+            )
+            for item in page["items"]:
+                yield item
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal, init_db
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the vector collections")
+    parser.add_argument("--refresh-metadata", action="store_true",
+                        help="Rewrite vector metadata (tags, scores, timestamps) from SQLite")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.refresh_metadata:
+        init_db()
+        # Metadata comes from SQLite; no models are needed
+        handler = MemoryHandler(SessionLocal, emotion_analyzer=None)
+        print(f"Refreshed metadata for {handler.refresh_vector_metadata(args.batch_size)} memories")
@@ -0,0 +1,292 @@
+"""Normalized tag/score rows for memories and the filter language over them.
+
+Filters are boolean expressions over tag names and score thresholds:
+
+    joy                        memory has the tag (user or suggested)
+    joy > 0.5                  combined emotion score above a threshold
+    (joy or love) and not sadness
+
+Every term compiles to an indexed lookup on `memory_tags`. Expressions
+without `not` also compile to a Chroma `where` clause over the scalar
+tag/score keys written into each vector's metadata (see `vector_tag_key`).
+
+    python memory_tags.py --backfill    # populate rows for existing memories
+"""
+import re
+import logging
+import argparse
+from typing import Dict, List
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+from database import Memory, MemoryTag
+from score_fusion import EMOTION_CATEGORIES
+
+TAG_SOURCES = ("user", "suggested")
+SCORE_SOURCE = "score"
+SCORE_OPERATORS = {
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+    "=": lambda column, value: column == value
+}
+
+def _normalize_tag(tag) -> str:
+    return str(tag).strip().lower()
+
+def vector_tag_key(tag) -> str:
+    """Vector metadata key flagging a user or suggested tag (metadata values must be scalars)"""
+    return f"tag:{_normalize_tag(tag)}"
+
+def vector_score_key(emotion) -> str:
+    """Vector metadata key holding a combined emotion score"""
+    return f"score:{_normalize_tag(emotion)}"
+
+def vector_tag_metadata(emotional_tags, suggested_tags, sentiment_scores) -> Dict:
+    """Tag and score keys for a memory's vector metadata.
+
+    Every emotion category gets an explicit `tag:` value and, for scored
+    memories, an explicit `score:` value, so rewriting the metadata with a
+    merging update clears tags and scores the memory no longer has.
+    """
+    metadata = {vector_tag_key(emotion): False for emotion in EMOTION_CATEGORIES}
+    if sentiment_scores:
+        metadata.update({vector_score_key(emotion): 0.0 for emotion in EMOTION_CATEGORIES})
+    for tag in list(emotional_tags or []) + list(suggested_tags or []):
+        if _normalize_tag(tag):
+            metadata[vector_tag_key(tag)] = True
+    for emotion, score in (sentiment_scores or {}).items():
+        metadata[vector_score_key(emotion)] = float(score)
+    return metadata
+
+def memory_tag_rows(memory_id: int, emotional_tags, suggested_tags, sentiment_scores) -> List[MemoryTag]:
+    rows = []
+    for source, tags in (("user", emotional_tags), ("suggested", suggested_tags)):
+        for tag in dict.fromkeys(_normalize_tag(tag) for tag in (tags or [])):
+            if tag:
+                rows.append(MemoryTag(memory_id=memory_id, tag=tag, source=source))
+    for emotion, score in (sentiment_scores or {}).items():
+        rows.append(MemoryTag(
+            memory_id=memory_id, tag=_normalize_tag(emotion), source=SCORE_SOURCE, score=float(score)
+        ))
+    return rows
+
+def replace_memory_tags(db: Session, memories: List[Memory]):
+    """Rewrite the tag rows of flushed memories; the caller commits"""
+    memory_ids = [memory.id for memory in memories]
+    db.query(MemoryTag).filter(MemoryTag.memory_id.in_(memory_ids)).delete(synchronize_session=False)
+    for memory in memories:
+        db.add_all(memory_tag_rows(
+            memory.id, memory.emotional_tags, memory.suggested_tags, memory.sentiment_scores
+        ))
+
+def replace_derived_tags(db: Session, memory_ids: List[int], suggested_tags: List[List[str]],
+                         sentiment_scores: List[Dict]):
+    """Rewrite only the model-derived rows (suggested tags and scores), in bulk; the caller commits"""
+    for start in range(0, len(memory_ids), 500):
+        db.query(MemoryTag).filter(
+            MemoryTag.memory_id.in_(memory_ids[start:start + 500]),
+            MemoryTag.source.in_(("suggested", SCORE_SOURCE))
+        ).delete(synchronize_session=False)
+    rows = []
+    for memory_id, tags, scores in zip(memory_ids, suggested_tags, sentiment_scores):
+        for row in memory_tag_rows(memory_id, None, tags, scores):
+            rows.append({"memory_id": row.memory_id, "tag": row.tag, "source": row.source, "score": row.score})
+    if rows:
+        db.execute(MemoryTag.__table__.insert(), rows)
+
+def backfill_memory_tags(db: Session, batch_size: int = 1000) -> int:
+    """Rebuild tag rows for every memory, one transaction per batch of ids"""
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.query(
+            Memory.id, Memory.emotional_tags, Memory.suggested_tags, Memory.sentiment_scores
+        ).filter(Memory.id > last_id).order_by(Memory.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        db.query(MemoryTag).filter(
+            MemoryTag.memory_id.in_([row.id for row in rows])
+        ).delete(synchronize_session=False)
+        for row in rows:
+            db.add_all(memory_tag_rows(row.id, row.emotional_tags, row.suggested_tags, row.sentiment_scores))
+        db.commit()
+
+        total += len(rows)
+        last_id = rows[-1].id
+        logging.info(f"Backfilled tags for {total} memories")
+    return total
+
+# Filter expressions
+
+TOKEN_PATTERN = re.compile(r"\s*(>=|<=|[()><=]|-?\d+(?:\.\d+)?|[A-Za-z_][\w\-]*)")
+
+class TagFilterError(ValueError):
+    """Raised for a malformed tag filter expression"""
+
+class NotPushable(Exception):
+    """The expression has no equivalent vector metadata `where` clause"""
+
+def _tokenize(expression: str) -> List[str]:
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise TagFilterError(f"Unexpected input at: {expression[position:]!r}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+def has_tag(tag: str):
+    """Condition on Memory.id: the memory carries `tag` as a user or suggested tag"""
+    return Memory.id.in_(
+        select(MemoryTag.memory_id).where(
+            MemoryTag.tag == _normalize_tag(tag), MemoryTag.source.in_(TAG_SOURCES)
+        )
+    )
+
+def score_matches(tag: str, operator: str, value: float):
+    """Condition on Memory.id: the memory's combined score for `tag` satisfies the comparison"""
+    return Memory.id.in_(
+        select(MemoryTag.memory_id).where(
+            MemoryTag.tag == _normalize_tag(tag),
+            MemoryTag.source == SCORE_SOURCE,
+            SCORE_OPERATORS[operator](MemoryTag.score, value)
+        )
+    )
+
+class _SqlBuilder:
+    """Builds SQLAlchemy conditions on Memory over the memory_tags table"""
+    has_tag = staticmethod(has_tag)
+    score_matches = staticmethod(score_matches)
+
+    @staticmethod
+    def all_of(terms):
+        return and_(*terms)
+
+    @staticmethod
+    def any_of(terms):
+        return or_(*terms)
+
+    @staticmethod
+    def negate(term):
+        return ~term
+
+class _WhereBuilder:
+    """Builds Chroma `where` clauses over the vector metadata tag/score keys"""
+    OPERATORS = {">": "$gt", ">=": "$gte", "<": "$lt", "<=": "$lte", "=": "$eq"}
+
+    @staticmethod
+    def has_tag(tag: str) -> Dict:
+        return {vector_tag_key(tag): True}
+
+    @classmethod
+    def score_matches(cls, tag: str, operator: str, value: float) -> Dict:
+        return {vector_score_key(tag): {cls.OPERATORS[operator]: value}}
+
+    @staticmethod
+    def all_of(terms) -> Dict:
+        return {"$and": list(terms)}
+
+    @staticmethod
+    def any_of(terms) -> Dict:
+        return {"$or": list(terms)}
+
+    @staticmethod
+    def negate(term):
+        # Only emotion categories get explicit False keys; other tags are absent when unset
+        raise NotPushable("Negated terms can't be expressed over vector metadata")
+
+class _Parser:
+    def __init__(self, tokens: List[str], builder=_SqlBuilder):
+        self.tokens = tokens
+        self.position = 0
+        self.builder = builder
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise TagFilterError("Unexpected end of expression")
+        self.position += 1
+        return token
+
+    def parse(self):
+        condition = self._or()
+        if self._peek() is not None:
+            raise TagFilterError(f"Unexpected token: {self._peek()!r}")
+        return condition
+
+    def _or(self):
+        terms = [self._and()]
+        while (self._peek() or "").lower() == "or":
+            self._next()
+            terms.append(self._and())
+        return terms[0] if len(terms) == 1 else self.builder.any_of(terms)
+
+    def _and(self):
+        terms = [self._not()]
+        while (self._peek() or "").lower() == "and":
+            self._next()
+            terms.append(self._not())
+        return terms[0] if len(terms) == 1 else self.builder.all_of(terms)
+
+    def _not(self):
+        if (self._peek() or "").lower() == "not":
+            self._next()
+            return self.builder.negate(self._not())
+        return self._atom()
+
+    def _atom(self):
+        token = self._next()
+        if token == "(":
+            condition = self._or()
+            if self._next() != ")":
+                raise TagFilterError("Expected ')'")
+            return condition
+        if not re.match(r"[A-Za-z_]", token) or token.lower() in ("and", "or", "not"):
+            raise TagFilterError(f"Expected a tag name, got {token!r}")
+        if self._peek() in SCORE_OPERATORS:
+            operator = self._next()
+            try:
+                value = float(self._next())
+            except ValueError:
+                raise TagFilterError(f"Expected a number after {operator!r}")
+            return self.builder.score_matches(token, operator, value)
+        return self.builder.has_tag(token)
+
+def parse_tag_filter(expression: str):
+    """Compile a filter expression into a SQLAlchemy condition on Memory"""
+    tokens = _tokenize(expression)
+    if not tokens:
+        raise TagFilterError("Empty tag filter")
+    return _Parser(tokens).parse()
+
+def tag_filter_where(expression: str) -> Dict:
+    """Compile a filter expression into a vector metadata `where` clause.
+
+    Raises NotPushable for expressions using `not`; callers resolve those
+    against the tag table instead.
+    """
+    tokens = _tokenize(expression)
+    if not tokens:
+        raise TagFilterError("Empty tag filter")
+    return _Parser(tokens, _WhereBuilder).parse()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the memory_tags table")
+    parser.add_argument("--backfill", action="store_true", help="Rebuild tag rows for all memories")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.backfill:
+        from database import init_db, session_scope
+        init_db()
+        with session_scope() as db:
+            print(f"Backfilled {backfill_memory_tags(db, args.batch_size)} memories")
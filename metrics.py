@@ -0,0 +1,188 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Default bucket boundaries (upper bounds, inclusive)
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64]
+LATENCY_MS_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+# Requests slower than this are logged with their per-stage breakdown (0 disables)
+SLOW_REQUEST_MS = float(os.environ.get("EMOTIONBANK_SLOW_REQUEST_MS", "1000"))
+
+class Histogram:
+    """Thread-safe cumulative histogram with fixed bucket boundaries"""
+
+    def __init__(self, name: str, buckets: List[float]):
+        self.name = name
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            cumulative = []
+            running = 0
+            for bound, count in zip(self.buckets + ["+Inf"], self._counts):
+                running += count
+                cumulative.append((bound, running))
+            return {
+                "buckets": cumulative,
+                "count": self._count,
+                "sum": self._sum,
+                "mean": self._sum / self._count if self._count else 0.0
+            }
+
+class Counter:
+    """Thread-safe monotonically increasing counter"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        with self._lock:
+            return self._value
+
+class Gauge(Counter):
+    """Thread-safe value that can go up and down"""
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+class MetricFamily:
+    """A named metric with one child per combination of label values"""
+
+    def __init__(self, kind: str, name: str, help_text: str, label_names: List[str],
+                 buckets: Optional[List[float]] = None):
+        self.kind = kind
+        self.name = name
+        self.help_text = help_text
+        self.label_names = list(label_names)
+        self.buckets = buckets
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **label_values):
+        key = tuple(str(label_values[name]) for name in self.label_names)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                if self.kind == "histogram":
+                    child = Histogram(self.name, self.buckets)
+                elif self.kind == "gauge":
+                    child = Gauge(self.name)
+                else:
+                    child = Counter(self.name)
+                self._children[key] = child
+            return child
+
+    def children(self):
+        with self._lock:
+            return list(self._children.items())
+
+class Registry:
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _family(self, kind: str, name: str, help_text: str, label_names: List[str], buckets=None):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = MetricFamily(kind, name, help_text, label_names, buckets)
+                self._families[name] = family
+            return family
+
+    def histogram(self, name: str, help_text: str, label_names: List[str],
+                  buckets: List[float] = LATENCY_MS_BUCKETS) -> MetricFamily:
+        return self._family("histogram", name, help_text, label_names, buckets)
+
+    def counter(self, name: str, help_text: str, label_names: List[str]) -> MetricFamily:
+        return self._family("counter", name, help_text, label_names)
+
+    def gauge(self, name: str, help_text: str, label_names: List[str]) -> MetricFamily:
+        return self._family("gauge", name, help_text, label_names)
+
+    def render_prometheus(self) -> str:
+        """Text exposition format 0.0.4"""
+        lines = []
+        with self._lock:
+            families = list(self._families.values())
+        for family in families:
+            lines.append(f"# HELP {family.name} {family.help_text}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for key, child in family.children():
+                labels = [f'{name}="{value}"' for name, value in zip(family.label_names, key)]
+                if family.kind in ("counter", "gauge"):
+                    lines.append(f"{family.name}{_format_labels(labels)} {child.value}")
+                    continue
+                snapshot = child.snapshot()
+                for bound, count in snapshot["buckets"]:
+                    bucket_labels = labels + [f'le="{bound}"']
+                    lines.append(f"{family.name}_bucket{_format_labels(bucket_labels)} {count}")
+                lines.append(f"{family.name}_sum{_format_labels(labels)} {snapshot['sum']}")
+                lines.append(f"{family.name}_count{_format_labels(labels)} {snapshot['count']}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels: List[str]) -> str:
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "emotionbank_stage_duration_ms", "Time spent in each processing stage", ["stage"]
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "emotionbank_stage_errors_total", "Stages that raised an exception", ["stage"]
+)
+
+# Per-request list of (stage, milliseconds); set by the request middleware
+_current_trace = contextvars.ContextVar("emotionbank_trace", default=None)
+
+def start_trace() -> List:
+    trace = []
+    _current_trace.set(trace)
+    return trace
+
+def current_trace() -> Optional[List]:
+    """The current request's trace, to hand to work that runs outside its context"""
+    return _current_trace.get()
+
+@contextmanager
+def span(stage: str):
+    """Time a stage into the stage histogram and the current request's trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage=stage).inc()
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        STAGE_DURATION.labels(stage=stage).observe(elapsed_ms)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed_ms))
@@ -0,0 +1,73 @@
+"""Convert JSON-text embeddings in memories.db to binary blobs, in place.
+
+Rows are processed in id order in fixed-size batches, each committed on
+its own, so the migration can be interrupted and re-run safely: rows that
+are already binary are skipped.
+
+    python migrate_embeddings.py --db memories.db --batch-size 1000 --dtype float16
+"""
+import argparse
+import logging
+import sqlite3
+import time
+from embedding_codec import encode_embedding, decode_embedding, is_encoded, EMBEDDING_DTYPE
+
+EMBEDDING_COLUMNS = ("text_embedding", "image_embedding")
+
+def _convert(value, dtype: str):
+    if value is None or is_encoded(value):
+        return value
+    return encode_embedding(decode_embedding(value), dtype)
+
+def migrate(db_path: str, batch_size: int = 1000, dtype: str = EMBEDDING_DTYPE,
+            vacuum: bool = False) -> int:
+    conn = sqlite3.connect(db_path)
+    converted = 0
+    last_id = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            rows = conn.execute(
+                "SELECT id, text_embedding, image_embedding FROM memories "
+                "WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for memory_id, text_embedding, image_embedding in rows:
+                new_text = _convert(text_embedding, dtype)
+                new_image = _convert(image_embedding, dtype)
+                if new_text is not text_embedding or new_image is not image_embedding:
+                    updates.append((new_text, new_image, memory_id))
+
+            if updates:
+                conn.executemany(
+                    "UPDATE memories SET text_embedding = ?, image_embedding = ? WHERE id = ?",
+                    updates
+                )
+                conn.commit()
+                converted += len(updates)
+
+            last_id = rows[-1][0]
+            logging.info(f"Migrated up to id {last_id} ({converted} rows converted)")
+
+        if vacuum:
+            # Reclaim the space freed by the smaller rows
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    logging.info(f"Converted {converted} rows in {time.perf_counter() - started:.1f}s")
+    return converted
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Convert stored embeddings to binary blobs")
+    parser.add_argument("--db", default="memories.db")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default=EMBEDDING_DTYPE)
+    parser.add_argument("--vacuum", action="store_true", help="Run VACUUM after converting")
+    args = parser.parse_args()
+    migrate(args.db, args.batch_size, args.dtype, args.vacuum)
@@ -0,0 +1,204 @@
+"""Precomputed k-nearest-neighbour graph of memories.
+
+`memory_neighbors` holds each memory's top NEIGHBOR_K neighbours by text
+similarity, by image similarity and by their fusion (ranking.fuse_rankings,
+the same fusion search uses). Right after new memories are indexed they
+get their own lists from one batched query per collection, and are
+spliced into the lists of the memories they turned up next to, so
+"more like this" is one indexed lookup instead of two vector searches.
+
+Memories stored before the graph existed have no lists until a rebuild;
+lookups for them fall back to a live vector search:
+
+    python neighbors.py --rebuild    # recompute every list from the vector collections
+"""
+import os
+import json
+import time
+import logging
+import argparse
+from typing import Dict, List, Tuple
+from sqlalchemy.orm import Session
+from database import Memory, MemoryNeighbor, session_scope
+from metrics import span
+from ranking import FUSION_TEXT_WEIGHT, FUSION_IMAGE_WEIGHT, fuse_rankings
+
+NEIGHBOR_K = int(os.environ.get("EMOTIONBANK_NEIGHBOR_K", "20"))  # 0 disables the graph
+NEIGHBOR_BATCH_SIZE = int(os.environ.get("EMOTIONBANK_NEIGHBOR_BATCH_SIZE", "256"))
+NEIGHBOR_KINDS = ("text", "image", "fused")
+
+def similarity(distance: float) -> float:
+    return 1.0 / (1.0 + float(distance))
+
+def _top_k(entries, k: int) -> List[Tuple[int, float]]:
+    """Best `k` (neighbor_id, score) pairs, one per neighbour"""
+    best = {}
+    for neighbor_id, score in entries:
+        if score > best.get(neighbor_id, float("-inf")):
+            best[neighbor_id] = score
+    return sorted(best.items(), key=lambda entry: (-entry[1], entry[0]))[:k]
+
+def fused_list(text_neighbors: List[Tuple[int, float]], image_neighbors: List[Tuple[int, float]],
+               k: int) -> List[Tuple[int, float]]:
+    """Fuse a memory's text and image lists the way search fuses its two rankings"""
+    rankings = [
+        (weight, [(neighbor_id, 1.0 / score - 1.0, None) for neighbor_id, score in neighbors])
+        for weight, neighbors in ((FUSION_TEXT_WEIGHT, text_neighbors), (FUSION_IMAGE_WEIGHT, image_neighbors))
+        if neighbors
+    ]
+    return [(neighbor_id, score) for neighbor_id, score, _ in fuse_rankings(rankings)[:k]]
+
+def load_lists(db: Session, kind: str, memory_ids: List[int]) -> Dict[int, List[Tuple[int, float]]]:
+    """Stored (neighbor_id, score) lists of `kind`, best first; memories without one are absent"""
+    lists = {}
+    # Stay well under SQLite's bound-parameter limit
+    for start in range(0, len(memory_ids), 500):
+        rows = db.query(MemoryNeighbor.memory_id, MemoryNeighbor.neighbor_id, MemoryNeighbor.score).filter(
+            MemoryNeighbor.kind == kind, MemoryNeighbor.memory_id.in_(memory_ids[start:start + 500])
+        ).order_by(MemoryNeighbor.memory_id, MemoryNeighbor.rank)
+        for row in rows:
+            lists.setdefault(row.memory_id, []).append((row.neighbor_id, row.score))
+    return lists
+
+def replace_lists(db: Session, kind: str, lists: Dict[int, List[Tuple[int, float]]]):
+    """Rewrite the `kind` lists of the given memories, in bulk; the caller commits"""
+    memory_ids = list(lists)
+    for start in range(0, len(memory_ids), 500):
+        db.query(MemoryNeighbor).filter(
+            MemoryNeighbor.kind == kind, MemoryNeighbor.memory_id.in_(memory_ids[start:start + 500])
+        ).delete(synchronize_session=False)
+    rows = [
+        {"memory_id": memory_id, "kind": kind, "rank": rank, "neighbor_id": neighbor_id, "score": score}
+        for memory_id, neighbors in lists.items()
+        for rank, (neighbor_id, score) in enumerate(neighbors)
+    ]
+    if rows:
+        db.execute(MemoryNeighbor.__table__.insert(), rows)
+
+class NeighborGraph:
+    def __init__(self, memory_handler, k: int = NEIGHBOR_K):
+        self.memory_handler = memory_handler
+        self.k = k
+
+    @property
+    def enabled(self) -> bool:
+        return self.k > 0
+
+    def _write(self, fn, *args):
+        """Run fn(db, *args) in one transaction, through the writer when the handler has one"""
+        if self.memory_handler.writer is not None:
+            return self.memory_handler.writer.submit(fn, *args).result()
+        with session_scope(self.memory_handler.session_factory) as db:
+            return fn(db, *args)
+
+    def _search(self, collection, ids: List[str], vectors: List) -> Dict[int, List[Tuple[int, float]]]:
+        """Top-k (neighbor_id, similarity) for each query vector, one batched query, self excluded"""
+        n_results = min(self.k + 1, collection.count())
+        if not ids or n_results == 0:
+            return {}
+        results = collection.query(query_embeddings=vectors, n_results=n_results, include=["distances"])
+        return {
+            int(memory_id): _top_k(
+                ((int(found_id), similarity(distance))
+                 for found_id, distance in zip(found_ids, distances) if found_id != memory_id),
+                self.k
+            )
+            for memory_id, found_ids, distances in zip(ids, results["ids"], results["distances"])
+        }
+
+    def _find(self, ids: List[str], text_vectors: List, image_vectors: List) -> Dict[str, Dict]:
+        with_images = [i for i, vector in enumerate(image_vectors) if vector is not None]
+        with span("neighbors.query"):
+            return {
+                "text": self._search(self.memory_handler.text_collection, ids, text_vectors),
+                "image": self._search(
+                    self.memory_handler.image_collection,
+                    [ids[i] for i in with_images], [image_vectors[i] for i in with_images]
+                )
+            }
+
+    def add_memories(self, ids: List[str], text_vectors: List, image_vectors: List):
+        """Give newly indexed memories their lists and splice them into their neighbours' lists"""
+        if not self.enabled or not ids:
+            return
+        found = self._find(ids, text_vectors, image_vectors)
+        with span("neighbors.write"):
+            self._write(self._splice, found)
+
+    def _splice(self, db: Session, found: Dict[str, Dict]):
+        touched = set()
+        for kind, lists in found.items():
+            # Distances are symmetric: a new memory is a candidate for each of its own neighbours
+            backlinks = {}
+            for memory_id, neighbors in lists.items():
+                for neighbor_id, score in neighbors:
+                    if neighbor_id not in lists:
+                        backlinks.setdefault(neighbor_id, []).append((memory_id, score))
+            updated = dict(lists)
+            # Memories without a list yet are left for a rebuild rather than given a partial one
+            for neighbor_id, current in load_lists(db, kind, list(backlinks)).items():
+                merged = _top_k(current + backlinks[neighbor_id], self.k)
+                if merged != current:
+                    updated[neighbor_id] = merged
+            replace_lists(db, kind, updated)
+            touched.update(updated)
+
+        memory_ids = sorted(touched)
+        text_lists = load_lists(db, "text", memory_ids)
+        image_lists = load_lists(db, "image", memory_ids)
+        replace_lists(db, "fused", {
+            memory_id: fused_list(text_lists.get(memory_id, []), image_lists.get(memory_id, []), self.k)
+            for memory_id in memory_ids
+        })
+
+    def _replace_batch(self, db: Session, memory_ids: List[int], found: Dict[str, Dict]):
+        for kind, lists in found.items():
+            replace_lists(db, kind, lists)
+        replace_lists(db, "fused", {
+            memory_id: fused_list(found["text"].get(memory_id, []), found["image"].get(memory_id, []), self.k)
+            for memory_id in memory_ids
+        })
+
+    def rebuild(self, batch_size: int = NEIGHBOR_BATCH_SIZE) -> Dict:
+        """Recompute every memory's lists from its stored embeddings, one batch of queries at a time"""
+        started = time.perf_counter()
+        self._write(lambda db: db.query(MemoryNeighbor).delete(synchronize_session=False))
+        last_id = 0
+        total = 0
+        while self.enabled:
+            with session_scope(self.memory_handler.session_factory) as db:
+                # Selecting the columns loads them despite the deferral on Memory
+                rows = db.query(Memory.id, Memory.text_embedding, Memory.image_embedding).filter(
+                    Memory.id > last_id
+                ).order_by(Memory.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            with_text = [row for row in rows if row.text_embedding is not None]
+            found = self._find(
+                [str(row.id) for row in with_text],
+                [row.text_embedding.tolist() for row in with_text],
+                [None if row.image_embedding is None else row.image_embedding.tolist() for row in with_text]
+            )
+            self._write(self._replace_batch, [row.id for row in with_text], found)
+            total += len(rows)
+            logging.info(f"Rebuilt neighbour lists for {total} memories")
+        return {"memories": total, "k": self.k, "seconds": time.perf_counter() - started}
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the precomputed neighbour graph")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute every memory's neighbour lists")
+    parser.add_argument("--k", type=int, default=NEIGHBOR_K)
+    parser.add_argument("--batch-size", type=int, default=NEIGHBOR_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.rebuild:
+        from database import SessionLocal, init_db
+        from memory_handler import MemoryHandler
+
+        init_db()
+        # Neighbours come from the stored embeddings and the vector collections; no models are loaded
+        handler = MemoryHandler(SessionLocal, emotion_analyzer=None)
+        print(json.dumps(NeighborGraph(handler, args.k).rebuild(args.batch_size), indent=2))
@@ -0,0 +1,289 @@
+"""ONNX Runtime CPU backend for the EmotionAnalyzer encoders.
+
+Each torch model is exported to ONNX once (optionally with dynamic int8
+quantization), cached under ./model_cache/onnx, and wrapped in an object
+with the same call surface EmotionAnalyzer uses on the torch model, so
+the analyzer code is identical for both backends.
+
+    python onnx_backend.py --parity [--images ./photos]
+
+compares the ONNX backend against torch and reports score differences,
+embedding cosine similarity and the speedup per model.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from types import SimpleNamespace
+from typing import Dict, List
+import numpy as np
+import torch
+import onnxruntime as ort
+from transformers import AutoConfig
+
+ONNX_DIR = os.environ.get("EMOTIONBANK_ONNX_DIR", "./model_cache/onnx")
+ONNX_QUANTIZE = os.environ.get("EMOTIONBANK_ONNX_QUANTIZE", "1") == "1"
+ONNX_INTRA_OP_THREADS = int(os.environ.get("EMOTIONBANK_ONNX_INTRA_OP_THREADS", "0"))  # 0 lets ORT decide
+ONNX_INTER_OP_THREADS = int(os.environ.get("EMOTIONBANK_ONNX_INTER_OP_THREADS", "1"))
+ONNX_OPSET = 14
+
+class OnnxRuntime:
+    """Exports, quantizes and opens ONNX Runtime sessions with shared settings"""
+
+    def __init__(self, onnx_dir: str = ONNX_DIR, quantize: bool = ONNX_QUANTIZE,
+                 intra_op_threads: int = ONNX_INTRA_OP_THREADS,
+                 inter_op_threads: int = ONNX_INTER_OP_THREADS):
+        self.onnx_dir = onnx_dir
+        self.quantize = quantize
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+    @property
+    def tag(self) -> str:
+        """Appended to model revisions so cached outputs never mix backends"""
+        return "onnx-int8" if self.quantize else "onnx-fp32"
+
+    def session(self, name: str, revision: str, export_fn) -> ort.InferenceSession:
+        """Open the session for `name`, exporting with `export_fn(path)` on first use"""
+        base = os.path.join(self.onnx_dir, f"{name.replace('/', '--')}-{revision}")
+        path = f"{base}.onnx"
+        if not os.path.exists(path):
+            os.makedirs(self.onnx_dir, exist_ok=True)
+            logging.info(f"Exporting {name} to {path}")
+            export_fn(path)
+
+        if self.quantize:
+            quantized_path = f"{base}.int8.onnx"
+            if not os.path.exists(quantized_path):
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+                logging.info(f"Quantizing {path} to int8")
+                quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+            path = quantized_path
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+def _export(module: torch.nn.Module, inputs: Dict[str, torch.Tensor], output_name: str,
+            dynamic_axes: Dict, path: str):
+    module.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            tuple(inputs.values()),
+            path,
+            input_names=list(inputs),
+            output_names=[output_name],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET
+        )
+
+class _LogitsOnly(torch.nn.Module):
+    def __init__(self, model, input_names: List[str]):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *args):
+        return self.model(**dict(zip(self.input_names, args))).logits
+
+class _ClipImageFeatures(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+class _ClipTextFeatures(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+def _feed(session: ort.InferenceSession, inputs) -> Dict[str, np.ndarray]:
+    names = {node.name for node in session.get_inputs()}
+    return {
+        name: value.numpy() if isinstance(value, torch.Tensor) else np.asarray(value)
+        for name, value in inputs.items() if name in names
+    }
+
+class OnnxSequenceModel:
+    """Stands in for a transformers sequence-classification model: `model(**inputs).logits`"""
+
+    def __init__(self, model_name: str, tokenizer, runtime: OnnxRuntime):
+        self.config = AutoConfig.from_pretrained(model_name)
+        self.backend_tag = runtime.tag
+        revision = getattr(self.config, "_commit_hash", None) or "unknown"
+
+        def export(path):
+            from transformers import AutoModelForSequenceClassification
+            model = AutoModelForSequenceClassification.from_pretrained(model_name)
+            sample = dict(tokenizer(["export sample"], return_tensors="pt"))
+            axes = {name: {0: "batch", 1: "sequence"} for name in sample}
+            axes["logits"] = {0: "batch"}
+            _export(_LogitsOnly(model, list(sample)), sample, "logits", axes, path)
+
+        self.session = runtime.session(model_name, revision, export)
+
+    def __call__(self, **inputs):
+        logits = self.session.run(["logits"], _feed(self.session, inputs))[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+class OnnxEmotionClassifier:
+    """Stands in for the text-classification pipeline with return_all_scores=True"""
+
+    def __init__(self, model_name: str, runtime: OnnxRuntime):
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = OnnxSequenceModel(model_name, self.tokenizer, runtime)
+        self.labels = [self.model.config.id2label[i] for i in range(len(self.model.config.id2label))]
+
+    def __call__(self, texts: List[str], batch_size: int = None) -> List[List[Dict]]:
+        inputs = self.tokenizer(texts, padding=True, truncation=True, return_tensors="np")
+        logits = self.model(**inputs).logits.numpy()
+        # Same softmax the pipeline applies for single-label models
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities = exp / exp.sum(axis=1, keepdims=True)
+        return [
+            [{"label": label, "score": float(score)} for label, score in zip(self.labels, row)]
+            for row in probabilities
+        ]
+
+class OnnxClipModel:
+    """Stands in for CLIPModel's get_image_features/get_text_features"""
+
+    def __init__(self, model_name: str, processor, runtime: OnnxRuntime):
+        self.config = AutoConfig.from_pretrained(model_name)
+        self.backend_tag = runtime.tag
+        revision = getattr(self.config, "_commit_hash", None) or "unknown"
+        self._torch_model = None
+
+        def torch_model():
+            if self._torch_model is None:
+                from transformers import CLIPModel
+                self._torch_model = CLIPModel.from_pretrained(model_name)
+            return self._torch_model
+
+        def export_image(path):
+            size = processor.image_processor.crop_size["height"]
+            sample = {"pixel_values": torch.zeros(1, 3, size, size)}
+            axes = {"pixel_values": {0: "batch"}, "image_features": {0: "batch"}}
+            _export(_ClipImageFeatures(torch_model()), sample, "image_features", axes, path)
+
+        def export_text(path):
+            sample = dict(processor(text=["export sample"], return_tensors="pt", padding=True))
+            sample = {name: sample[name] for name in ("input_ids", "attention_mask")}
+            axes = {name: {0: "batch", 1: "sequence"} for name in sample}
+            axes["text_features"] = {0: "batch"}
+            _export(_ClipTextFeatures(torch_model()), sample, "text_features", axes, path)
+
+        self.image_session = runtime.session(f"{model_name}-image", revision, export_image)
+        self.text_session = runtime.session(f"{model_name}-text", revision, export_text)
+        self._torch_model = None  # Only needed for export
+
+    def get_image_features(self, **inputs) -> torch.Tensor:
+        features = self.image_session.run(["image_features"], _feed(self.image_session, inputs))[0]
+        return torch.from_numpy(features)
+
+    def get_text_features(self, **inputs) -> torch.Tensor:
+        features = self.text_session.run(["text_features"], _feed(self.text_session, inputs))[0]
+        return torch.from_numpy(features)
+
+# Parity check
+
+PARITY_TEXTS = [
+    "We finally made it to the beach and the kids could not stop laughing.",
+    "I miss her every day since the funeral.",
+    "The landlord ignored us again and I am furious.",
+    "Waiting for the test results is making me so nervous.",
+    "Thank you all for the surprise party, I love you!"
+]
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+def _timed(fn, *args, repeats: int = 3):
+    fn(*args)  # Warm-up
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = fn(*args)
+    return result, (time.perf_counter() - started) / repeats
+
+def parity_report(image_paths: List[str]) -> Dict:
+    from PIL import Image
+    from embedding_cache import EmbeddingCache
+    from emotion_tagging import EmotionAnalyzer
+
+    if image_paths:
+        images = [Image.open(path).convert("RGB") for path in image_paths]
+    else:
+        rng = np.random.default_rng(0)
+        images = [Image.fromarray(rng.integers(0, 255, (256, 256, 3), dtype=np.uint8)) for _ in range(4)]
+
+    # Separate caches so neither backend can serve the other's outputs
+    torch_analyzer = EmotionAnalyzer(cache=EmbeddingCache(), backend="torch")
+    onnx_analyzer = EmotionAnalyzer(cache=EmbeddingCache(), backend="onnx")
+
+    report = {}
+    checks = {
+        "emotion": lambda analyzer: np.array([
+            [score["score"] for score in scores] for scores in analyzer._classify_emotions(PARITY_TEXTS)
+        ]),
+        "text": lambda analyzer: np.array(analyzer._embed_texts(PARITY_TEXTS)),
+        "clip_image": lambda analyzer: np.array(analyzer._embed_images(images)),
+        "clip_text": lambda analyzer: analyzer.encode_clip_texts(PARITY_TEXTS)
+    }
+    for name, run in checks.items():
+        expected, torch_seconds = _timed(run, torch_analyzer)
+        actual, onnx_seconds = _timed(run, onnx_analyzer)
+        entry = {
+            "torch_ms": torch_seconds * 1000,
+            "onnx_ms": onnx_seconds * 1000,
+            "speedup": torch_seconds / onnx_seconds if onnx_seconds else None
+        }
+        if name == "emotion":
+            entry["max_abs_score_diff"] = float(np.abs(expected - actual).max())
+            entry["top_label_agreement"] = float((expected.argmax(1) == actual.argmax(1)).mean())
+        else:
+            cosine = _cosine(expected, actual)
+            entry["min_cosine"] = float(cosine.min())
+            entry["mean_cosine"] = float(cosine.mean())
+        report[name] = entry
+    return report
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="ONNX Runtime backend tools")
+    parser.add_argument("--parity", action="store_true", help="Compare the ONNX backend with torch")
+    parser.add_argument("--images", default=None, help="Directory of sample images for the parity check")
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--max-score-diff", type=float, default=0.05)
+    args = parser.parse_args()
+
+    if args.parity:
+        paths = []
+        if args.images:
+            paths = [
+                os.path.join(args.images, name) for name in sorted(os.listdir(args.images))
+                if name.lower().endswith((".jpg", ".jpeg", ".png"))
+            ]
+        result = parity_report(paths)
+        print(json.dumps(result, indent=2))
+
+        failed = [
+            name for name, entry in result.items()
+            if entry.get("min_cosine", 1.0) < args.min_cosine
+            or entry.get("max_abs_score_diff", 0.0) > args.max_score_diff
+        ]
+        if failed:
+            print(f"Parity check failed for: {', '.join(failed)}")
+            sys.exit(1)
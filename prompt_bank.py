@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from typing import Callable, List
+
+# Templates averaged into one embedding per emotion (prompt ensemble).
+# Bump PROMPT_SET_VERSION whenever the templates change meaning.
+PROMPT_TEMPLATES = [
+    "an image expressing {emotion}",
+    "a photo that conveys {emotion}",
+    "a picture of people feeling {emotion}",
+    "a moment full of {emotion}"
+]
+PROMPT_SET_VERSION = 1
+PROMPT_BANK_DIR = os.environ.get("EMOTIONBANK_PROMPT_BANK_DIR", "./model_cache")
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class PromptBank:
+    """Per-emotion CLIP text embeddings, computed once and persisted to disk.
+
+    The bank file is keyed by model name, model revision, emotion list,
+    templates and PROMPT_SET_VERSION, so any change produces a new file
+    instead of silently reusing stale embeddings.
+    """
+
+    def __init__(self, model_name: str, revision: str, emotions: List[str],
+                 templates: List[str] = PROMPT_TEMPLATES,
+                 bank_dir: str = PROMPT_BANK_DIR):
+        self.model_name = model_name
+        self.revision = revision
+        self.emotions = list(emotions)
+        self.templates = list(templates)
+        self.bank_dir = bank_dir
+        self.embeddings = None
+
+    @property
+    def key(self) -> str:
+        spec = json.dumps({
+            "model": self.model_name,
+            "revision": self.revision,
+            "emotions": self.emotions,
+            "templates": self.templates,
+            "version": PROMPT_SET_VERSION
+        }, sort_keys=True)
+        return hashlib.sha256(spec.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.bank_dir, f"prompt_bank_{self.key}.npy")
+
+    def load_or_build(self, encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Load the bank from disk, or encode every prompt with `encode_fn` and persist it"""
+        if os.path.exists(self.path):
+            self.embeddings = np.load(self.path)
+            logging.info(f"Loaded prompt bank {self.path}")
+            return self.embeddings
+
+        prompts = [
+            template.format(emotion=emotion)
+            for emotion in self.emotions
+            for template in self.templates
+        ]
+        prompt_embeddings = _normalize(np.asarray(encode_fn(prompts), dtype=np.float32))
+
+        # Average each emotion's templates, then renormalize
+        ensembled = prompt_embeddings.reshape(len(self.emotions), len(self.templates), -1).mean(axis=1)
+        self.embeddings = _normalize(ensembled).astype(np.float32)
+
+        os.makedirs(self.bank_dir, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, self.embeddings)
+        os.replace(temp_path, self.path)
+        logging.info(f"Built prompt bank {self.path} from {len(prompts)} prompts")
+        return self.embeddings
+
+    def score(self, image_features: np.ndarray) -> np.ndarray:
+        """Cosine similarity of each image embedding to each emotion (images x emotions)"""
+        return _normalize(np.asarray(image_features, dtype=np.float32)) @ self.embeddings.T
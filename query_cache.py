@@ -0,0 +1,123 @@
+"""Result cache for memory searches and browse pages.
+
+Entries are keyed on the normalized search parameters and stamped with
+the cache generation current when the search started. Anything that can
+change search results (storing memories, reconciliation repairs, vector
+metadata refreshes, deletes) bumps the generation, which turns every
+older entry into a miss at once. Entries also expire after a TTL, which
+bounds staleness from writes made by other processes such as the CLI
+tools, and the least recently used entries are evicted past max_entries.
+"""
+import os
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Tuple
+from metrics import REGISTRY
+
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("EMOTIONBANK_QUERY_CACHE_MAX_ENTRIES", "1024"))  # 0 disables
+QUERY_CACHE_TTL_S = float(os.environ.get("EMOTIONBANK_QUERY_CACHE_TTL_S", "300"))
+
+QUERY_CACHE_LOOKUPS = REGISTRY.counter(
+    "emotionbank_query_cache_lookups_total", "Search result cache lookups by outcome", ["result"]
+)
+QUERY_CACHE_INVALIDATIONS = REGISTRY.counter(
+    "emotionbank_query_cache_invalidations_total", "Search result cache generation bumps", ["reason"]
+)
+QUERY_CACHE_ENTRIES = REGISTRY.gauge(
+    "emotionbank_query_cache_entries", "Entries held by the search result cache", []
+)
+# Resolved once so lookups don't take the family lock
+_LOOKUP_RESULTS = {
+    result: QUERY_CACHE_LOOKUPS.labels(result=result) for result in ("hit", "miss", "stale", "expired")
+}
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(unicodedata.normalize("NFC", value).split())
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def cache_key(kind: str, **params) -> Tuple:
+    """Hashable key for a search: text is NFC-normalized with whitespace collapsed, unset params dropped"""
+    return (kind,) + tuple(sorted(
+        (name, _normalize(value)) for name, value in params.items() if value not in (None, "")
+    ))
+
+class QueryCache:
+    def __init__(self, max_entries: int = QUERY_CACHE_MAX_ENTRIES, ttl_s: float = QUERY_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.generation = 0
+        self._entries = OrderedDict()  # key -> (generation, expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: Tuple):
+        """Cached value for `key`, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                outcome = "miss"
+            elif entry[0] != self.generation:
+                outcome = "stale"
+            elif entry[1] < time.monotonic():
+                outcome = "expired"
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                _LOOKUP_RESULTS["hit"].inc()
+                return entry[2]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+        _LOOKUP_RESULTS[outcome].inc()
+        return None
+
+    def put(self, key: Tuple, value, generation: int):
+        """Store a value computed from data as of `generation`; dropped if a write happened since"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (generation, time.monotonic() + self.ttl_s, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            QUERY_CACHE_ENTRIES.labels().set(len(self._entries))
+
+    def bump(self, reason: str):
+        """Invalidate every entry; call after any write that can change search results"""
+        with self._lock:
+            self.generation += 1
+            # Older entries can never hit again, so free them now
+            self._entries.clear()
+            QUERY_CACHE_ENTRIES.labels().set(0)
+        QUERY_CACHE_INVALIDATIONS.labels(reason=reason).inc()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
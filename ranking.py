@@ -0,0 +1,28 @@
+"""Fusion of ranked result lists from the text and image collections.
+
+Text and image similarity are fused by reciprocal rank ("rrf") or by a
+weighted sum of similarities ("weighted"). Search results and the
+precomputed neighbour graph use the same fusion so they rank alike.
+"""
+import os
+from typing import Dict, List, Tuple
+
+FUSION_METHOD = os.environ.get("EMOTIONBANK_FUSION", "rrf")
+FUSION_TEXT_WEIGHT = float(os.environ.get("EMOTIONBANK_FUSION_TEXT_WEIGHT", "0.6"))
+FUSION_IMAGE_WEIGHT = float(os.environ.get("EMOTIONBANK_FUSION_IMAGE_WEIGHT", "0.4"))
+RRF_K = 60
+
+def fuse_rankings(rankings: List[Tuple[float, List[Tuple[str, float, Dict]]]],
+                  method: str = FUSION_METHOD) -> List[Tuple[str, float, Dict]]:
+    """Merge (weight, [(id, distance, metadata), ...]) lists, best first"""
+    scores, metadatas = {}, {}
+    for weight, results in rankings:
+        for rank, (memory_id, distance, metadata) in enumerate(results):
+            if method == "weighted":
+                score = weight / (1.0 + distance)
+            else:
+                score = weight / (RRF_K + rank + 1)
+            scores[memory_id] = scores.get(memory_id, 0.0) + score
+            metadatas.setdefault(memory_id, metadata)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return [(memory_id, score, metadatas[memory_id]) for memory_id, score in ranked]
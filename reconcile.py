@@ -0,0 +1,161 @@
+"""Keep the vector collections in step with SQLite using the stored embeddings.
+
+SQLite is the source of truth. A memory is committed there first and is
+then upserted into `text_memories` and, when it has an image vector,
+`image_memories`. A crash between the two steps leaves vectors missing,
+and deleted memories can leave orphans. Reconciliation fixes both
+without running any model:
+
+    python reconcile.py              # diff, re-add missing vectors, remove orphans
+    python reconcile.py --dry-run    # only report drift
+    python reconcile.py --rebuild    # recreate the vector store from memories.db
+
+The server also runs reconciliation periodically (EMOTIONBANK_RECONCILE_INTERVAL_S).
+"""
+import os
+import json
+import time
+import logging
+import argparse
+from typing import Dict, List, Set
+import numpy as np
+from sqlalchemy.orm import undefer
+from database import Memory, session_scope
+from metrics import REGISTRY
+
+RECONCILE_BATCH_SIZE = int(os.environ.get("EMOTIONBANK_RECONCILE_BATCH_SIZE", "2000"))
+RECONCILE_INTERVAL_S = float(os.environ.get("EMOTIONBANK_RECONCILE_INTERVAL_S", "3600"))  # 0 disables
+
+VECTOR_DRIFT = REGISTRY.gauge(
+    "emotionbank_vector_drift", "Vectors missing from or orphaned in a collection at the last check",
+    ["collection", "kind"]
+)
+VECTOR_REPAIRS = REGISTRY.counter(
+    "emotionbank_vector_repairs_total", "Vectors re-added or removed by reconciliation",
+    ["collection", "action"]
+)
+
+class VectorReconciler:
+    def __init__(self, memory_handler, batch_size: int = RECONCILE_BATCH_SIZE):
+        self.memory_handler = memory_handler
+        self.batch_size = batch_size
+        self.last_report = None
+
+    def _collections(self) -> Dict:
+        # Which stored embedding column feeds each collection
+        return {
+            "text": (self.memory_handler.text_collection, Memory.text_embedding),
+            "image": (self.memory_handler.image_collection, Memory.image_embedding)
+        }
+
+    def _sqlite_ids(self, embedding_column) -> Set[str]:
+        with session_scope(self.memory_handler.session_factory) as db:
+            return {str(row.id) for row in db.query(Memory.id).filter(embedding_column.isnot(None))}
+
+    def _still_missing(self, embedding_column, memory_ids: List[str]) -> List[str]:
+        """The ids among `memory_ids` that SQLite still has no embedded memory for"""
+        existing = set()
+        with session_scope(self.memory_handler.session_factory) as db:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(memory_ids), 500):
+                batch = [int(memory_id) for memory_id in memory_ids[start:start + 500]]
+                existing.update(str(row.id) for row in db.query(Memory.id).filter(
+                    Memory.id.in_(batch), embedding_column.isnot(None)
+                ))
+        return [memory_id for memory_id in memory_ids if memory_id not in existing]
+
+    def _vector_ids(self, collection) -> Set[str]:
+        ids = set()
+        offset = 0
+        while True:
+            page = collection.get(include=[], limit=self.batch_size, offset=offset)["ids"]
+            ids.update(page)
+            if len(page) < self.batch_size:
+                return ids
+            offset += len(page)
+
+    def _add_from_sqlite(self, collection, embedding_column, memory_ids: List[str]):
+        """Upsert vectors for `memory_ids` from their stored embeddings, one batch at a time"""
+        for start in range(0, len(memory_ids), self.batch_size):
+            batch = [int(memory_id) for memory_id in memory_ids[start:start + self.batch_size]]
+            with session_scope(self.memory_handler.session_factory) as db:
+                memories = db.query(Memory).options(undefer(embedding_column)).filter(
+                    Memory.id.in_(batch)
+                ).all()
+                ids = [str(memory.id) for memory in memories]
+                embeddings = [
+                    np.asarray(getattr(memory, embedding_column.key), dtype=np.float32).tolist()
+                    for memory in memories
+                ]
+                metadatas = [self.memory_handler.vector_metadata(memory) for memory in memories]
+            if ids:
+                collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas)
+
+    def reconcile(self, dry_run: bool = False) -> Dict:
+        """Diff SQLite against both collections and repair the differences; returns a drift report"""
+        started = time.perf_counter()
+        report = {"dry_run": dry_run, "collections": {}}
+        for name, (collection, embedding_column) in self._collections().items():
+            expected = self._sqlite_ids(embedding_column)
+            present = self._vector_ids(collection)
+            missing = sorted(expected - present, key=int)
+            # Memories committed and indexed between the two reads are not orphans
+            orphaned = self._still_missing(embedding_column, sorted(present - expected, key=int))
+            VECTOR_DRIFT.labels(collection=name, kind="missing").set(len(missing))
+            VECTOR_DRIFT.labels(collection=name, kind="orphaned").set(len(orphaned))
+
+            if not dry_run:
+                for start in range(0, len(orphaned), self.batch_size):
+                    collection.delete(ids=orphaned[start:start + self.batch_size])
+                self._add_from_sqlite(collection, embedding_column, missing)
+                VECTOR_REPAIRS.labels(collection=name, action="added").inc(len(missing))
+                VECTOR_REPAIRS.labels(collection=name, action="removed").inc(len(orphaned))
+                if missing or orphaned:
+                    self.memory_handler.query_cache.bump("reconcile")
+
+            report["collections"][name] = {
+                "sqlite": len(expected),
+                "vectors": len(present),
+                "missing": len(missing),
+                "orphaned": len(orphaned)
+            }
+            if missing or orphaned:
+                logging.warning(
+                    f"Vector drift in {name} collection: {len(missing)} missing, {len(orphaned)} orphaned"
+                    + ("" if dry_run else " (repaired)")
+                )
+        report["seconds"] = time.perf_counter() - started
+        self.last_report = report
+        return report
+
+    def rebuild(self) -> Dict:
+        """Recreate both collections from SQLite alone"""
+        started = time.perf_counter()
+        self.memory_handler.reset_vector_collections()
+        report = {"collections": {}}
+        for name, (collection, embedding_column) in self._collections().items():
+            memory_ids = sorted(self._sqlite_ids(embedding_column), key=int)
+            self._add_from_sqlite(collection, embedding_column, memory_ids)
+            report["collections"][name] = {"indexed": len(memory_ids)}
+            logging.info(f"Rebuilt {name} collection with {len(memory_ids)} vectors")
+        self.memory_handler.query_cache.bump("rebuild")
+        report["seconds"] = time.perf_counter() - started
+        return report
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Reconcile or rebuild the vector collections from SQLite")
+    parser.add_argument("--dry-run", action="store_true", help="Report drift without repairing it")
+    parser.add_argument("--rebuild", action="store_true", help="Drop and rebuild both collections")
+    parser.add_argument("--batch-size", type=int, default=RECONCILE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from database import SessionLocal, init_db
+    from memory_handler import MemoryHandler
+
+    init_db()
+    # Vectors come from the stored embeddings, so no models are loaded
+    handler = MemoryHandler(SessionLocal, emotion_analyzer=None)
+    reconciler = VectorReconciler(handler, args.batch_size)
+    result = reconciler.rebuild() if args.rebuild else reconciler.reconcile(dry_run=args.dry_run)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,147 @@
+"""Recompute combined emotion scores and suggested tags for the whole library.
+
+Each memory's per-modality scores are stored as dense vectors
+(`memory_modality_scores`), so new fusion weights or a new tag threshold
+only need matrix arithmetic over chunks of rows, not model inference:
+
+    python rescoring.py --text-weight 0.7 --image-weight 0.3 --threshold 0.25           # dry run
+    python rescoring.py --text-weight 0.7 --image-weight 0.3 --threshold 0.25 --apply   # write
+
+A dry run reports how many memories would change and which tags would be
+added or removed. Applying rewrites `sentiment_scores`, `suggested_tags`,
+their tag-table rows and the timeline rollups for the changed memories.
+Set the matching EMOTIONBANK_SCORE_* variables so new uploads agree.
+Memories stored before per-modality scores existed are skipped.
+"""
+import json
+import time
+import logging
+import argparse
+from typing import Dict, List
+import numpy as np
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.orm import Session
+from database import Memory, MemoryModalityScores
+from memory_tags import replace_derived_tags
+from rollups import backfill_rollups
+from score_fusion import (
+    EMOTION_CATEGORIES, SCORE_TEXT_WEIGHT, SCORE_IMAGE_WEIGHT, TAG_THRESHOLD,
+    score_vector, score_matrix, tag_mask, fuse_scores, scores_dict, tags_list
+)
+
+RESCORE_CHUNK_SIZE = 50000
+SCORE_TOLERANCE = 1e-6
+
+def modality_scores(text_analysis: Dict, image_analysis: Dict) -> MemoryModalityScores:
+    """Per-modality score row for a new memory, from the analyzer outputs"""
+    has_image = image_analysis.get("image_embedding") is not None
+    return MemoryModalityScores(
+        text_scores=score_vector(text_analysis["emotion_scores"]),
+        image_scores=score_vector(image_analysis["emotion_scores"]) if has_image else None
+    )
+
+def _write_chunk(db: Session, ids: List[int], combined: np.ndarray, suggested: np.ndarray):
+    scores = [scores_dict(row) for row in combined]
+    tags = [tags_list(row) for row in suggested]
+    db.execute(
+        update(Memory.__table__).where(Memory.__table__.c.id == bindparam("memory_id")).values(
+            sentiment_scores=bindparam("scores_json"), suggested_tags=bindparam("tags_json")
+        ),
+        [
+            {"memory_id": memory_id, "scores_json": json.dumps(row_scores), "tags_json": json.dumps(row_tags)}
+            for memory_id, row_scores, row_tags in zip(ids, scores, tags)
+        ]
+    )
+    replace_derived_tags(db, ids, tags, scores)
+
+def rescore(db: Session, text_weight: float = SCORE_TEXT_WEIGHT, image_weight: float = SCORE_IMAGE_WEIGHT,
+            threshold: float = TAG_THRESHOLD, apply: bool = False,
+            chunk_size: int = RESCORE_CHUNK_SIZE) -> Dict:
+    """Diff (and with `apply`, write) combined scores under new fusion parameters"""
+    started = time.perf_counter()
+    categories = len(EMOTION_CATEGORIES)
+    report = {
+        "text_weight": text_weight,
+        "image_weight": image_weight,
+        "threshold": threshold,
+        "applied": apply,
+        "memories": 0,
+        "scores_changed": 0,
+        "tags_changed": 0,
+        "max_abs_score_change": 0.0,
+        "tags_added": dict.fromkeys(EMOTION_CATEGORIES, 0),
+        "tags_removed": dict.fromkeys(EMOTION_CATEGORIES, 0),
+        "skipped_without_modality_scores": db.query(func.count(Memory.id)).outerjoin(
+            MemoryModalityScores, MemoryModalityScores.memory_id == Memory.id
+        ).filter(MemoryModalityScores.memory_id.is_(None)).scalar()
+    }
+    added = np.zeros(categories, dtype=np.int64)
+    removed = np.zeros(categories, dtype=np.int64)
+
+    last_id = 0
+    while True:
+        rows = db.query(
+            MemoryModalityScores.memory_id, MemoryModalityScores.text_scores,
+            MemoryModalityScores.image_scores, Memory.sentiment_scores, Memory.suggested_tags
+        ).join(Memory, Memory.id == MemoryModalityScores.memory_id).filter(
+            MemoryModalityScores.memory_id > last_id
+        ).order_by(MemoryModalityScores.memory_id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].memory_id
+
+        ids = np.fromiter((row.memory_id for row in rows), dtype=np.int64, count=len(rows))
+        text_scores = np.stack([row.text_scores for row in rows]).astype(np.float32)
+        image_scores = np.zeros_like(text_scores)
+        for i, row in enumerate(rows):
+            if row.image_scores is not None:
+                image_scores[i] = row.image_scores
+
+        combined, suggested = fuse_scores(text_scores, image_scores, text_weight, image_weight, threshold)
+        old_combined = score_matrix(row.sentiment_scores for row in rows)
+        old_suggested = tag_mask(row.suggested_tags for row in rows)
+
+        score_change = np.abs(combined - old_combined).max(axis=1)
+        tags_differ = (suggested != old_suggested).any(axis=1)
+        changed = (score_change > SCORE_TOLERANCE) | tags_differ
+        added += (suggested & ~old_suggested).sum(axis=0)
+        removed += (~suggested & old_suggested).sum(axis=0)
+
+        report["memories"] += len(rows)
+        report["scores_changed"] += int((score_change > SCORE_TOLERANCE).sum())
+        report["tags_changed"] += int(tags_differ.sum())
+        report["max_abs_score_change"] = max(report["max_abs_score_change"], float(score_change.max()))
+
+        if apply and changed.any():
+            _write_chunk(db, ids[changed].tolist(), combined[changed], suggested[changed])
+            db.commit()
+        logging.info(f"Rescored {report['memories']} memories")
+
+    report["tags_added"] = dict(zip(EMOTION_CATEGORIES, added.tolist()))
+    report["tags_removed"] = dict(zip(EMOTION_CATEGORIES, removed.tolist()))
+    if apply and report["scores_changed"]:
+        backfill_rollups(db)
+    report["seconds"] = time.perf_counter() - started
+    return report
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Re-score every memory with new fusion parameters")
+    parser.add_argument("--text-weight", type=float, default=SCORE_TEXT_WEIGHT)
+    parser.add_argument("--image-weight", type=float, default=SCORE_IMAGE_WEIGHT)
+    parser.add_argument("--threshold", type=float, default=TAG_THRESHOLD)
+    parser.add_argument("--apply", action="store_true", help="Write the new scores (default is a dry run)")
+    parser.add_argument("--refresh-vectors", action="store_true",
+                        help="After applying, rewrite the vector metadata used by filtered search")
+    parser.add_argument("--chunk-size", type=int, default=RESCORE_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    from database import SessionLocal, init_db, session_scope
+    init_db()
+    with session_scope() as db:
+        result = rescore(db, args.text_weight, args.image_weight, args.threshold, args.apply, args.chunk_size)
+    print(json.dumps(result, indent=2))
+
+    if args.apply and args.refresh_vectors and (result["scores_changed"] or result["tags_changed"]):
+        from memory_handler import MemoryHandler
+        MemoryHandler(SessionLocal, emotion_analyzer=None).refresh_vector_metadata()
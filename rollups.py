@@ -0,0 +1,127 @@
+"""Emotion timeline rollups.
+
+`emotion_rollups` holds, per period ("day" or "week") bucket and emotion,
+the count, sum and max of the combined emotion scores of the memories
+timestamped in that bucket. Rows are upserted in the same transaction
+that inserts the memories, so timeline queries read a few hundred
+pre-aggregated rows instead of every memory's scores.
+
+    python rollups.py --backfill    # rebuild the rollups from existing memories
+"""
+import logging
+import argparse
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from database import Memory, EmotionRollup
+
+PERIODS = ("day", "week")
+
+def bucket_start(timestamp: datetime, period: str) -> date:
+    day = timestamp.date()
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+def _aggregate(rows: Iterable[Tuple[datetime, Dict]]) -> Dict[Tuple, List[float]]:
+    """(period, bucket, emotion) -> [count, sum, max] for (timestamp, sentiment_scores) rows"""
+    totals = {}
+    for timestamp, scores in rows:
+        if timestamp is None or not scores:
+            continue
+        for period in PERIODS:
+            bucket = bucket_start(timestamp, period)
+            for emotion, score in scores.items():
+                score = float(score)
+                entry = totals.get((period, bucket, emotion))
+                if entry is None:
+                    totals[(period, bucket, emotion)] = [1, score, score]
+                else:
+                    entry[0] += 1
+                    entry[1] += score
+                    entry[2] = max(entry[2], score)
+    return totals
+
+def _upsert(db: Session, totals: Dict[Tuple, List[float]]):
+    if not totals:
+        return
+    values = [
+        {"period": period, "bucket_start": bucket, "emotion": emotion,
+         "count": count, "score_sum": score_sum, "score_max": score_max}
+        for (period, bucket, emotion), (count, score_sum, score_max) in totals.items()
+    ]
+    # Stay well under SQLite's bound-parameter limit
+    for start in range(0, len(values), 500):
+        statement = insert(EmotionRollup).values(values[start:start + 500])
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["period", "bucket_start", "emotion"],
+            set_={
+                "count": EmotionRollup.count + statement.excluded.count,
+                "score_sum": EmotionRollup.score_sum + statement.excluded.score_sum,
+                "score_max": func.max(EmotionRollup.score_max, statement.excluded.score_max)
+            }
+        ))
+
+def add_to_rollups(db: Session, memories: List[Memory]):
+    """Fold newly inserted memories into the rollups; the caller commits"""
+    _upsert(db, _aggregate((memory.timestamp, memory.sentiment_scores) for memory in memories))
+
+def backfill_rollups(db: Session, batch_size: int = 5000) -> int:
+    """Rebuild every rollup from the memories table in one transaction"""
+    db.query(EmotionRollup).delete(synchronize_session=False)
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.query(Memory.id, Memory.timestamp, Memory.sentiment_scores).filter(
+            Memory.id > last_id
+        ).order_by(Memory.id).limit(batch_size).all()
+        if not rows:
+            break
+        _upsert(db, _aggregate((row.timestamp, row.sentiment_scores) for row in rows))
+        total += len(rows)
+        last_id = rows[-1].id
+        logging.info(f"Rolled up {total} memories")
+    db.commit()
+    return total
+
+def timeline(db: Session, period: str, emotions: List[str] = None,
+             start: datetime = None, end: datetime = None) -> Dict:
+    """Per-bucket mean, count and max for each emotion between `start` and `end`"""
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period {period!r}; expected one of {', '.join(PERIODS)}")
+    query = db.query(EmotionRollup).filter(EmotionRollup.period == period)
+    if start:
+        query = query.filter(EmotionRollup.bucket_start >= bucket_start(start, period))
+    if end:
+        query = query.filter(EmotionRollup.bucket_start <= bucket_start(end, period))
+    if emotions:
+        query = query.filter(EmotionRollup.emotion.in_(emotions))
+
+    buckets = {}
+    for row in query.order_by(EmotionRollup.bucket_start, EmotionRollup.emotion):
+        buckets.setdefault(row.bucket_start, {})[row.emotion] = {
+            "mean": row.score_sum / row.count if row.count else 0.0,
+            "count": row.count,
+            "max": row.score_max
+        }
+    return {
+        "period": period,
+        "buckets": [
+            {"start": bucket.isoformat(), "emotions": values} for bucket, values in buckets.items()
+        ]
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the emotion timeline rollups")
+    parser.add_argument("--backfill", action="store_true", help="Rebuild rollups from all memories")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.backfill:
+        from database import init_db, session_scope
+        init_db()
+        with session_scope() as db:
+            print(f"Rolled up {backfill_rollups(db, args.batch_size)} memories")
@@ -0,0 +1,62 @@
+"""Fusion of per-modality emotion scores into combined scores and suggested tags.
+
+Scores are dense float32 vectors over EMOTION_CATEGORIES (in that order),
+so fusing one memory or a million is the same matrix expression. Stored
+per-modality vectors (`memory_modality_scores`) use this order too;
+appending a category is safe, reordering is not.
+"""
+import os
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+
+EMOTION_CATEGORIES = (
+    "joy", "sadness", "anger", "fear", "love",
+    "surprise", "neutral", "anxiety", "gratitude"
+)
+SCORE_TEXT_WEIGHT = float(os.environ.get("EMOTIONBANK_SCORE_TEXT_WEIGHT", "0.6"))
+SCORE_IMAGE_WEIGHT = float(os.environ.get("EMOTIONBANK_SCORE_IMAGE_WEIGHT", "0.4"))
+TAG_THRESHOLD = float(os.environ.get("EMOTIONBANK_TAG_THRESHOLD", "0.2"))
+
+_CATEGORY_INDEX = {emotion: i for i, emotion in enumerate(EMOTION_CATEGORIES)}
+
+def score_vector(scores: Dict) -> np.ndarray:
+    """Dense vector for a {emotion: score} dict; emotions outside the categories are dropped"""
+    vector = np.zeros(len(EMOTION_CATEGORIES), dtype=np.float32)
+    for emotion, score in (scores or {}).items():
+        index = _CATEGORY_INDEX.get(emotion)
+        if index is not None:
+            vector[index] = score
+    return vector
+
+def score_matrix(score_dicts: Iterable[Dict]) -> np.ndarray:
+    vectors = [score_vector(scores) for scores in score_dicts]
+    if not vectors:
+        return np.zeros((0, len(EMOTION_CATEGORIES)), dtype=np.float32)
+    return np.stack(vectors)
+
+def tag_mask(tag_lists: Iterable[List[str]]) -> np.ndarray:
+    """Boolean (memories x categories) matrix of which categories appear in each tag list"""
+    rows = []
+    for tags in tag_lists:
+        row = np.zeros(len(EMOTION_CATEGORIES), dtype=bool)
+        for tag in tags or []:
+            index = _CATEGORY_INDEX.get(tag)
+            if index is not None:
+                row[index] = True
+        rows.append(row)
+    if not rows:
+        return np.zeros((0, len(EMOTION_CATEGORIES)), dtype=bool)
+    return np.stack(rows)
+
+def fuse_scores(text_scores: np.ndarray, image_scores: np.ndarray,
+                text_weight: float = SCORE_TEXT_WEIGHT, image_weight: float = SCORE_IMAGE_WEIGHT,
+                threshold: float = TAG_THRESHOLD) -> Tuple[np.ndarray, np.ndarray]:
+    """Combined scores and the boolean mask of suggested tags, for (memories x categories) inputs"""
+    combined = text_scores * np.float32(text_weight) + image_scores * np.float32(image_weight)
+    return combined, combined > threshold
+
+def scores_dict(row: np.ndarray) -> Dict[str, float]:
+    return {emotion: float(score) for emotion, score in zip(EMOTION_CATEGORIES, row)}
+
+def tags_list(mask_row: np.ndarray) -> List[str]:
+    return [emotion for emotion, selected in zip(EMOTION_CATEGORIES, mask_row) if selected]
@@ -0,0 +1,251 @@
+"""Persisted upload jobs and the background workers that process them.
+
+POST /upload_memory/ only records the raw memory as an `upload_jobs` row
+and returns its id. Workers take queued jobs in arrival order, run the
+analysis and storage stages through MemoryHandler.upload_memory, and
+write the result or error back to the row. Status changes are published
+to subscribers (the SSE endpoint) as they happen.
+
+Jobs survive restarts: on start, rows left `running` by a crash are put
+back in the queue. Each memory is stored with the source key
+`job:<id>`, so a job whose memory was committed just before the crash is
+marked done instead of being analyzed and stored a second time.
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from database import Memory, UploadJob, IngestRecord, SerializedWriter, SessionLocal, session_scope
+from executor import ExecutorSaturated
+
+JOB_WORKERS = int(os.environ.get("EMOTIONBANK_JOB_WORKERS", "4"))
+JOB_RETRY_DELAY_S = float(os.environ.get("EMOTIONBANK_JOB_RETRY_DELAY_S", "0.5"))
+TERMINAL_STATUSES = ("done", "failed")
+
+def job_source_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+def describe_job(job: UploadJob) -> Dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "memory_id": job.memory_id,
+        "result": job.result,
+        "error": job.error,
+        "created_at": _isoformat(job.created_at),
+        "started_at": _isoformat(job.started_at),
+        "finished_at": _isoformat(job.finished_at)
+    }
+
+class UploadJobQueue:
+    """Queue of upload jobs backed by the `upload_jobs` table"""
+
+    def __init__(self, memory_handler, session_factory=SessionLocal,
+                 writer: SerializedWriter = None, workers: int = JOB_WORKERS):
+        self.memory_handler = memory_handler
+        self.session_factory = session_factory
+        self.writer = writer
+        self.workers = workers
+        self._queue = None
+        self._tasks = []
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    # Database access; these run on the I/O pool
+
+    def _write(self, fn, *args):
+        if self.writer is not None:
+            return self.writer.submit(fn, *args).result()
+        with session_scope(self.session_factory) as db:
+            return fn(db, *args)
+
+    def _read(self, job_id: str) -> Optional[Dict]:
+        with session_scope(self.session_factory) as db:
+            job = db.get(UploadJob, job_id)
+            return describe_job(job) if job else None
+
+    @staticmethod
+    def _insert(db, job: UploadJob) -> Dict:
+        db.add(job)
+        db.flush()
+        return describe_job(job)
+
+    @staticmethod
+    def _recover(db) -> List[str]:
+        """Requeue jobs interrupted by a restart; returns queued ids oldest first"""
+        requeued = db.query(UploadJob).filter(UploadJob.status == "running").update(
+            {"status": "queued"}, synchronize_session=False
+        )
+        if requeued:
+            logging.info(f"Requeued {requeued} interrupted upload jobs")
+        rows = db.query(UploadJob.id).filter(
+            UploadJob.status == "queued"
+        ).order_by(UploadJob.created_at).all()
+        return [row.id for row in rows]
+
+    @staticmethod
+    def _claim(db, job_id: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """Mark a queued job running; returns (its fields, None), or (None, None) if it is not queued.
+
+        A job whose memory was already committed (crash before the job row was
+        updated) is completed from its ingest record instead, and (None, its
+        final description) is returned.
+        """
+        job = db.get(UploadJob, job_id)
+        if job is None or job.status != "queued":
+            return None, None
+        record = db.query(IngestRecord).filter(
+            IngestRecord.source_key == job_source_key(job_id)
+        ).first()
+        if record is not None:
+            job.status = "done"
+            job.memory_id = record.memory_id
+            job.finished_at = datetime.utcnow()
+            return None, describe_job(job)
+        job.status = "running"
+        job.attempts += 1
+        job.started_at = datetime.utcnow()
+        return {
+            "image_path": job.image_path,
+            "caption": job.caption,
+            "content": job.content,
+            "emotional_tags": job.emotional_tags,
+            "timestamp": job.timestamp
+        }, None
+
+    @staticmethod
+    def _finish(db, job_id: str, result: Dict = None, error: str = None) -> Dict:
+        job = db.get(UploadJob, job_id)
+        job.status = "failed" if error else "done"
+        job.finished_at = datetime.utcnow()
+        job.error = error
+        if result is not None:
+            job.result = result
+            job.memory_id = result["id"]
+        return describe_job(job)
+
+    # Lifecycle
+
+    async def start(self):
+        """Load unfinished jobs and start the workers; call from the running event loop"""
+        self._queue = asyncio.Queue()
+        for job_id in await self.memory_handler.run_io(self._write, self._recover):
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info(f"Upload job workers started with {self._queue.qsize()} queued jobs")
+
+    async def stop(self):
+        """Cancel the workers; jobs they were running are requeued on the next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # Public API
+
+    async def enqueue(self, image_path: str, caption: str, content: str,
+                      emotional_tags: List[str], timestamp: datetime) -> Dict:
+        """Persist a new job and queue it; returns its description"""
+        job = UploadJob(
+            id=uuid.uuid4().hex,
+            status="queued",
+            image_path=image_path,
+            caption=caption,
+            content=content,
+            emotional_tags=emotional_tags,
+            timestamp=timestamp,
+            attempts=0,
+            created_at=datetime.utcnow()
+        )
+        description = await self.memory_handler.run_io(self._write, self._insert, job)
+        self._queue.put_nowait(description["id"])
+        return description
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        return await self.memory_handler.run_io(self._read, job_id)
+
+    async def events(self, job_id: str) -> AsyncIterator[Dict]:
+        """Yield the job's current state, then each change until it finishes"""
+        updates = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(updates)
+        try:
+            # Subscribe before reading so a change in between is not missed
+            current = await self.get(job_id)
+            if current is None:
+                return
+            yield current
+            while current["status"] not in TERMINAL_STATUSES:
+                current = await updates.get()
+                yield current
+        finally:
+            subscribers = self._subscribers.get(job_id, [])
+            subscribers.remove(updates)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    async def wait(self, job_id: str) -> Optional[Dict]:
+        """The job's final state, or None for an unknown id"""
+        state = None
+        async for state in self.events(job_id):
+            pass
+        return state
+
+    def stats(self) -> Dict:
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values())
+        }
+
+    # Workers
+
+    def _publish(self, description: Dict):
+        for updates in self._subscribers.get(description["id"], []):
+            updates.put_nowait(description)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Upload job {job_id} could not be processed: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _retrying(self, call, *args):
+        """Await call(*args), retrying shortly while the executor is saturated"""
+        while True:
+            try:
+                return await call(*args)
+            except ExecutorSaturated:
+                # Backpressure: the job keeps its status and is retried shortly
+                await asyncio.sleep(JOB_RETRY_DELAY_S)
+
+    async def _process(self, job_id: str):
+        run_io = self.memory_handler.run_io
+        fields, completed = await self._retrying(run_io, self._write, self._claim, job_id)
+        if completed is not None:
+            self._publish(completed)
+        if fields is None:
+            return
+        self._publish(await self._retrying(self.get, job_id))
+
+        try:
+            result = await self._retrying(
+                self.memory_handler.upload_memory, Memory(**fields), job_source_key(job_id)
+            )
+        except Exception as e:
+            logging.error(f"Upload job {job_id} failed: {str(e)}")
+            self._publish(await self._retrying(run_io, self._write, self._finish, job_id, None, str(e)))
+            return
+
+        result["timestamp"] = _isoformat(result["timestamp"])
+        self._publish(await self._retrying(run_io, self._write, self._finish, job_id, result))
@@ -0,0 +1,135 @@
+"""Compressed vector codes for the numpy vector backend.
+
+A PQCodec optionally projects vectors onto their top principal axes
+(PCA), then splits them into `subspaces` chunks and replaces each chunk
+with the index of its nearest of 256 centroids, so a vector is stored in
+`subspaces` bytes: 64 bytes instead of 2048 for a 512-d float32 vector.
+
+Search scores codes asymmetrically: the query stays exact and is
+compared with every centroid once per subspace (a 256-entry lookup table
+per subspace), and a code's approximate inner product is the sum of its
+table entries. The best RERANK_FACTOR * k codes are then re-scored
+against the full vectors, which stay on disk in the memory-mapped matrix
+and are only paged in for that shortlist.
+
+Codecs are saved as codec.<version>.npz next to the collection they were
+trained on; the version is a hash of the trained arrays.
+"""
+import os
+import hashlib
+import numpy as np
+
+PQ_CENTROIDS = 256
+PQ_SUBSPACES = int(os.environ.get("EMOTIONBANK_PQ_SUBSPACES", "64"))
+PQ_TRAIN_SAMPLE = 65536
+PQ_TRAIN_ITERATIONS = 20
+RERANK_FACTOR = int(os.environ.get("EMOTIONBANK_PQ_RERANK_FACTOR", "8"))
+SCORE_BLOCK_ROWS = 65536
+
+def _kmeans(points: np.ndarray, k: int, iterations: int, rng) -> np.ndarray:
+    """Lloyd's k-means with squared L2; empty clusters are reseeded at random points"""
+    centroids = points[rng.choice(len(points), k, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (centroids * centroids).sum(axis=1)[None, :] - 2 * points @ centroids.T
+        assignment = np.argmin(distances, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, points)
+        counts = np.bincount(assignment, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        if not filled.all():
+            centroids[~filled] = points[rng.choice(len(points), int((~filled).sum()))]
+    return centroids
+
+class PQCodec:
+    def __init__(self, mean: np.ndarray, components, codebooks: np.ndarray):
+        self.mean = mean.astype(np.float32)                   # (dim,)
+        self.components = components                          # (reduced_dim, dim) or None
+        self.codebooks = codebooks.astype(np.float32)         # (subspaces, 256, sub_dim)
+        digest = hashlib.sha256()
+        for array in (self.mean, self.components, self.codebooks):
+            if array is not None:
+                digest.update(np.ascontiguousarray(array).tobytes())
+        self.version = digest.hexdigest()[:16]
+
+    @property
+    def subspaces(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def code_size(self) -> int:
+        """Bytes per encoded vector"""
+        return self.subspaces
+
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, subspaces, sub_dim) reduced, zero-padded chunks of centered vectors"""
+        reduced = vectors - self.mean
+        if self.components is not None:
+            reduced = reduced @ self.components.T
+        subspaces, _, sub_dim = self.codebooks.shape
+        padding = subspaces * sub_dim - reduced.shape[1]
+        if padding:
+            reduced = np.pad(reduced, ((0, 0), (0, padding)))
+        return reduced.reshape(len(reduced), subspaces, sub_dim)
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, subspaces: int = PQ_SUBSPACES, reduced_dim: int = None,
+              iterations: int = PQ_TRAIN_ITERATIONS, seed: int = 0) -> "PQCodec":
+        """Fit PCA (when `reduced_dim` is below the vector width) and per-subspace codebooks"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) < PQ_CENTROIDS:
+            raise ValueError(f"Need at least {PQ_CENTROIDS} vectors to train a codec, got {len(vectors)}")
+        rng = np.random.default_rng(seed)
+        mean = vectors.mean(axis=0)
+        components = None
+        width = vectors.shape[1]
+        if reduced_dim and reduced_dim < width:
+            # Principal axes from the SVD of the centered sample
+            _, _, axes = np.linalg.svd(vectors - mean, full_matrices=False)
+            components = axes[:reduced_dim].astype(np.float32)
+            width = reduced_dim
+        sub_dim = -(-width // subspaces)
+        codec = cls(mean, components, np.zeros((subspaces, PQ_CENTROIDS, sub_dim), dtype=np.float32))
+        parts = codec._project(vectors)
+        codebooks = np.stack([
+            _kmeans(parts[:, subspace], PQ_CENTROIDS, iterations, rng) for subspace in range(subspaces)
+        ])
+        return cls(mean, components, codebooks)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, subspaces) uint8 codes"""
+        parts = self._project(np.asarray(vectors, dtype=np.float32))
+        codes = np.empty((len(parts), self.subspaces), dtype=np.uint8)
+        for subspace, codebook in enumerate(self.codebooks):
+            distances = (codebook * codebook).sum(axis=1)[None, :] - 2 * parts[:, subspace] @ codebook.T
+            codes[:, subspace] = np.argmin(distances, axis=1)
+        return codes
+
+    def tables(self, query: np.ndarray):
+        """Per-subspace inner products of the query with every centroid, and the constant query . mean"""
+        projected = self._project(query[None, :] + self.mean)[0]
+        return np.einsum("skd,sd->sk", self.codebooks, projected), float(query @ self.mean)
+
+    def scores(self, tables, codes: np.ndarray) -> np.ndarray:
+        """Approximate inner products of the table's query with each code"""
+        table, offset = tables
+        subspaces = np.arange(self.subspaces)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = np.asarray(codes[start:start + SCORE_BLOCK_ROWS])
+            scores[start:start + len(block)] = table[subspaces, block].sum(axis=1) + offset
+        return scores
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path, mean=self.mean, codebooks=self.codebooks,
+            components=self.components if self.components is not None else np.zeros((0, 0), dtype=np.float32)
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PQCodec":
+        with np.load(path) as arrays:
+            components = arrays["components"]
+            return cls(arrays["mean"], components if components.size else None, arrays["codebooks"])
@@ -0,0 +1,718 @@
+"""Vector store backends.
+
+MemoryHandler, the reconciler and the neighbour graph use only a small
+part of the Chroma API: `upsert`, `update`, `get`, `query`, `delete` and
+`count` on a collection, and `get_or_create_collection`,
+`list_collections` and `delete_collection` on the client.
+EMOTIONBANK_VECTOR_BACKEND picks what answers those calls:
+
+- "chroma" (default): chromadb.PersistentClient under ./vector_db
+- "numpy": the embedded index below, under EMOTIONBANK_VECTOR_INDEX_DIR
+
+Both backends return cosine distances (1 - cosine similarity), so
+neighbour scores (1 / (1 + d)) and fusion weights mean the same on
+either. Chroma collections are created with COLLECTION_METADATA
+(`hnsw:space` cosine); collections created before that still use
+squared L2 and log a warning until `python reconcile.py --rebuild`
+recreates them, after which `python neighbors.py --rebuild` refreshes
+the stored neighbour scores.
+
+The NumPy backend keeps each collection as one memory-mapped matrix of
+L2-normalized vectors (float32, or float16 to halve the footprint) and an
+append-only row log of ids and metadata. Search is exact: a matmul per
+block of rows and argpartition for the top k, with `where` filters
+evaluated as boolean masks over metadata columns. New ids are appended; deletes only
+mark rows dead, and a collection is compacted into a new generation of
+files once dead rows pass VECTOR_COMPACT_RATIO. With
+EMOTIONBANK_VECTOR_IVF_LISTS set, a spherical k-means coarse quantizer
+limits each query to the rows of its EMOTIONBANK_VECTOR_IVF_PROBES
+nearest lists. A trained PQCodec (see vector_compression) keeps search
+on compressed codes in memory and re-ranks a shortlist exactly.
+
+    python vector_store.py --compact                          # compact the numpy collections now
+    python vector_store.py --train-ivf                        # (re)train their coarse quantizers
+    python vector_store.py --train-pq --pca-dim 256 --subspaces 64
+    python vector_store.py --recall-report                    # recall@k of compressed vs exact search
+"""
+import os
+import json
+import shutil
+import logging
+import operator
+import argparse
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from vector_compression import PQCodec, PQ_SUBSPACES, PQ_TRAIN_SAMPLE, RERANK_FACTOR
+
+VECTOR_BACKEND = os.environ.get("EMOTIONBANK_VECTOR_BACKEND", "chroma")
+CHROMA_DIR = "./vector_db"
+VECTOR_INDEX_DIR = os.environ.get("EMOTIONBANK_VECTOR_INDEX_DIR", "./vector_index")
+VECTOR_DTYPE = os.environ.get("EMOTIONBANK_VECTOR_DTYPE", "float32")
+# Distance for Chroma collections, matching the numpy backend's cosine distances
+COLLECTION_METADATA = {"hnsw:space": "cosine"}
+VECTOR_COMPACT_RATIO = float(os.environ.get("EMOTIONBANK_VECTOR_COMPACT_RATIO", "0.2"))
+IVF_LISTS = int(os.environ.get("EMOTIONBANK_VECTOR_IVF_LISTS", "0"))  # 0 keeps search exact
+IVF_PROBES = int(os.environ.get("EMOTIONBANK_VECTOR_IVF_PROBES", "8"))
+# Too few rows per list gives poor centroids; train once there are this many per list
+IVF_MIN_ROWS_PER_LIST = 39
+IVF_TRAIN_ITERATIONS = 10
+INITIAL_CAPACITY = 1024
+SEARCH_BLOCK_ROWS = 65536
+
+_COMPARISONS = {
+    "$eq": operator.eq, "$ne": operator.ne,
+    "$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le
+}
+
+def open_vector_store(backend: str = VECTOR_BACKEND):
+    """Client for the configured backend"""
+    if backend == "numpy":
+        return NumpyVectorStore(VECTOR_INDEX_DIR)
+    if backend == "chroma":
+        import chromadb
+        return chromadb.PersistentClient(path=CHROMA_DIR)
+    raise ValueError(f"Unknown vector backend {backend!r}; expected chroma or numpy")
+
+def open_collection(client, name: str):
+    """Get or create a collection with cosine distance, warning about older L2 collections"""
+    collection = client.get_or_create_collection(name=name, metadata=COLLECTION_METADATA)
+    space = (getattr(collection, "metadata", None) or COLLECTION_METADATA).get("hnsw:space", "l2")
+    if space != COLLECTION_METADATA["hnsw:space"]:
+        logging.warning(
+            f"Collection {name} uses {space} distance; rebuild it (python reconcile.py --rebuild) for cosine"
+        )
+    return collection
+
+def _normalize(embeddings) -> np.ndarray:
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def _metadata_column(metadatas: List[Dict], key: str) -> np.ndarray:
+    """One metadata key across rows: float64 (NaN where absent) when numeric, else objects"""
+    values = [metadata.get(key) if metadata else None for metadata in metadatas]
+    present = [value for value in values if value is not None]
+    if present and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+def _where_mask(where: Dict, column) -> np.ndarray:
+    """Boolean row mask for a Chroma-style `where` clause; `column(key)` returns a metadata column"""
+    if "$and" in where:
+        return np.logical_and.reduce([_where_mask(clause, column) for clause in where["$and"]])
+    if "$or" in where:
+        return np.logical_or.reduce([_where_mask(clause, column) for clause in where["$or"]])
+    masks = []
+    for key, condition in where.items():
+        values = column(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, operand in condition.items():
+            if op in ("$in", "$nin"):
+                if values.dtype == object:
+                    options = set(operand)
+                    mask = np.fromiter((value in options for value in values), dtype=bool, count=len(values))
+                else:
+                    mask = np.isin(values, np.asarray(operand, dtype=np.float64))
+                masks.append(mask if op == "$in" else ~mask)
+            elif op in _COMPARISONS:
+                if values.dtype == object and op not in ("$eq", "$ne"):
+                    masks.append(np.zeros(len(values), dtype=bool))
+                else:
+                    masks.append(np.asarray(_COMPARISONS[op](values, operand), dtype=bool))
+            else:
+                raise ValueError(f"Unsupported where operator {op}")
+    return np.logical_and.reduce(masks)
+
+class NumpyCollection:
+    """One collection: vectors.<generation>.bin, rows.<generation>.jsonl and index.json,
+    plus codec.<version>.npz and codes.<generation>.<version>.bin once compressed"""
+
+    def __init__(self, directory: str, dtype: str = VECTOR_DTYPE,
+                 ivf_lists: int = IVF_LISTS, ivf_probes: int = IVF_PROBES):
+        self.directory = directory
+        self.name = os.path.basename(directory)
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        # Writers hold the lock throughout; readers only while taking a snapshot
+        self._lock = threading.RLock()
+        self._dtype = np.dtype(dtype)
+        self._dim = None
+        self._generation = 0
+        self._vectors = None
+        self._ids = []          # row -> id, None once deleted
+        self._rows = {}         # id -> row
+        self._metadatas = []    # row -> metadata
+        self._live = np.zeros(0, dtype=bool)
+        self._columns = {}      # metadata key -> column, dropped on every write
+        self._centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._codec = None
+        self._codes = None      # (capacity, codec.code_size) uint8 memmap
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # Files
+
+    def _file(self, kind: str, generation: int = None) -> str:
+        generation = self._generation if generation is None else generation
+        extension = "bin" if kind == "vectors" else "jsonl"
+        return os.path.join(self.directory, f"{kind}.{generation}.{extension}")
+
+    def _codes_file(self, generation: int = None, codec: PQCodec = None) -> str:
+        generation = self._generation if generation is None else generation
+        codec = codec or self._codec
+        return os.path.join(self.directory, f"codes.{generation}.{codec.version}.bin")
+
+    def _codec_file(self, codec: PQCodec) -> str:
+        return os.path.join(self.directory, f"codec.{codec.version}.npz")
+
+    def _header_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def _write_header(self):
+        tmp_path = self._header_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "dim": self._dim, "dtype": self._dtype.name, "generation": self._generation,
+                "codec": self._codec.version if self._codec is not None else None
+            }, f)
+        os.replace(tmp_path, self._header_path())
+
+    def _open_vectors(self, capacity: int = None):
+        path = self._file("vectors")
+        if capacity is not None:
+            with open(path, "ab") as f:
+                f.truncate(capacity * self._dim * self._dtype.itemsize)
+        capacity = os.path.getsize(path) // (self._dim * self._dtype.itemsize)
+        self._vectors = np.memmap(path, dtype=self._dtype, mode="r+", shape=(capacity, self._dim))
+        if self._codec is not None:
+            self._codes = self._open_codes(self._codes_file(), self._codec, capacity)
+        if len(self._live) < capacity:
+            self._live = np.concatenate([self._live, np.zeros(capacity - len(self._live), dtype=bool)])
+            self._assignments = np.concatenate(
+                [self._assignments, np.zeros(capacity - len(self._assignments), dtype=np.int32)]
+            )
+
+    @staticmethod
+    def _open_codes(path: str, codec: PQCodec, capacity: int) -> np.memmap:
+        with open(path, "ab") as f:
+            f.truncate(capacity * codec.code_size)
+        return np.memmap(path, dtype=np.uint8, mode="r+", shape=(capacity, codec.code_size))
+
+    def _load(self):
+        if not os.path.exists(self._header_path()):
+            return
+        with open(self._header_path()) as f:
+            header = json.load(f)
+        self._dim, self._dtype, self._generation = header["dim"], np.dtype(header["dtype"]), header["generation"]
+        if header.get("codec"):
+            self._codec = PQCodec.load(os.path.join(self.directory, f"codec.{header['codec']}.npz"))
+        self._open_vectors()
+
+        log_path = self._file("rows")
+        valid_bytes = 0
+        if os.path.exists(log_path):
+            with open(log_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-append
+                        break
+                    self._apply(record)
+                    valid_bytes += len(line)
+            if valid_bytes < os.path.getsize(log_path):
+                with open(log_path, "r+b") as f:
+                    f.truncate(valid_bytes)
+
+        centroids_path = os.path.join(self.directory, "centroids.npy")
+        if os.path.exists(centroids_path):
+            self._centroids = np.load(centroids_path)
+            self._assignments[:len(self._ids)] = self._assign(self._centroids, self._vectors, 0, len(self._ids))
+        logging.info(f"Opened vector collection {self.name} with {self.count()} vectors")
+        if self.ivf_lists and self._centroids is None and self.count() >= self.ivf_lists * IVF_MIN_ROWS_PER_LIST:
+            self.train_ivf()
+
+    def _apply(self, record: Dict):
+        memory_id = record["id"]
+        if record["op"] == "put":
+            row = record["row"]
+            if row == len(self._ids):
+                self._ids.append(memory_id)
+                self._metadatas.append(record.get("metadata"))
+            else:
+                self._ids[row] = memory_id
+                self._metadatas[row] = record.get("metadata")
+            self._rows[memory_id] = row
+            self._live[row] = True
+        elif record["op"] == "meta":
+            row = self._rows.get(memory_id)
+            if row is not None:
+                # Chroma merges updated keys into the existing metadata
+                self._metadatas[row] = {**(self._metadatas[row] or {}), **(record.get("metadata") or {})}
+        elif record["op"] == "del":
+            row = self._rows.pop(memory_id, None)
+            if row is not None:
+                self._ids[row] = None
+                self._metadatas[row] = None
+                self._live[row] = False
+
+    def _append_log(self, records: List[Dict]):
+        with open(self._file("rows"), "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+        for record in records:
+            self._apply(record)
+        self._columns = {}
+
+    # Writes
+
+    def upsert(self, ids: List[str], embeddings, metadatas: List[Dict] = None, **kwargs):
+        vectors = _normalize(embeddings)
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                self._write_header()
+                self._open_vectors(INITIAL_CAPACITY)
+            if vectors.shape[1] != self._dim:
+                raise ValueError(f"Collection {self.name} holds {self._dim}-d vectors, got {vectors.shape[1]}-d")
+
+            rows, pending = [], {}
+            next_row = len(self._ids)
+            for memory_id in ids:
+                row = self._rows.get(memory_id, pending.get(memory_id))
+                if row is None:
+                    row = pending[memory_id] = next_row
+                    next_row += 1
+                rows.append(row)
+            if next_row > self._vectors.shape[0]:
+                self._vectors.flush()
+                self._open_vectors(max(next_row, 2 * self._vectors.shape[0]))
+
+            # Vectors land before the log records that make them visible
+            self._vectors[rows] = vectors.astype(self._dtype)
+            self._vectors.flush()
+            if self._centroids is not None:
+                self._assignments[rows] = np.argmax(vectors @ self._centroids.T, axis=1)
+            if self._codec is not None:
+                self._codes[rows] = self._codec.encode(vectors)
+                self._codes.flush()
+            self._append_log([
+                {"op": "put", "id": memory_id, "row": row, "metadata": metadata}
+                for memory_id, row, metadata in zip(ids, rows, metadatas)
+            ])
+
+    add = upsert
+
+    def update(self, ids: List[str], embeddings=None, metadatas: List[Dict] = None, **kwargs):
+        with self._lock:
+            present = [i for i, memory_id in enumerate(ids) if memory_id in self._rows]
+            if embeddings is not None:
+                self.upsert(
+                    [ids[i] for i in present], [embeddings[i] for i in present],
+                    [metadatas[i] if metadatas else self._metadatas[self._rows[ids[i]]] for i in present]
+                )
+            elif metadatas is not None:
+                self._append_log([{"op": "meta", "id": ids[i], "metadata": metadatas[i]} for i in present])
+
+    def delete(self, ids: List[str] = None, where: Dict = None, **kwargs):
+        with self._lock:
+            if where is not None:
+                ids = list(ids or []) + self.get(where=where, include=[])["ids"]
+            self._append_log([{"op": "del", "id": memory_id} for memory_id in ids or [] if memory_id in self._rows])
+            dead = len(self._ids) - len(self._rows)
+            if dead > INITIAL_CAPACITY and dead > VECTOR_COMPACT_RATIO * len(self._ids):
+                self.compact()
+
+    def compact(self):
+        """Rewrite live rows into a new generation of files, dropping dead rows"""
+        with self._lock:
+            if self._dim is None:
+                return
+            live_rows = np.flatnonzero(self._live[:len(self._ids)])
+            old_generation, generation = self._generation, self._generation + 1
+            capacity = max(INITIAL_CAPACITY, len(live_rows))
+            vectors = np.memmap(
+                self._file("vectors", generation), dtype=self._dtype, mode="w+", shape=(capacity, self._dim)
+            )
+            for start in range(0, len(live_rows), SEARCH_BLOCK_ROWS):
+                block = live_rows[start:start + SEARCH_BLOCK_ROWS]
+                vectors[start:start + len(block)] = self._vectors[block]
+            vectors.flush()
+            del vectors
+            if self._codec is not None:
+                codes = self._open_codes(self._codes_file(generation), self._codec, capacity)
+                codes[:len(live_rows)] = self._codes[live_rows]
+                codes.flush()
+                del codes
+            with open(self._file("rows", generation), "w") as f:
+                for new_row, row in enumerate(live_rows):
+                    f.write(json.dumps({
+                        "op": "put", "id": self._ids[row], "row": new_row, "metadata": self._metadatas[row]
+                    }) + "\n")
+
+            # The header names the generation, so switching to it is one atomic rename
+            self._generation = generation
+            self._write_header()
+            assignments = self._assignments[live_rows]
+            self._ids, self._rows, self._metadatas, self._columns = [], {}, [], {}
+            self._live = np.zeros(0, dtype=bool)
+            self._assignments = np.zeros(0, dtype=np.int32)
+            self._open_vectors()
+            with open(self._file("rows")) as f:
+                for line in f:
+                    self._apply(json.loads(line))
+            self._assignments[:len(assignments)] = assignments
+            for kind in ("vectors", "rows"):
+                os.remove(self._file(kind, old_generation))
+            if self._codec is not None:
+                os.remove(self._codes_file(old_generation))
+            logging.info(f"Compacted vector collection {self.name} to {len(live_rows)} rows")
+
+    # Coarse quantizer
+
+    @staticmethod
+    def _assign(centroids: np.ndarray, vectors, start: int, stop: int) -> np.ndarray:
+        """Nearest centroid of rows start..stop"""
+        assignments = np.zeros(stop - start, dtype=np.int32)
+        for offset in range(start, stop, SEARCH_BLOCK_ROWS):
+            block = np.asarray(vectors[offset:min(offset + SEARCH_BLOCK_ROWS, stop)], dtype=np.float32)
+            assignments[offset - start:offset - start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    def train_ivf(self, lists: int = None, seed: int = 0):
+        """Spherical k-means over a sample of the live vectors; search stays exact until trained"""
+        lists = lists or self.ivf_lists
+        with self._lock:
+            count = len(self._ids)
+            live_rows = np.flatnonzero(self._live[:count])
+            vectors, generation = self._vectors, self._generation
+        if lists <= 0 or len(live_rows) < lists:
+            return
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(live_rows, min(len(live_rows), lists * 256), replace=False))
+        points = np.asarray(vectors[sample], dtype=np.float32)
+        centroids = points[rng.choice(len(points), lists, replace=False)]
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            assignment = np.argmax(points @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, points)
+            filled = np.bincount(assignment, minlength=lists) > 0
+            centroids[filled] = _normalize(sums[filled])
+        # Assign the snapshot outside the lock, then only the rows written since
+        assignments = self._assign(centroids, vectors, 0, count)
+        with self._lock:
+            if self._generation != generation:
+                # Compacted meanwhile, so the snapshot's row numbers are stale
+                assignments, count = self._assign(centroids, self._vectors, 0, len(self._ids)), len(self._ids)
+            np.save(os.path.join(self.directory, "centroids.npy"), centroids)
+            self._assignments[:count] = assignments
+            self._assignments[count:len(self._ids)] = self._assign(centroids, self._vectors, count, len(self._ids))
+            self._centroids = centroids
+        logging.info(f"Trained a {lists}-list coarse quantizer for vector collection {self.name}")
+
+    # Compression
+
+    @staticmethod
+    def _encode_rows(codec: PQCodec, vectors, codes: np.memmap, start: int, stop: int):
+        for offset in range(start, stop, SEARCH_BLOCK_ROWS):
+            end = min(offset + SEARCH_BLOCK_ROWS, stop)
+            codes[offset:end] = codec.encode(np.asarray(vectors[offset:end], dtype=np.float32))
+        codes.flush()
+
+    def _remove_codec_files(self, codec: PQCodec):
+        for name in os.listdir(self.directory):
+            if name == f"codec.{codec.version}.npz" or (name.startswith("codes.") and f".{codec.version}." in name):
+                os.remove(os.path.join(self.directory, name))
+
+    def train_compression(self, subspaces: int = PQ_SUBSPACES, reduced_dim: int = None,
+                          sample: int = PQ_TRAIN_SAMPLE, seed: int = 0) -> Dict:
+        """Train a codec on a sample of the live vectors, encode every row, and search on codes from now on"""
+        with self._lock:
+            if self._vectors is None:
+                raise ValueError(f"Collection {self.name} is empty")
+            count = len(self._ids)
+            live_rows = np.flatnonzero(self._live[:count])
+            vectors, generation = self._vectors, self._generation
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(live_rows, min(len(live_rows), sample), replace=False))
+        codec = PQCodec.train(np.asarray(vectors[rows], dtype=np.float32), subspaces, reduced_dim, seed=seed)
+
+        # Encode the snapshot outside the lock, then only the rows written since
+        codes_path = self._codes_file(generation, codec)
+        codes = self._open_codes(codes_path, codec, vectors.shape[0])
+        self._encode_rows(codec, vectors, codes, 0, count)
+        with self._lock:
+            if self._generation != generation:
+                # Compacted meanwhile, so the snapshot's row numbers are stale
+                del codes
+                os.remove(codes_path)
+                codes, count = self._open_codes(self._codes_file(codec=codec), codec, self._vectors.shape[0]), 0
+            elif codes.shape[0] != self._vectors.shape[0]:
+                codes = self._open_codes(codes_path, codec, self._vectors.shape[0])
+            self._encode_rows(codec, self._vectors, codes, count, len(self._ids))
+            codec.save(self._codec_file(codec))
+            previous = self._codec
+            self._codec, self._codes = codec, codes
+            self._write_header()
+            if previous is not None and previous.version != codec.version:
+                self._remove_codec_files(previous)
+        logging.info(f"Trained codec {codec.version} for vector collection {self.name}")
+        return {
+            "collection": self.name,
+            "codec": codec.version,
+            "subspaces": codec.subspaces,
+            "reduced_dim": None if codec.components is None else codec.components.shape[0],
+            "trained_on": len(rows)
+        }
+
+    def drop_compression(self):
+        """Go back to searching the full vectors"""
+        with self._lock:
+            previous, self._codec, self._codes = self._codec, None, None
+            self._write_header()
+            if previous is not None:
+                self._remove_codec_files(previous)
+
+    def recall_report(self, k: int = 10, queries: int = 200, seed: int = 0) -> Dict:
+        """Recall@k of the compressed search against exact search, using stored vectors as queries"""
+        snapshot = self._snapshot()
+        codec = snapshot["codec"]
+        if codec is None:
+            raise ValueError(f"Collection {self.name} has no trained codec")
+        live_rows = np.flatnonzero(snapshot["live"])
+        sample = np.sort(np.random.default_rng(seed).choice(live_rows, min(queries, len(live_rows)), replace=False))
+        query_vectors = np.asarray(snapshot["vectors"][sample], dtype=np.float32)
+        exact = self._search(snapshot, query_vectors, k, None, exact=True)
+        report = {
+            "collection": self.name,
+            "vectors": len(live_rows),
+            "queries": len(sample),
+            "k": k,
+            "codec": codec.version,
+            "subspaces": codec.subspaces,
+            "reduced_dim": None if codec.components is None else codec.components.shape[0],
+            "full_bytes_per_vector": self._dim * 4,
+            "code_bytes_per_vector": codec.code_size,
+            "compression_ratio": self._dim * 4 / codec.code_size,
+            "rerank_factor": RERANK_FACTOR
+        }
+        # Codes alone (shortlist of k) and with the exact re-ranking of a RERANK_FACTOR * k shortlist
+        for name, factor in (("codes_only", 1), ("reranked", RERANK_FACTOR)):
+            found = self._search(snapshot, query_vectors, k, None, rerank_factor=factor)
+            report[f"recall_at_{k}_{name}"] = float(np.mean([
+                len(set(approx_rows) & set(exact_rows)) / max(1, len(exact_rows))
+                for (approx_rows, _), (exact_rows, _) in zip(found, exact)
+            ]))
+        return report
+
+    # Reads
+
+    def count(self) -> int:
+        return len(self._rows)
+
+    def _snapshot(self):
+        with self._lock:
+            count = len(self._ids)
+            return {
+                "count": count,
+                "vectors": self._vectors,
+                "ids": self._ids[:count],
+                "metadatas": self._metadatas[:count],
+                "live": self._live[:count].copy(),
+                "columns": self._columns,
+                "centroids": self._centroids,
+                "assignments": self._assignments[:count].copy(),
+                "codec": self._codec,
+                "codes": self._codes
+            }
+
+    @staticmethod
+    def _mask(snapshot: Dict, where: Optional[Dict]) -> np.ndarray:
+        if not where:
+            return snapshot["live"]
+        columns, metadatas = snapshot["columns"], snapshot["metadatas"]
+
+        def column(key):
+            if key not in columns:
+                columns[key] = _metadata_column(metadatas, key)
+            return columns[key]
+
+        return snapshot["live"] & _where_mask(where, column)
+
+    def get(self, ids: List[str] = None, where: Dict = None, limit: int = None, offset: int = None,
+            include: List[str] = ("metadatas",), **kwargs) -> Dict:
+        with self._lock:
+            snapshot = self._snapshot()
+            if ids is not None:
+                rows = [self._rows.get(memory_id) for memory_id in ids]
+                rows = np.array([row for row in rows if row is not None], dtype=np.int64)
+        if ids is not None:
+            if where:
+                rows = rows[self._mask(snapshot, where)[rows]]
+        else:
+            rows = np.flatnonzero(self._mask(snapshot, where))
+        rows = rows[offset or 0:]
+        if limit is not None:
+            rows = rows[:limit]
+        return {
+            "ids": [snapshot["ids"][row] for row in rows],
+            "embeddings": (
+                np.asarray(snapshot["vectors"][rows], dtype=np.float32)
+                if "embeddings" in include and len(rows) else None
+            ),
+            "metadatas": [snapshot["metadatas"][row] for row in rows] if "metadatas" in include else None
+        }
+
+    def _probe_rows(self, snapshot: Dict, query: np.ndarray, mask: np.ndarray, n_results: int):
+        """Rows of the query's nearest IVF lists that pass the mask; None to search every row"""
+        centroids = snapshot["centroids"]
+        if centroids is None:
+            return None
+        probes = np.argsort(-(centroids @ query))[:self.ivf_probes]
+        rows = np.flatnonzero(mask & np.isin(snapshot["assignments"], probes))
+        # Narrow filters can leave the probed lists short; fall back to exact search then
+        return rows if len(rows) >= n_results else None
+
+    def query(self, query_embeddings, n_results: int = 10, where: Dict = None,
+              include: List[str] = ("metadatas", "distances"), **kwargs) -> Dict:
+        snapshot = self._snapshot()
+        results = self._search(snapshot, _normalize(query_embeddings), n_results, where)
+        return {
+            "ids": [[snapshot["ids"][row] for row in rows] for rows, _ in results],
+            "distances": [(1.0 - scores).tolist() for _, scores in results] if "distances" in include else None,
+            "metadatas": (
+                [[snapshot["metadatas"][row] for row in rows] for rows, _ in results]
+                if "metadatas" in include else None
+            ),
+            "embeddings": None
+        }
+
+    def _search(self, snapshot: Dict, queries: np.ndarray, n_results: int, where: Optional[Dict],
+                exact: bool = False, rerank_factor: int = RERANK_FACTOR) -> List:
+        """(rows, scores) per query, best first; `exact` ignores the quantizer and the codec"""
+        mask = self._mask(snapshot, where)
+        vectors, count = snapshot["vectors"], snapshot["count"]
+        codec = None if exact else snapshot["codec"]
+
+        results = []
+        full_scan = []
+        for i, query in enumerate(queries):
+            rows = None if exact else self._probe_rows(snapshot, query, mask, n_results)
+            if codec is not None:
+                if rows is None:
+                    rows = np.flatnonzero(mask)
+                # Approximate scores from the codes pick a shortlist to score exactly
+                approx = codec.scores(codec.tables(query), snapshot["codes"][rows])
+                shortlist = np.sort(np.asarray(
+                    self._top_k(approx, rows, n_results * rerank_factor)[0], dtype=np.int64
+                ))
+                scores = np.asarray(vectors[shortlist], dtype=np.float32) @ query
+                results.append(self._top_k(scores, shortlist, n_results))
+            elif rows is not None:
+                scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+                results.append(self._top_k(scores, rows, n_results))
+            else:
+                full_scan.append(i)
+                results.append(None)
+
+        if full_scan:
+            # Every query that needs a full scan shares one pass over the matrix
+            best_scores = np.full((len(full_scan), 0), -np.inf, dtype=np.float32)
+            best_rows = np.zeros((len(full_scan), 0), dtype=np.int64)
+            for start in range(0, count, SEARCH_BLOCK_ROWS):
+                stop = min(start + SEARCH_BLOCK_ROWS, count)
+                block_mask = mask[start:stop]
+                if not block_mask.any():
+                    continue
+                scores = queries[full_scan] @ np.asarray(vectors[start:stop], dtype=np.float32).T
+                scores[:, ~block_mask] = -np.inf
+                scores = np.concatenate([best_scores, scores], axis=1)
+                rows = np.concatenate(
+                    [best_rows, np.broadcast_to(np.arange(start, stop), (len(full_scan), stop - start))], axis=1
+                )
+                keep = min(n_results, scores.shape[1])
+                top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+                best_scores = np.take_along_axis(scores, top, axis=1)
+                best_rows = np.take_along_axis(rows, top, axis=1)
+            for position, i in enumerate(full_scan):
+                results[i] = self._top_k(best_scores[position], best_rows[position], n_results)
+        return results
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, rows: np.ndarray, k: int):
+        """(rows, scores) of the best `k` finite scores, best first"""
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            scores, rows = scores[top], rows[top]
+        order = np.argsort(-scores, kind="stable")
+        scores, rows = scores[order], rows[order]
+        finite = np.isfinite(scores)
+        return rows[finite].tolist(), scores[finite]
+
+class NumpyVectorStore:
+    """Client over a directory with one subdirectory per NumpyCollection"""
+
+    def __init__(self, path: str = VECTOR_INDEX_DIR):
+        self.path = path
+        self._collections = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def get_or_create_collection(self, name: str, **kwargs) -> NumpyCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = NumpyCollection(os.path.join(self.path, name))
+            return self._collections[name]
+
+    def get_collection(self, name: str, **kwargs) -> NumpyCollection:
+        if name not in self.list_collections():
+            raise ValueError(f"Collection {name} does not exist")
+        return self.get_or_create_collection(name)
+
+    def list_collections(self) -> List[str]:
+        return sorted(
+            name for name in os.listdir(self.path)
+            if os.path.isdir(os.path.join(self.path, name))
+        )
+
+    def delete_collection(self, name: str):
+        with self._lock:
+            self._collections.pop(name, None)
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the embedded numpy vector collections")
+    parser.add_argument("--compact", action="store_true", help="Drop deleted rows from every collection")
+    parser.add_argument("--train-ivf", action="store_true", help="(Re)train every collection's coarse quantizer")
+    parser.add_argument("--lists", type=int, default=IVF_LISTS or 256)
+    parser.add_argument("--train-pq", action="store_true", help="Train a compression codec for every collection")
+    parser.add_argument("--drop-pq", action="store_true", help="Remove the compression codecs")
+    parser.add_argument("--subspaces", type=int, default=PQ_SUBSPACES, help="Bytes per compressed vector")
+    parser.add_argument("--pca-dim", type=int, default=None, help="Reduce to this many dimensions before PQ")
+    parser.add_argument("--recall-report", action="store_true", help="Recall@k of compressed vs exact search")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    store = NumpyVectorStore(VECTOR_INDEX_DIR)
+    for name in store.list_collections():
+        collection = store.get_or_create_collection(name)
+        if args.compact:
+            collection.compact()
+        if args.train_ivf:
+            collection.train_ivf(args.lists)
+        if args.drop_pq:
+            collection.drop_compression()
+        if args.train_pq:
+            print(json.dumps(collection.train_compression(args.subspaces, args.pca_dim), indent=2))
+        if args.recall_report:
+            print(json.dumps(collection.recall_report(args.k), indent=2))
+        print(f"{name}: {collection.count()} vectors")